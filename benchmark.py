@@ -0,0 +1,72 @@
+import argparse
+import importlib
+import time
+
+from simulator import GameSimulator, PlayStats, SimulatorConfig, play_level, play_level_planned
+from vision import VisionConfig
+
+# 各模块自带的性能测试，通过 --all 一并运行
+MODULE_BENCHMARKS = [
+    "log",
+    "data_struct",
+    "config",
+    "text_layout",
+    "draw",
+    "press",
+    "input_backend",
+    "input_filter",
+    "metrics",
+    "executor",
+    "vision",
+    "tracker",
+    "capture",
+    "motion",
+    "vision_worker",
+    "calibration",
+    "journal",
+    "replay",
+    "sweep",
+    "tracing",
+    "startup",
+]
+
+
+def run_simulation(levels: int, use_vision: bool, adjustment_coefficient=1.5, planned=False):
+    # planned 为 True 时一次规划画面中所有可见平台的跳跃，落地后仅在偏差过大时重新规划
+    cfg = SimulatorConfig()
+    vision_cfg = VisionConfig() if use_vision else None
+    play = play_level_planned if planned else play_level
+
+    stats = PlayStats()
+    for seed in range(levels):
+        cfg.seed = seed
+        play(GameSimulator(cfg), adjustment_coefficient, stats, cfg.speed_x_per_second, vision_cfg)
+
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="在模拟器中端到端地运行整个跳跃流程，并统计吞吐、落地准确率以及各阶段耗时")
+    parser.add_argument("--levels", type=int, default=20, help="直接使用真实坐标时模拟的关卡数")
+    parser.add_argument("--vision-levels", type=int, default=3, help="通过渲染画面并识别坐标时模拟的关卡数")
+    parser.add_argument("--all", action="store_true", help="同时运行各模块自带的性能测试")
+    args = parser.parse_args()
+
+    for planned, mode in [(False, "逐跳规划"), (True, "多跳规划")]:
+        print("=" * 20 + f" 模拟器: 使用真实坐标，{mode} " + "=" * 20)
+        print(run_simulation(args.levels, False, planned=planned).summary())
+
+        if args.vision_levels > 0:
+            print("=" * 20 + f" 模拟器: 渲染画面并识别坐标，{mode} " + "=" * 20)
+            print(run_simulation(args.vision_levels, True, planned=planned).summary())
+
+    if args.all:
+        for module_name in MODULE_BENCHMARKS:
+            print("=" * 20 + f" {module_name} " + "=" * 20)
+            start = time.perf_counter()
+            importlib.import_module(module_name).benchmark()
+            print(f"({module_name} 耗时 {time.perf_counter() - start:.1f}秒)")
+
+
+if __name__ == '__main__':
+    main()
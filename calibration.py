@@ -0,0 +1,214 @@
+from __future__ import annotations
+
+import math
+import os.path
+from typing import Dict, List, Optional, Tuple
+
+from data_struct import ConfigInterface
+from vision import Detection
+
+
+class CalibrationConfig(ConfigInterface):
+    def __init__(self):
+        # 是否根据每次跳跃的实际落点自动修正系数
+        self.enabled = True
+        # 递推最小二乘的遗忘因子，越小越偏向最近的跳跃，能更快适应变化，但也更容易受噪声影响
+        self.forgetting_factor = 0.98
+        # 新建估计时系数的初始方差，越大则最初几次跳跃对系数的影响越大
+        self.initial_variance = 1.0
+        # 是否按照跳跃距离分段估计系数，各段之间线性插值，而不是整体只用一个系数
+        self.use_distance_buckets = True
+        # 每段的宽度（像素）
+        self.bucket_width = 100
+        # 某段至少有这么多次跳跃后才使用该段的系数，否则使用整体的系数
+        self.min_bucket_samples = 3
+        # 距离过近的跳跃误差占比太大，不参与修正
+        self.min_delta_x = 30
+        # 落点偏差超过 跳跃距离 的该比例时，认为是识别错误，不参与修正
+        self.max_offset_ratio = 0.5
+        # 修正后系数的合理范围
+        self.min_coefficient = 0.5
+        self.max_coefficient = 5.0
+
+
+class RlsEstimate(ConfigInterface):
+    # 单个系数的递推最小二乘估计：按压时长 = 系数 * 实际跳跃距离 / 实际速度
+    # 按距离分段时会有很多个，使用 __slots__ 减少内存占用
+    __slots__ = ("coefficient", "variance", "samples")
+
+    def __init__(self, coefficient=1.5, variance=1.0):
+        self.coefficient = coefficient
+        self.variance = variance
+        self.samples = 0
+
+    def update(self, regressor: float, press_seconds: float, forgetting_factor: float):
+        gain = self.variance * regressor / (forgetting_factor + regressor * self.variance * regressor)
+        self.coefficient += gain * (press_seconds - regressor * self.coefficient)
+        self.variance = (self.variance - gain * regressor * self.variance) / forgetting_factor
+        self.samples += 1
+
+
+class CalibrationModel(ConfigInterface):
+    # 保存到 config.json 旁边的 calibration.json 中，下次启动时继续使用
+    def __init__(self):
+        self.overall = RlsEstimate()
+        # 按距离分段的估计，key 为段的下标
+        self.buckets: Dict[str, RlsEstimate] = {}
+
+    def dict_fields_to_fill(self) -> list[tuple[str, type[ConfigInterface]]]:
+        return [("buckets", RlsEstimate)]
+
+
+class Calibrator:
+    # 根据每次跳跃的 (X差值, 弹跳力, 按压时长, 实际落点偏差) 在线修正系数
+    def __init__(self, cfg: CalibrationConfig, model: Optional[CalibrationModel] = None, speed_x_per_second: float = 300, base_bounce_force: int = 100):
+        self.cfg = cfg
+        self.model = model or CalibrationModel()
+        self.speed_x_per_second = speed_x_per_second
+        self.base_bounce_force = base_bounce_force
+
+    def reset(self, coefficient: float):
+        # 手动设置系数后，以其为初始值重新开始估计
+        self.model = CalibrationModel()
+        self.model.overall = RlsEstimate(coefficient, self.cfg.initial_variance)
+
+    def bucket_index(self, delta_x: float) -> int:
+        return int(math.fabs(delta_x) // max(1, self.cfg.bucket_width))
+
+    def record(self, delta_x: float, bounce_force: int, press_seconds: float, offset: float, speed_x_per_second: Optional[float] = None) -> bool:
+        # offset 为实际落点减去目标点的X坐标，speed_x_per_second 为计算按压时长时该弹跳力所用的x速度，返回本次数据是否被用于修正
+        cfg = self.cfg
+        traveled = delta_x + offset
+        if math.fabs(delta_x) < cfg.min_delta_x or math.fabs(offset) > cfg.max_offset_ratio * math.fabs(delta_x) or traveled * delta_x <= 0:
+            return False
+
+        actual_speed = (speed_x_per_second or self.speed_x_per_second) * bounce_force / self.base_bounce_force
+        regressor = math.fabs(traveled) / actual_speed
+
+        self.model.overall.update(regressor, press_seconds, cfg.forgetting_factor)
+
+        if cfg.use_distance_buckets:
+            key = str(self.bucket_index(traveled))
+            if key not in self.model.buckets:
+                # 新的分段以当前整体的系数为初始值
+                self.model.buckets[key] = RlsEstimate(self.model.overall.coefficient, cfg.initial_variance)
+            self.model.buckets[key].update(regressor, press_seconds, cfg.forgetting_factor)
+
+        return True
+
+    def coefficient_for(self, delta_x: float) -> float:
+        cfg = self.cfg
+        coefficient = self.model.overall.coefficient
+
+        if cfg.use_distance_buckets:
+            points = self.bucket_points()
+            if len(points) > 0:
+                coefficient = interpolate(points, math.fabs(delta_x))
+
+        return min(cfg.max_coefficient, max(cfg.min_coefficient, coefficient))
+
+    def bucket_points(self) -> List[Tuple[float, float]]:
+        # 样本足够的各段的 (中心距离, 系数)，按距离排序
+        width = max(1, self.cfg.bucket_width)
+        return sorted(
+            ((int(key) + 0.5) * width, estimate.coefficient)
+            for key, estimate in self.model.buckets.items()
+            if estimate.samples >= self.cfg.min_bucket_samples
+        )
+
+    def summary(self) -> str:
+        overall = self.model.overall
+        buckets = " ".join(f"{center:.0f}px={coefficient:.3f}" for center, coefficient in self.bucket_points())
+        return f"整体系数={overall.coefficient:.4f} 样本数={overall.samples} 分段系数=[{buckets}]"
+
+
+def interpolate(points: List[Tuple[float, float]], x: float) -> float:
+    # 分段线性插值，超出两端时使用端点的值
+    if x <= points[0][0]:
+        return points[0][1]
+    for (x0, y0), (x1, y1) in zip(points, points[1:]):
+        if x <= x1:
+            return y0 + (y1 - y0) * (x - x0) / (x1 - x0)
+    return points[-1][1]
+
+
+def observe_landing_offset(previous: Detection, current: Detection, max_platform_shift=3) -> Optional[float]:
+    # 根据跳跃前后两次识别结果计算实际落点与目标点的偏差
+    # 仅当上次的目标平台在画面中的位置没有变化（镜头没有移动）且角色站在它上面时才能得出
+    target = None
+    for platform in previous.platforms:
+        if platform.left <= previous.end_position.x <= platform.right:
+            target = platform
+            break
+    if target is None:
+        return None
+
+    for platform in current.platforms:
+        if math.fabs(platform.left - target.left) <= max_platform_shift and math.fabs(platform.right - target.right) <= max_platform_shift and platform.top == target.top:
+            if platform.left <= current.start_position.x <= platform.right:
+                return current.start_position.x - previous.end_position.x
+            return None
+
+    return None
+
+
+def calibration_path(config_path: str) -> str:
+    return os.path.join(os.path.dirname(config_path), "calibration.json")
+
+
+def load_model(path: str) -> CalibrationModel:
+    model = CalibrationModel()
+    if os.path.isfile(path):
+        model.load_from_json_file(path)
+    return model
+
+
+def benchmark(levels=10, true_coefficient=1.65, press_slope=0.05):
+    # 在模拟器中验证收敛速度：游戏实际系数与初始系数 1.5 不同，且随按压时长略有变化
+    # 对比 固定系数、单一系数的在线修正、分段系数的在线修正 三种方式的落地率、收敛后的落点偏差，以及系数误差首次小于 2% 所需的跳跃次数
+    # 实际游戏中只有落地后才能观察到落点，因此初始系数偏差过大、一直跳不上时无法修正，此时仍需手动调整
+    import numpy as np
+
+    from simulator import GameSimulator, PlayStats, SimulatorConfig, play_level
+
+    sim_cfg = SimulatorConfig()
+
+    for name, use_buckets, press_slope_value in [
+        ("固定系数 1.5", None, 0.0),
+        ("单一系数修正", False, 0.0),
+        ("分段系数修正", True, 0.0),
+        ("固定系数 1.5 (系数随按压时长变化)", None, press_slope),
+        ("单一系数修正 (系数随按压时长变化)", False, press_slope),
+        ("分段系数修正 (系数随按压时长变化)", True, press_slope),
+    ]:
+        # 系数随按压时长变化时，使其在平均按压时长（约1.5秒）处仍等于 true_coefficient
+        sim_cfg.game_coefficient = true_coefficient - press_slope_value * 1.5
+        sim_cfg.game_coefficient_per_press_second = press_slope_value
+
+        calibrator = None
+        if use_buckets is not None:
+            cfg = CalibrationConfig()
+            cfg.use_distance_buckets = use_buckets
+            calibrator = Calibrator(cfg)
+            calibrator.reset(1.5)
+
+        stats = PlayStats()
+        converged_at = None
+        for seed in range(levels):
+            sim_cfg.seed = seed
+            play_level(GameSimulator(sim_cfg), 1.5, stats, sim_cfg.speed_x_per_second, calibrator=calibrator)
+
+            if calibrator is not None and converged_at is None:
+                for index, error in enumerate(stats.coefficient_errors):
+                    if error < 0.02:
+                        converged_at = index + 1
+                        break
+
+        line = f"{name}: 跳跃次数={stats.jumps} 落地率={stats.landed / max(1, stats.jumps):.1%} 后半段平均偏差={np.mean(stats.abs_offsets[len(stats.abs_offsets) // 2:]):.2f}px"
+        if calibrator is not None:
+            line += f" 系数误差首次小于2%时的跳跃次数={converged_at} {calibrator.summary()}"
+        print(line)
+
+
+if __name__ == '__main__':
+    benchmark()
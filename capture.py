@@ -0,0 +1,341 @@
+import ctypes
+import glob
+import os
+import threading
+import time
+import tracemalloc
+from abc import ABCMeta, abstractmethod
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from data_struct import ConfigInterface
+from vision import Box, load_frame
+
+CAPTURE_BACKEND_WIN32 = "win32"
+CAPTURE_BACKEND_REPLAY = "replay"
+
+
+class CaptureConfig(ConfigInterface):
+    def __init__(self):
+        # 截图方式，win32 为截取屏幕，replay 为依次回放目录中保存的画面（png或npy）
+        self.backend = CAPTURE_BACKEND_WIN32
+        # 仅截取标题中包含该内容的窗口，为空时截取整个主屏幕
+        self.window_title = "地下城与勇士"
+        # 回放模式下画面所在的目录，npy 文件应为截图缓冲区原样保存的 HxWx4 BGRA 数组，png 则为普通截图
+        self.replay_directory = ""
+        # 预先分配的画面缓冲区数目，截图结果在被之后第 ring_size 次截图覆盖前均可安全使用
+        self.ring_size = 3
+
+
+class CaptureBackend(metaclass=ABCMeta):
+    @abstractmethod
+    def locate_region(self) -> Optional[Box]:
+        # 返回需要截取的区域（屏幕坐标），找不到时返回None
+        pass
+
+    @abstractmethod
+    def grab_into(self, buffer: np.ndarray, region: Box) -> bool:
+        # 将区域内的画面以 BGRA 格式就地写入 buffer（HxWx4，行连续），返回是否成功
+        pass
+
+    def close(self):
+        return
+
+
+class FrameRing:
+    # 预先分配的环形画面缓冲区，避免每次截图都重新分配内存
+    def __init__(self, size: int):
+        self.size = max(1, size)
+        self.buffers: Optional[np.ndarray] = None
+        self.index = 0
+
+    def next_buffer(self, width: int, height: int) -> np.ndarray:
+        if self.buffers is None or self.buffers.shape[1:3] != (height, width):
+            # 仅在截图区域的尺寸变化时重新分配
+            self.buffers = np.empty((self.size, height, width, 4), dtype=np.uint8)
+            self.index = 0
+
+        buffer = self.buffers[self.index]
+        self.index = (self.index + 1) % self.size
+        return buffer
+
+
+class FixedFrameRing(FrameRing):
+    # 使用外部提供的固定大小内存（如共享内存）作为缓冲区，每个槽位最多容纳 slot_bytes 字节的画面
+    def __init__(self, size: int, backing: np.ndarray, slot_bytes: int):
+        super().__init__(size)
+        self.backing = backing
+        self.slot_bytes = slot_bytes
+
+        # 最近一次返回的槽位下标
+        self.last_slot = -1
+
+    def next_buffer(self, width: int, height: int) -> np.ndarray:
+        if width * height * 4 > self.slot_bytes:
+            raise ValueError(f"截图区域 {width}x{height} 超出了缓冲区的大小 {self.slot_bytes}")
+
+        # 每个槽位从头开始按实际尺寸排列，保证各行在内存中连续
+        slot = self.index
+        self.index = (self.index + 1) % self.size
+        self.last_slot = slot
+
+        start = slot * self.slot_bytes
+        return self.backing[start:start + width * height * 4].reshape(height, width, 4)
+
+
+class ScreenCapture:
+    def __init__(self, backend: CaptureBackend, ring_size=3, ring: Optional[FrameRing] = None):
+        self.backend = backend
+        self.ring = ring or FrameRing(ring_size)
+
+        # 最近一次截图的区域，用于将画面中的坐标转换为屏幕坐标
+        self.last_region: Optional[Box] = None
+
+        # 落地检测与自动识别可能在不同线程中截图
+        self.lock = threading.Lock()
+
+    def grab(self) -> Optional[np.ndarray]:
+        # 返回 HxWx3 的 RGB 画面，为缓冲区的视图（不会复制），在被之后第 ring_size 次截图覆盖前均可安全使用
+        with self.lock:
+            region = self.backend.locate_region()
+            if region is None:
+                return None
+
+            buffer = self.ring.next_buffer(region.right - region.left + 1, region.bottom - region.top + 1)
+            if not self.backend.grab_into(buffer, region):
+                return None
+
+            self.last_region = region
+            return bgra_to_rgb_view(buffer)
+
+    def close(self):
+        self.backend.close()
+
+
+def bgra_to_rgb_view(buffer: np.ndarray) -> np.ndarray:
+    # 通过负步长的切片得到 RGB 通道顺序的视图，不复制数据
+    return buffer[..., 2::-1]
+
+
+def rgb_to_bgra(frame: np.ndarray) -> np.ndarray:
+    bgra = np.empty((frame.shape[0], frame.shape[1], 4), dtype=np.uint8)
+    bgra[..., 2::-1] = frame[..., :3]
+    bgra[..., 3] = 255
+    return bgra
+
+
+class BITMAPINFOHEADER(ctypes.Structure):
+    _fields_ = [
+        ("biSize", ctypes.c_uint32),
+        ("biWidth", ctypes.c_int32),
+        ("biHeight", ctypes.c_int32),
+        ("biPlanes", ctypes.c_uint16),
+        ("biBitCount", ctypes.c_uint16),
+        ("biCompression", ctypes.c_uint32),
+        ("biSizeImage", ctypes.c_uint32),
+        ("biXPelsPerMeter", ctypes.c_int32),
+        ("biYPelsPerMeter", ctypes.c_int32),
+        ("biClrUsed", ctypes.c_uint32),
+        ("biClrImportant", ctypes.c_uint32),
+    ]
+
+
+class BITMAPINFO(ctypes.Structure):
+    _fields_ = [
+        ("bmiHeader", BITMAPINFOHEADER),
+        ("bmiColors", ctypes.c_uint32 * 3),
+    ]
+
+
+class Win32CaptureBackend(CaptureBackend):
+    # 通过 BitBlt 截取屏幕，并用 GetDIBits 直接写入 numpy 缓冲区的内存中
+    SRCCOPY = 0x00CC0020
+    DIB_RGB_COLORS = 0
+    BI_RGB = 0
+
+    def __init__(self, window_title=""):
+        self.window_title = window_title
+
+        self.user32 = ctypes.windll.user32
+        self.gdi32 = ctypes.windll.gdi32
+        for func in [self.user32.GetDC, self.gdi32.CreateCompatibleDC, self.gdi32.CreateCompatibleBitmap, self.gdi32.SelectObject]:
+            func.restype = ctypes.c_void_p
+        self.gdi32.CreateCompatibleDC.argtypes = [ctypes.c_void_p]
+        self.gdi32.CreateCompatibleBitmap.argtypes = [ctypes.c_void_p, ctypes.c_int, ctypes.c_int]
+        self.gdi32.SelectObject.argtypes = [ctypes.c_void_p, ctypes.c_void_p]
+        self.gdi32.DeleteObject.argtypes = [ctypes.c_void_p]
+        self.gdi32.DeleteDC.argtypes = [ctypes.c_void_p]
+        self.user32.ReleaseDC.argtypes = [ctypes.c_void_p, ctypes.c_void_p]
+        self.gdi32.BitBlt.argtypes = [ctypes.c_void_p, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_void_p, ctypes.c_int, ctypes.c_int, ctypes.c_uint32]
+        self.gdi32.GetDIBits.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_uint, ctypes.c_uint, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_uint]
+
+        self.screen_dc = self.user32.GetDC(None)
+        self.memory_dc = self.gdi32.CreateCompatibleDC(self.screen_dc)
+        self.bitmap = None
+        self.bitmap_size = (0, 0)
+
+        self.bitmap_info = BITMAPINFO()
+        self.bitmap_info.bmiHeader.biSize = ctypes.sizeof(BITMAPINFOHEADER)
+        self.bitmap_info.bmiHeader.biPlanes = 1
+        self.bitmap_info.bmiHeader.biBitCount = 32
+        self.bitmap_info.bmiHeader.biCompression = self.BI_RGB
+
+    def locate_region(self) -> Optional[Box]:
+        if self.window_title == "":
+            width, height = self.user32.GetSystemMetrics(0), self.user32.GetSystemMetrics(1)
+            return Box(0, 0, width - 1, height - 1)
+
+        import win32gui
+
+        hwnds = []
+
+        def collect(hwnd, _):
+            if win32gui.IsWindowVisible(hwnd) and self.window_title in win32gui.GetWindowText(hwnd):
+                hwnds.append(hwnd)
+
+        win32gui.EnumWindows(collect, None)
+        if len(hwnds) == 0:
+            return None
+
+        _, _, width, height = win32gui.GetClientRect(hwnds[0])
+        left, top = win32gui.ClientToScreen(hwnds[0], (0, 0))
+        if width <= 0 or height <= 0:
+            return None
+
+        return Box(left, top, left + width - 1, top + height - 1)
+
+    def grab_into(self, buffer: np.ndarray, region: Box) -> bool:
+        height, width = buffer.shape[:2]
+        if self.bitmap_size != (width, height):
+            if self.bitmap is not None:
+                self.gdi32.DeleteObject(self.bitmap)
+            self.bitmap = self.gdi32.CreateCompatibleBitmap(self.screen_dc, width, height)
+            self.gdi32.SelectObject(self.memory_dc, self.bitmap)
+            self.bitmap_size = (width, height)
+
+            self.bitmap_info.bmiHeader.biWidth = width
+            # 高度为负数表示自上而下的行顺序，与numpy数组一致
+            self.bitmap_info.bmiHeader.biHeight = -height
+
+        if not self.gdi32.BitBlt(self.memory_dc, 0, 0, width, height, self.screen_dc, region.left, region.top, self.SRCCOPY):
+            return False
+
+        lines = self.gdi32.GetDIBits(self.memory_dc, self.bitmap, 0, height, buffer.ctypes.data, ctypes.byref(self.bitmap_info), self.DIB_RGB_COLORS)
+        return lines == height
+
+    def close(self):
+        if self.bitmap is not None:
+            self.gdi32.DeleteObject(self.bitmap)
+            self.bitmap = None
+        self.gdi32.DeleteDC(self.memory_dc)
+        self.user32.ReleaseDC(None, self.screen_dc)
+
+
+class ReplayCaptureBackend(CaptureBackend):
+    # 依次回放目录中保存的画面（按文件名排序的png或npy），用于在没有显示器的环境中运行整个流程
+    def __init__(self, directory: str, loop=True):
+        self.paths = sorted(glob.glob(os.path.join(directory, "*.png")) + glob.glob(os.path.join(directory, "*.npy")))
+        self.loop = loop
+        self.index = 0
+
+        # BGRA 格式的画面，BGRA 的 npy 通过内存映射读取，其余在首次使用时解码并转换一次
+        self.frames: Dict[str, np.ndarray] = {}
+
+    @classmethod
+    def from_frames(cls, frames: List[np.ndarray], loop=True):
+        backend = cls("", loop)
+        backend.paths = [str(index) for index in range(len(frames))]
+        backend.frames = {str(index): rgb_to_bgra(frame) for index, frame in enumerate(frames)}
+        return backend
+
+    def current_frame(self) -> Optional[np.ndarray]:
+        if self.index >= len(self.paths):
+            if not self.loop or len(self.paths) == 0:
+                return None
+            self.index = 0
+
+        path = self.paths[self.index]
+        if path not in self.frames:
+            if path.endswith(".npy"):
+                frame = np.load(path, mmap_mode="r")
+                self.frames[path] = frame if frame.shape[2] == 4 else rgb_to_bgra(frame)
+            else:
+                self.frames[path] = rgb_to_bgra(load_frame(path))
+
+        return self.frames[path]
+
+    def locate_region(self) -> Optional[Box]:
+        frame = self.current_frame()
+        if frame is None:
+            return None
+
+        return Box(0, 0, frame.shape[1] - 1, frame.shape[0] - 1)
+
+    def grab_into(self, buffer: np.ndarray, region: Box) -> bool:
+        frame = self.current_frame()
+        if frame is None:
+            return False
+        self.index += 1
+
+        np.copyto(buffer, frame[region.top:region.bottom + 1, region.left:region.right + 1])
+        return True
+
+
+def create_capture(cfg: CaptureConfig, ring: Optional[FrameRing] = None) -> ScreenCapture:
+    if cfg.backend == CAPTURE_BACKEND_REPLAY:
+        backend: CaptureBackend = ReplayCaptureBackend(cfg.replay_directory)
+    else:
+        backend = Win32CaptureBackend(cfg.window_title)
+
+    return ScreenCapture(backend, cfg.ring_size, ring)
+
+
+def benchmark(frames_directory="", grabs=200):
+    # 对比 复用环形缓冲区 与 每次截图新分配数组 的耗时和内存分配量，并在截图结果上运行增量跟踪
+    from tracker import RegionTracker, synthetic_frames
+    from vision import VisionConfig
+
+    cfg = VisionConfig()
+    if frames_directory != "":
+        backend = ReplayCaptureBackend(frames_directory)
+    else:
+        backend = ReplayCaptureBackend.from_frames(synthetic_frames(20, cfg))
+
+    def measure(grab) -> Tuple[float, float]:
+        tracemalloc.start()
+        start = time.perf_counter()
+        for _ in range(grabs):
+            grab()
+        cost = (time.perf_counter() - start) / grabs
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return cost, peak
+
+    def naive_grab():
+        region = backend.locate_region()
+        buffer = np.empty((region.bottom - region.top + 1, region.right - region.left + 1, 4), dtype=np.uint8)
+        backend.grab_into(buffer, region)
+        return buffer[..., 2::-1].copy()
+
+    naive_cost, naive_peak = measure(naive_grab)
+
+    capture = ScreenCapture(backend)
+    capture.grab()
+    ring_cost, ring_peak = measure(capture.grab)
+
+    tracker = RegionTracker(cfg)
+    start = time.perf_counter()
+    for _ in range(grabs):
+        tracker.track(capture.grab())
+    pipeline_cost = (time.perf_counter() - start) / grabs
+
+    print(f"每次新分配: 单次截图 {naive_cost * 1000:.2f}ms，内存峰值 {naive_peak / 1024 / 1024:.1f}MB")
+    print(f"环形缓冲区: 单次截图 {ring_cost * 1000:.2f}ms，内存峰值 {ring_peak / 1024 / 1024:.1f}MB")
+    print(f"截图+增量跟踪: 单帧 {pipeline_cost * 1000:.2f}ms，{tracker.summary()}")
+
+
+if __name__ == '__main__':
+    import sys
+
+    benchmark(sys.argv[1] if len(sys.argv) > 1 else "")
@@ -0,0 +1,41 @@
+import time
+
+
+class Clock:
+    # 真实时钟，所有需要计时与等待的地方都通过时钟进行，便于在模拟与回放时替换为虚拟时钟
+    virtual = False
+
+    def perf_counter_ns(self) -> int:
+        return time.perf_counter_ns()
+
+    def sleep(self, seconds: float):
+        time.sleep(seconds)
+
+    def spin_until(self, deadline_ns: int):
+        # 自旋等待到指定时间点
+        while time.perf_counter_ns() < deadline_ns:
+            pass
+
+
+class VirtualClock(Clock):
+    # 虚拟时钟，等待时直接将时间向前推进，使得模拟与回放能以远快于真实时间的速度运行
+    virtual = True
+
+    def __init__(self, start_ns=0):
+        self.now_ns = start_ns
+
+    def perf_counter_ns(self) -> int:
+        return self.now_ns
+
+    def sleep(self, seconds: float):
+        self.advance(int(seconds * 1_000_000_000))
+
+    def spin_until(self, deadline_ns: int):
+        self.now_ns = max(self.now_ns, deadline_ns)
+
+    def advance(self, delta_ns: int):
+        self.now_ns += max(0, delta_ns)
+
+
+# 默认使用的真实时钟
+real_clock = Clock()
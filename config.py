@@ -0,0 +1,201 @@
+import json
+import os.path
+import threading
+import time
+from typing import Dict, Optional
+
+from calibration import CalibrationConfig
+from capture import CaptureConfig
+from data_struct import ConfigInterface, to_raw_type, write_text_atomically
+from input_filter import InputFilterConfig
+from journal import JournalConfig
+from log import logger
+from metrics import MetricsConfig
+from motion import MotionConfig
+from planner import PlannerConfig
+from vision import VisionConfig
+
+
+class Config(ConfigInterface):
+    def __init__(self):
+        # 由于实际分辨率问题，按照像素计算出来，可能与实际的有区别，这里用一个系数自行调整，使其能恰好跳到目标点
+        # 如果跳的过远，就把这个数值调小点。太近了，则调大，直到找到一个在当前设置下比较合适的数目
+        self.adjustment_coefficient = 1.5
+        # 游戏中设定的x速度，可按弹跳力（key 为弹跳力）分别设置，未设置的弹跳力使用 speed_x_per_second，可通过 sweep.py 搜索合适的数值
+        self.speed_x_per_second = 300
+        self.speed_x_per_second_by_bounce_force: Dict[str, float] = {}
+        # 根据自动跳跃的实际落点在线修正系数，手动调整系数后会以新的系数为初始值重新修正
+        self.calibration = CalibrationConfig()
+
+        # 自动识别起点和终点所使用的配置
+        self.vision = VisionConfig()
+        self.capture = CaptureConfig()
+        # 落地检测所使用的配置
+        self.motion = MotionConfig()
+        # 跳跃记录所使用的配置
+        self.journal = JournalConfig()
+        # 一次规划多跳所使用的配置
+        self.planner = PlannerConfig()
+        # 是否将本次运行的输入事件与识别结果记录到配置文件旁边的 sessions 目录中，之后可通过 replay.py 回放
+        self.record_session = True
+        # 读取鼠标位置与按下、松开鼠标所使用的实现：auto、pynput、sendinput（uinput 与 recording 仅用于测试，不可在此使用），退出时会输出每次调用的耗时，可通过 python input_backend.py --all 对比
+        self.input_backend = "auto"
+        # 键盘监听回调中过滤按键所使用的配置
+        self.input_filter = InputFilterConfig()
+        # 本机统计数据接口所使用的配置
+        self.metrics = MetricsConfig()
+
+    def speed_for(self, bounce_force: int) -> float:
+        return self.speed_x_per_second_by_bounce_force.get(str(bounce_force), self.speed_x_per_second)
+
+
+def load_config() -> Config:
+    cfg = Config()
+    cfg.load_from_json_file(config_path())
+    return cfg
+
+
+class ConfigSaver:
+    # 在后台线程中保存配置与修正模型，save 仅在调用方线程中记下要保存的内容，不会因写文件阻塞键盘事件循环
+    # 短时间内多次保存同一文件时合并为一次，仅写入最后的内容；内容与文件中已有的完全相同时不重写
+    def __init__(self, coalesce_seconds=0.5):
+        self.coalesce_seconds = coalesce_seconds
+
+        # 文件路径 -> 最近一次要求保存的内容
+        self.pending: Dict[str, object] = {}
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopping = False
+        self.thread: Optional[threading.Thread] = None
+
+        # 文件路径 -> 最近一次写入或读取到的文件内容
+        self.saved_texts: Dict[str, str] = {}
+
+        self.requested = 0
+        self.written = 0
+        self.skipped = 0
+
+    def start(self):
+        if self.thread is not None:
+            return
+
+        self.stopping = False
+        self.thread = threading.Thread(target=self.run, name="ConfigSaver", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.thread is None:
+            return
+
+        self.stopping = True
+        self.wakeup.set()
+        self.thread.join()
+        self.thread = None
+
+    def save(self, cfg: ConfigInterface, filepath: str):
+        # 在调用方线程中转换为基础类型，保证写入的是调用时的内容，之后调用方可以继续修改配置
+        raw = to_raw_type(cfg)
+        with self.lock:
+            self.pending[filepath] = raw
+            self.requested += 1
+        self.wakeup.set()
+
+    def run(self):
+        while not self.stopping:
+            self.wakeup.wait()
+            self.wakeup.clear()
+            # 等待一小段时间，让连续的多次保存合并为一次写入，停止时不再等待
+            if not self.stopping:
+                time.sleep(self.coalesce_seconds)
+            self.flush()
+
+        self.flush()
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+
+        for filepath, raw in pending.items():
+            text = json.dumps(raw, ensure_ascii=False, indent=2)
+            if text == self.saved_text(filepath):
+                self.skipped += 1
+                continue
+
+            try:
+                make_sure_dir_exists(os.path.dirname(filepath))
+                write_text_atomically(filepath, text)
+            except OSError as e:
+                # 文件可能被其他程序短暂占用，保留内容，下次保存时再重试（期间有更新的内容时以新的为准）
+                logger.warning(f"保存 {filepath} 失败，将在下次保存时重试: {e}")
+                with self.lock:
+                    self.pending.setdefault(filepath, raw)
+                continue
+
+            self.saved_texts[filepath] = text
+            self.written += 1
+
+    def saved_text(self, filepath: str) -> Optional[str]:
+        # 首次保存某个文件时读取其现有内容，之后使用缓存的最近一次写入的内容
+        if filepath not in self.saved_texts:
+            try:
+                with open(filepath, encoding="utf-8") as saved_file:
+                    self.saved_texts[filepath] = saved_file.read()
+            except (OSError, ValueError):
+                return None
+
+        return self.saved_texts[filepath]
+
+
+def make_sure_dir_exists(dir_path):
+    if not os.path.exists(dir_path):
+        os.makedirs(dir_path, exist_ok=True)
+
+
+def config_path() -> str:
+    return os.path.join(os.path.expandvars("%APPDATA%"), "mo_jie_ren", "config.json")
+
+
+def benchmark(saves=200, interval_seconds=0.002):
+    # 模拟键盘事件循环中连续调整系数并保存，对比直接同步保存与通过 ConfigSaver 在后台保存时调用方的耗时，以及实际写入文件的次数
+    import tempfile
+
+    from press import Histogram
+
+    directory = tempfile.mkdtemp()
+    cfg = Config()
+
+    def legacy_save_to_json_file(cfg: Config, filepath: str):
+        # 原来的保存方式：在调用方线程中截断并重写原文件，用于对比
+        with open(filepath, "w", encoding="utf-8") as save_file:
+            json.dump(to_raw_type(cfg), save_file, ensure_ascii=False, indent=2)
+
+    saver = ConfigSaver(coalesce_seconds=0.1)
+    saver.start()
+    for index, (name, save) in enumerate([
+        ("原来的同步保存", legacy_save_to_json_file),
+        ("同步原子保存", lambda current, filepath: current.save_to_json_file(filepath)),
+        ("ConfigSaver 后台保存", saver.save),
+    ]):
+        filepath = os.path.join(directory, str(index), "config.json")
+        make_sure_dir_exists(os.path.dirname(filepath))
+
+        stall = Histogram(bucket_width_us=1)
+        for save_index in range(saves):
+            # 最后一半保存的内容相同，后台保存时不会重复写入
+            cfg.adjustment_coefficient = 1.5 + min(save_index, saves // 2) * 0.001
+            start = time.perf_counter_ns()
+            save(cfg, filepath)
+            stall.add(time.perf_counter_ns() - start)
+            time.sleep(interval_seconds)
+        saver.flush()
+
+        with open(filepath, encoding="utf-8") as saved_file:
+            correct = json.load(saved_file)["adjustment_coefficient"] == cfg.adjustment_coefficient
+        print(f"{name}: 调用方耗时 {stall.summary()} 内容{'正确' if correct else '错误'}")
+
+    saver.stop()
+    print(f"ConfigSaver: 要求保存 {saver.requested} 次，实际写入 {saver.written} 次，内容未变化跳过 {saver.skipped} 次")
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -1,7 +1,9 @@
 from __future__ import annotations
 
 import json
+import keyword
 import os.path
+import tempfile
 from abc import ABCMeta
 
 from log import logger
@@ -19,25 +21,22 @@ class Object:
 
 # 如果配置的值是dict，可以用ConfigInterface自行实现对应结构，将会自动解析
 # 如果配置的值是list/set/tuple，则需要实现ConfigInterface，同时重写auto_update_config，在调用过基类的该函数后，再自行处理这三类结果
+# 子类可以声明 __slots__ 以减少大量小配置（如修正模型中的各段估计）的内存占用，声明了的字段同样会被加载与导出
 class ConfigInterface(metaclass=ABCMeta):
+    __slots__ = ()
+
     def auto_update_config(self, raw_config: dict):
         if type(raw_config) is not dict:
             logger.warning(f"raw_config={raw_config} is not dict")
-        else:
-            for key, val in raw_config.items():
-                if hasattr(self, key):
-                    attr = getattr(self, key)
-                    if isinstance(attr, ConfigInterface):
-                        config_field: ConfigInterface = attr
-                        config_field.auto_update_config(val)
-                    else:
-                        setattr(self, key, val)
 
-        # 尝试填充一些数组元素
-        self.fill_array_fields(raw_config, self.fields_to_fill())
+            # 尝试填充一些数组元素
+            self.fill_array_fields(raw_config, self.fields_to_fill())
 
-        # 尝试填充一些字典元素
-        self.fill_dict_fields(raw_config, self.dict_fields_to_fill())
+            # 尝试填充一些字典元素
+            self.fill_dict_fields(raw_config, self.dict_fields_to_fill())
+        else:
+            # 按照该类的字段结构生成的加载函数，效果与逐个字段判断后赋值、再填充数组与字典元素一致
+            config_schema(type(self)).load(self, raw_config)
 
         # re: 以后有需求的时候再增加处理set、tuple等
 
@@ -62,8 +61,7 @@ class ConfigInterface(metaclass=ABCMeta):
         return self.auto_update_config(raw_config)
 
     def save_to_json_file(self, filepath: str, ensure_ascii=False, indent=2):
-        with open(filepath, "w", encoding="utf-8") as save_file:
-            json.dump(to_raw_type(self), save_file, ensure_ascii=ensure_ascii, indent=indent)
+        write_text_atomically(filepath, json.dumps(to_raw_type(self), ensure_ascii=ensure_ascii, indent=indent))
 
     def fill_array_fields(self, raw_config: dict, fields_to_fill: list[tuple[str, type[ConfigInterface]]]):
         for field_name, field_type in fields_to_fill:
@@ -103,8 +101,10 @@ class ConfigInterface(metaclass=ABCMeta):
 
 
 def to_raw_type(v):
-    if isinstance(v, ConfigInterface):
-        return {sk: to_raw_type(sv) for sk, sv in v.__dict__.items()}
+    if type(v) in SCALAR_TYPES:
+        return v
+    elif isinstance(v, ConfigInterface):
+        return config_schema(type(v)).dump(v)
     elif isinstance(v, list):
         return list(to_raw_type(sv) for sk, sv in enumerate(v))
     elif isinstance(v, tuple):
@@ -117,6 +117,167 @@ def to_raw_type(v):
         return v
 
 
+def write_text_atomically(filepath: str, text: str):
+    # 先写入同目录下的临时文件并落盘，再通过重命名替换原文件，写入过程中崩溃或断电也不会留下不完整的文件
+    fd, temp_path = tempfile.mkstemp(prefix=os.path.basename(filepath) + ".", suffix=".tmp", dir=os.path.dirname(filepath) or ".")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as temp_file:
+            temp_file.write(text)
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+        os.replace(temp_path, filepath)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+# 导出时无需转换的类型
+SCALAR_TYPES = frozenset([int, float, str, bool, type(None)])
+
+
+class ConfigSchema:
+    # 配置类的字段结构，以及据此生成的加载、导出函数，每个类仅在首次加载或导出时根据默认实例生成一次
+    # 生成的函数直接按字段名读写，不再对每个key进行 hasattr/getattr/isinstance 判断，也不会每次都调用 fields_to_fill/dict_fields_to_fill
+    # 因此要求同一个类的 fields_to_fill/dict_fields_to_fill 返回值固定，且各字段是否为 ConfigInterface 与默认实例一致
+    def __init__(self, cls: type):
+        try:
+            default = cls()
+        except TypeError:
+            # 无法直接创建默认实例时，仍使用原来的逐个字段判断的方式
+            self.known_fields = frozenset()
+            self.load = self.load_generic
+            self.dump = dump_generic
+            return
+
+        self.field_names = instance_field_names(default)
+        array_fields = dict(default.fields_to_fill())
+        dict_fields = dict(default.dict_fields_to_fill())
+        nested_fields = {name for name in self.field_names if isinstance(getattr(default, name), ConfigInterface)}
+
+        # 数组与字典字段即使不在默认实例中，也会被填充
+        self.known_fields = frozenset(list(self.field_names) + list(array_fields) + list(dict_fields))
+        # 默认实例 __dict__ 中的字段数，None 表示仅有 __slots__
+        self.dict_field_count = len(default.__dict__) if hasattr(default, "__dict__") else None
+
+        if all(name.isidentifier() and not keyword.iskeyword(name) for name in self.known_fields):
+            self.load = self.compile_loader(cls, array_fields, dict_fields, nested_fields)
+            self.dump = self.compile_dumper(cls)
+        else:
+            self.load = self.load_generic
+            self.dump = dump_generic
+
+    def compile_loader(self, cls: type, array_fields: dict, dict_fields: dict, nested_fields: set):
+        namespace = {"ConfigInterface": ConfigInterface}
+        lines = ["def load(self, raw_config):", "    matched = 0"]
+        for index, name in enumerate(sorted(self.known_fields, key=self.field_order)):
+            lines.append(f"    if {name!r} in raw_config:")
+            lines.append(f"        val = raw_config[{name!r}]")
+            lines.append("        matched += 1")
+
+            fill_type = array_fields.get(name) or dict_fields.get(name)
+            if fill_type is not None:
+                namespace[f"type_{index}"] = fill_type
+                if name in array_fields:
+                    lines.append(f"        if val is None: self.{name} = []")
+                    lines.append(f"        elif type(val) is list: self.{name} = [type_{index}().auto_update_config(item) for item in val]")
+                else:
+                    lines.append(f"        if val is None: self.{name} = {{}}")
+                    lines.append(f"        elif type(val) is dict: self.{name} = {{key: type_{index}().auto_update_config(item) for key, item in val.items()}}")
+                if name in self.field_names:
+                    lines.append(f"        else: self.{name} = val")
+            elif name in nested_fields:
+                lines.append(f"        attr = self.{name}")
+                lines.append("        if isinstance(attr, ConfigInterface): attr.auto_update_config(val)")
+                lines.append(f"        else: self.{name} = val")
+            else:
+                lines.append(f"        self.{name} = val")
+
+        lines.append("    if matched != len(raw_config):")
+        lines.append("        load_unknown_fields(self, raw_config)")
+
+        namespace["load_unknown_fields"] = self.load_unknown_fields
+        exec("\n".join(lines), namespace)
+        return namespace["load"]
+
+    def compile_dumper(self, cls: type):
+        # 实例中的字段与默认实例一致时直接按字段导出，否则（如运行时新增了字段）按实例中实际的字段导出
+        namespace = {"SCALAR_TYPES": SCALAR_TYPES, "to_raw_type": to_raw_type, "dump_generic": dump_generic}
+        lines = ["def dump(self):"]
+        if self.dict_field_count is not None:
+            lines.append(f"    if len(self.__dict__) != {self.dict_field_count}: return dump_generic(self)")
+        lines.append("    try:")
+        for index, name in enumerate(self.field_names):
+            lines.append(f"        v{index} = self.{name}")
+            lines.append(f"        if type(v{index}) not in SCALAR_TYPES: v{index} = to_raw_type(v{index})")
+        lines.append("    except AttributeError:")
+        lines.append("        return dump_generic(self)")
+        lines.append("    return {" + ", ".join(f"{name!r}: v{index}" for index, name in enumerate(self.field_names)) + "}")
+
+        exec("\n".join(lines), namespace)
+        return namespace["dump"]
+
+    def field_order(self, name: str) -> tuple:
+        if name in self.field_names:
+            return 0, self.field_names.index(name)
+        return 1, name
+
+    def load_generic(self, config: ConfigInterface, raw_config: dict):
+        # 字段名无法直接用于生成代码时使用，即原来的逐个字段判断的方式
+        self.load_unknown_fields(config, raw_config, skip_known=False)
+        config.fill_array_fields(raw_config, config.fields_to_fill())
+        config.fill_dict_fields(raw_config, config.dict_fields_to_fill())
+
+    def load_unknown_fields(self, config: ConfigInterface, raw_config: dict, skip_known=True):
+        for key, val in raw_config.items():
+            if skip_known and key in self.known_fields:
+                continue
+
+            if hasattr(config, key):
+                attr = getattr(config, key)
+                if isinstance(attr, ConfigInterface):
+                    attr.auto_update_config(val)
+                else:
+                    setattr(config, key, val)
+
+
+# 各配置类对应的字段结构
+config_schemas: dict[type, ConfigSchema] = {}
+
+
+def config_schema(cls: type) -> ConfigSchema:
+    schema = config_schemas.get(cls)
+    if schema is None:
+        schema = ConfigSchema(cls)
+        config_schemas[cls] = schema
+
+    return schema
+
+
+def slot_names(cls: type) -> list[str]:
+    names = []
+    for klass in reversed(cls.__mro__):
+        slots = klass.__dict__.get("__slots__", ())
+        if isinstance(slots, str):
+            slots = [slots]
+        names.extend(name for name in slots if name not in ("__dict__", "__weakref__") and name not in names)
+
+    return names
+
+
+def instance_field_names(config: ConfigInterface) -> list[str]:
+    # 先是 __slots__ 中声明且已赋值的字段，再是 __dict__ 中的字段
+    names = [name for name in slot_names(type(config)) if hasattr(config, name)]
+    if hasattr(config, "__dict__"):
+        names.extend(config.__dict__)
+
+    return names
+
+
+def dump_generic(config: ConfigInterface) -> dict:
+    return {name: to_raw_type(getattr(config, name)) for name in instance_field_names(config)}
+
+
 def test():
     class TestSubConfig(ConfigInterface):
         def __init__(self):
@@ -166,5 +327,85 @@ def test():
     print(test_config)
 
 
+def benchmark(entries=5000, rounds=5):
+    # 加载与导出包含大量嵌套配置的修正模型与配置，对比原来逐个字段反射的方式与现在按字段结构生成的函数，并检查两者结果一致
+    import time
+
+    from calibration import CalibrationModel, RlsEstimate
+    from config import Config
+
+    def legacy_auto_update_config(config: ConfigInterface, raw_config: dict):
+        for key, val in raw_config.items():
+            if hasattr(config, key):
+                attr = getattr(config, key)
+                if isinstance(attr, ConfigInterface):
+                    legacy_auto_update_config(attr, val)
+                else:
+                    setattr(config, key, val)
+
+        for field_name, field_type in config.fields_to_fill():
+            if type(raw_config.get(field_name)) is list:
+                setattr(config, field_name, [legacy_auto_update_config(field_type(), item) for item in raw_config[field_name]])
+        for field_name, field_type in config.dict_fields_to_fill():
+            if type(raw_config.get(field_name)) is dict:
+                setattr(config, field_name, {key: legacy_auto_update_config(field_type(), val) for key, val in raw_config[field_name].items()})
+
+        config.on_config_update(raw_config)
+        return config
+
+    def legacy_to_raw_type(v):
+        if isinstance(v, ConfigInterface):
+            if not hasattr(v, "__dict__"):
+                # 原来的方式不支持 __slots__，这里仅补上读取声明的字段
+                return {sk: legacy_to_raw_type(getattr(v, sk)) for sk in slot_names(type(v))}
+            return {sk: legacy_to_raw_type(sv) for sk, sv in v.__dict__.items()}
+        elif isinstance(v, list):
+            return list(legacy_to_raw_type(sv) for sk, sv in enumerate(v))
+        elif isinstance(v, dict):
+            return {sk: legacy_to_raw_type(sv) for sk, sv in v.items()}
+        else:
+            return v
+
+    model = CalibrationModel()
+    model.buckets = {str(index): RlsEstimate(1.5 + index / entries, 1.0 / (index + 1)) for index in range(entries)}
+    cfg = Config()
+    cfg.speed_x_per_second_by_bounce_force = {str(bounce_force): 300 + bounce_force / 10 for bounce_force in range(entries)}
+
+    for name, config_type, config in [("修正模型", CalibrationModel, model), ("配置", Config, cfg)]:
+        raw_config = json.loads(json.dumps(to_raw_type(config)))
+
+        timings = {}
+        for method, load, dump in [
+            ("原来", lambda raw: legacy_auto_update_config(config_type(), raw), legacy_to_raw_type),
+            ("现在", lambda raw: config_type().auto_update_config(raw), to_raw_type),
+        ]:
+            start = time.perf_counter()
+            for _ in range(rounds):
+                loaded = load(raw_config)
+            load_seconds = (time.perf_counter() - start) / rounds
+
+            start = time.perf_counter()
+            for _ in range(rounds):
+                dumped = dump(loaded)
+            dump_seconds = (time.perf_counter() - start) / rounds
+
+            assert dumped == raw_config, f"{method}的方式加载后再导出的结果与原始数据不一致"
+            timings[method] = (load_seconds, dump_seconds)
+
+        (legacy_load, legacy_dump), (load_seconds, dump_seconds) = timings["原来"], timings["现在"]
+        print(
+            f"{name}({entries}个嵌套条目): 加载 {legacy_load * 1000:.2f}ms -> {load_seconds * 1000:.2f}ms ({legacy_load / load_seconds:.1f}x)，"
+            f"导出 {legacy_dump * 1000:.2f}ms -> {dump_seconds * 1000:.2f}ms ({legacy_dump / dump_seconds:.1f}x)"
+        )
+
+
 if __name__ == "__main__":
-    test()
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] == "benchmark":
+        # 其他模块中的配置类继承的是 data_struct 模块中的 ConfigInterface，而不是作为脚本运行时的 __main__ 中的，需通过模块调用
+        import data_struct
+
+        data_struct.benchmark()
+    else:
+        test()
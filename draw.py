@@ -1,41 +1,225 @@
+import queue
 import threading
 import time
+from abc import ABCMeta, abstractmethod
 from collections import namedtuple
+from typing import List, Optional, Tuple
 
-import wx
+from tracing import tracer
 
 Point = namedtuple('Point', ['x', 'y'])
 
+# 绘制命令
+CMD_DRAW_LINE = "draw_line"
+CMD_CLEAR = "clear"
+CMD_STOP = "stop"
 
-def draw_line(start_point: Point, end_point: Point, duration_seconds: float):
-    # init
-    app = wx.App()
-    dc = wx.ScreenDC()
 
-    # set line and fill style
-    dc.SetBrush(wx.TRANSPARENT_BRUSH)
-    color = wx.Colour(255, 20, 147)
-    pen = wx.Pen(
-        color,
-        width=15,
-        style=wx.PENSTYLE_SOLID,
-    )
-    dc.SetPen(pen)
+class OverlayBackend(metaclass=ABCMeta):
+    # 实际负责在屏幕上绘制的后端，所有方法都只会在渲染线程中调用
 
-    start_time = time.time()
-    while True:
-        dc.DrawLine(start_point.x, start_point.y, end_point.x, end_point.y)
+    def init(self):
+        return
 
-        if time.time() - start_time >= duration_seconds:
-            break
+    @abstractmethod
+    def draw_line(self, start_point: Point, end_point: Point):
+        pass
 
+    def clear(self):
+        return
 
-def draw_line_async(start_point: Point, end_point: Point, duration_seconds: float):
-    threading.Thread(target=draw_line, args=(start_point, end_point, duration_seconds), daemon=True).start()
+    def close(self):
+        return
+
+
+class WxOverlayBackend(OverlayBackend):
+    def __init__(self):
+        self.app = None
+        self.dc = None
+
+    def init(self):
+        # wx 仅在首次真正需要绘制时才导入，且 wx.App 仅在渲染线程中创建一次
+        import wx
+
+        self.app = wx.App()
+        self.dc = wx.ScreenDC()
+
+        # set line and fill style
+        self.dc.SetBrush(wx.TRANSPARENT_BRUSH)
+        color = wx.Colour(255, 20, 147)
+        pen = wx.Pen(
+            color,
+            width=15,
+            style=wx.PENSTYLE_SOLID,
+        )
+        self.dc.SetPen(pen)
+
+    def draw_line(self, start_point: Point, end_point: Point):
+        self.dc.DrawLine(start_point.x, start_point.y, end_point.x, end_point.y)
+
+    def close(self):
+        self.dc = None
+        self.app = None
+
+
+class RecordingOverlayBackend(OverlayBackend):
+    # 不实际绘制，仅记录调用情况，用于无界面环境下的测试与性能测试
+    def __init__(self):
+        self.draw_calls: List[Tuple[float, Point, Point]] = []
+        self.clear_count = 0
+
+    def draw_line(self, start_point: Point, end_point: Point):
+        self.draw_calls.append((time.perf_counter(), start_point, end_point))
+
+    def clear(self):
+        self.clear_count += 1
+
+
+class OverlayRenderer:
+    # 常驻的屏幕标记线渲染服务，启动时创建一次，通过队列接收绘制命令
+    # 有线条需要显示时按照限定帧率重绘（ScreenDC上的内容会被其他窗口刷新覆盖，所以需要持续重绘），没有时则阻塞等待新命令，不占用CPU
+    def __init__(self, backend: OverlayBackend, max_fps=60):
+        self.backend = backend
+        self.frame_interval = 1.0 / max_fps
+
+        self.commands: queue.Queue = queue.Queue()
+        self.thread: Optional[threading.Thread] = None
+
+        # 当前显示的线条及其过期时间
+        self.current_line: Optional[Tuple[Point, Point]] = None
+        self.expire_at = 0.0
+        # 当前线条的绘制命令发出的时间点，首次绘制后清零，用于统计从发出命令到画出线条的延迟
+        self.line_posted_at_ns = 0
+
+        self.frame_count = 0
+
+    def start(self):
+        if self.thread is not None:
+            return
+
+        self.thread = threading.Thread(target=self.run, name="OverlayRenderer", daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        if self.thread is None:
+            return
+
+        self.commands.put((CMD_STOP,))
+        self.thread.join(timeout)
+        self.thread = None
+
+    def draw_line(self, start_point: Point, end_point: Point, duration_seconds: float):
+        # 替换当前显示的线条
+        self.commands.put((CMD_DRAW_LINE, start_point, end_point, duration_seconds, time.perf_counter_ns()))
+
+    def clear(self):
+        self.commands.put((CMD_CLEAR,))
+
+    def run(self):
+        self.backend.init()
+
+        try:
+            while True:
+                if not self.handle_commands():
+                    break
+
+                if self.current_line is None:
+                    continue
+
+                now = time.perf_counter()
+                if now >= self.expire_at:
+                    self.clear_line()
+                    continue
+
+                with tracer.span("overlay.frame"):
+                    self.backend.draw_line(*self.current_line)
+                self.frame_count += 1
+
+                if self.line_posted_at_ns != 0:
+                    tracer.record("overlay.first_frame", self.line_posted_at_ns)
+                    self.line_posted_at_ns = 0
+        finally:
+            self.backend.close()
+
+    def handle_commands(self) -> bool:
+        # 处理所有待处理的命令，返回是否需要继续运行
+        # 没有线条时阻塞等待，有线条时最多等待到下一帧的时间
+        timeout: Optional[float] = None
+        if self.current_line is not None:
+            timeout = max(0.0, min(self.frame_interval, self.expire_at - time.perf_counter()))
+
+        try:
+            cmd = self.commands.get(timeout=timeout)
+        except queue.Empty:
+            return True
+
+        while True:
+            if cmd[0] == CMD_STOP:
+                return False
+            elif cmd[0] == CMD_DRAW_LINE:
+                _, start_point, end_point, duration_seconds, posted_at_ns = cmd
+                self.current_line = (start_point, end_point)
+                self.expire_at = time.perf_counter() + duration_seconds
+                self.line_posted_at_ns = posted_at_ns
+            elif cmd[0] == CMD_CLEAR:
+                self.clear_line()
+
+            try:
+                cmd = self.commands.get_nowait()
+            except queue.Empty:
+                return True
+
+    def clear_line(self):
+        self.current_line = None
+        self.backend.clear()
+
+
+def benchmark(jumps=5, duration_seconds=0.3):
+    # 对比旧版每次跳跃新建线程并忙等重绘，与常驻渲染服务按帧率重绘，每次跳跃所消耗的CPU时间
+    start = Point(100, 100)
+    end = Point(600, 100)
+
+    def legacy_draw_line(backend: OverlayBackend):
+        start_time = time.time()
+        while True:
+            backend.draw_line(start, end)
+
+            if time.time() - start_time >= duration_seconds:
+                break
+
+    legacy_backend = RecordingOverlayBackend()
+    cpu_start = time.process_time()
+    for _ in range(jumps):
+        t = threading.Thread(target=legacy_draw_line, args=(legacy_backend,), daemon=True)
+        t.start()
+        t.join()
+    legacy_cpu = (time.process_time() - cpu_start) / jumps
+
+    backend = RecordingOverlayBackend()
+    renderer = OverlayRenderer(backend)
+    renderer.start()
+    cpu_start = time.process_time()
+    for _ in range(jumps):
+        renderer.draw_line(start, end, duration_seconds)
+        time.sleep(duration_seconds + 0.05)
+    renderer_cpu = (time.process_time() - cpu_start) / jumps
+    renderer.stop()
+
+    print(f"旧版忙等绘制: 每次跳跃CPU时间 {legacy_cpu * 1000:.2f}ms, 绘制次数 {len(legacy_backend.draw_calls) // jumps}")
+    print(f"常驻渲染服务: 每次跳跃CPU时间 {renderer_cpu * 1000:.2f}ms, 绘制次数 {len(backend.draw_calls) // jumps}")
 
 
 if __name__ == '__main__':
-    start = Point(1920, 540)
-    end = Point(start.x + 500, start.y + 500)
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] == "benchmark":
+        benchmark()
+    else:
+        start = Point(1920, 540)
+        end = Point(start.x + 500, start.y + 500)
 
-    draw_line(start, end, 2)
+        renderer = OverlayRenderer(WxOverlayBackend())
+        renderer.start()
+        renderer.draw_line(start, end, 2)
+        time.sleep(2)
+        renderer.stop()
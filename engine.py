@@ -0,0 +1,433 @@
+import math
+import time
+from collections import namedtuple
+from typing import Callable, List, Optional, Tuple
+
+from calibration import Calibrator, observe_landing_offset
+from clock import Clock, real_clock
+from config import Config
+from draw import Point
+from executor import JumpTask
+from journal import OUTCOME_CANCELLED, OUTCOME_LANDED, OUTCOME_UNKNOWN, JournalWriter, make_entry
+from log import color, debug_enabled, logger
+from metrics import metrics
+from planner import JumpPipeline, JumpPlanner, PlannedJump, remaining_targets
+from press import Histogram, PressRecord, press_seconds_for
+from tracing import tracer
+
+STEP_START = "选择起始点"
+STEP_END = "选择终点"
+
+# 引擎处理的输入事件，与具体的键盘、鼠标无关，便于录制与回放
+# 左ctrl，position 为按下时鼠标的位置
+EVENT_MARK = "mark"
+# 左shift，选择终点时依次标记途经的平台，position 为按下时鼠标的位置
+EVENT_WAYPOINT = "waypoint"
+# 根据当前画面自动识别并跳跃
+EVENT_AUTO_JUMP = "auto_jump"
+# 开启/关闭连续模式
+EVENT_TOGGLE_CONTINUOUS = "toggle_continuous"
+# 调整本轮弹跳力，value 为弹跳力
+EVENT_BOUNCE_FORCE = "bounce_force"
+# 取消进行中的跳跃
+EVENT_CANCEL = "cancel"
+# 请求输入新的修正系数
+EVENT_ADJUST_COEFFICIENT = "adjust_coefficient"
+# 输入了新的修正系数，value 为新的系数
+EVENT_SET_COEFFICIENT = "set_coefficient"
+# 角色落地后画面静止
+EVENT_SETTLED = "settled"
+# 跳跃执行完毕，value 为 (JumpTask, PressRecord)，由执行线程投递，使得跳跃记录与落地检测的状态仅在主循环中修改
+EVENT_JUMP_FINISHED = "jump_finished"
+
+# posted_at_ns 仅在开启追踪时由产生事件的一方填写，用于统计从产生事件到开始处理的延迟
+InputEvent = namedtuple('InputEvent', ['kind', 'position', 'value', 'posted_at_ns'], defaults=[None, None, None])
+
+
+# 计算下一步是什么
+def get_next_step(current_step: str) -> str:
+    next_step = STEP_END
+    if current_step == STEP_START:
+        next_step = STEP_END
+    elif current_step == STEP_END:
+        next_step = STEP_START
+    else:
+        raise AssertionError(f"unexpected step {current_step}")
+
+    return next_step
+
+
+class JumpEngine:
+    # 跳跃流程的状态机，仅处理 InputEvent，时钟、跳跃执行器、识别、落地检测等均由外部注入
+    # 实际运行时由键盘事件驱动，回放时则由录制的事件序列驱动，并使用虚拟时钟与模拟鼠标
+    def __init__(self, cfg: Config, jumper, vision=None, calibrator: Optional[Calibrator] = None, journal: Optional[JournalWriter] = None, landing_watcher=None, clock: Clock = real_clock):
+        self.cfg = cfg
+        self.jumper = jumper
+        self.vision = vision
+        self.calibrator = calibrator
+        self.journal = journal
+        self.landing_watcher = landing_watcher
+        self.clock = clock
+
+        # 需要输入新的系数时调用，输入完成后应产生 EVENT_SET_COEFFICIENT 事件
+        self.request_coefficient: Optional[Callable[[], None]] = None
+        # 配置或修正模型变化时调用，用于保存到文件
+        self.save_config: Optional[Callable[[Config], None]] = None
+        self.save_calibration: Optional[Callable[[Calibrator], None]] = None
+        # 每次提交跳跃时调用，参数为 起点、终点、按压时长
+        self.on_submit: Optional[Callable[[Point, Point, float], None]] = None
+        # 跳跃在单独的线程中执行时，用于将执行完毕的通知作为 EVENT_JUMP_FINISHED 投递到主循环
+        # 未设置时（如回放时同步执行跳跃）直接在执行方的线程中处理
+        self.post_event: Optional[Callable[[InputEvent], None]] = None
+
+        self.current_step = STEP_START
+        self.current_block = 1
+        self.start_position = Point(0, 0)
+
+        self.base_bounce_force = 100
+        self.bounce_force = self.base_bounce_force
+
+        # 连续模式下，每次落地后自动识别并进行下一跳
+        self.continuous_mode = False
+        self.adjusting_coefficient = False
+
+        # 上一次自动跳跃的 (识别结果, 弹跳力, 按压时长)，用于在下一次识别时得出实际落点并修正系数
+        self.last_auto_jump = None
+        # 已执行完但尚未确定落点的跳跃记录，在下一次识别或下一次跳跃时写入
+        self.pending_entry = None
+
+        # 选择终点前标记的途经点及跳向该点时的弹跳力，标记终点后一次规划整条路径，之后每次落地后自动跳向下一个
+        self.waypoints: List[Tuple[Point, int]] = []
+        # 正在执行的规划跳跃，落点偏差过大时其目标也需要重新规划
+        self.current_planned: Optional[PlannedJump] = None
+        self.pipeline = JumpPipeline(JumpPlanner(self.coefficient_for, cfg.speed_for, self.base_bounce_force), cfg.planner)
+
+        # 从收到事件到处理完成的延迟
+        self.dispatch_latency = Histogram()
+
+        self.jumper.on_finished = self.jump_finished
+
+    def start(self):
+        logger.info(f"当前修正系数为 {self.cfg.adjustment_coefficient}")
+        if self.calibrator is not None and self.cfg.calibration.enabled:
+            logger.info(f"已开启系数自动修正，{self.calibrator.summary()}")
+
+        self.show_step_prompt()
+
+    def show_step_prompt(self):
+        if self.current_step == STEP_START:
+            logger.info("")
+            logger.info(color("bold_yellow") + f"当前开始第 {self.current_block} 个格子，请依次将鼠标放到当前位置和目标位置，并分别点击 左ctrl 键（键盘左下角那个）(停止使用可以点击右上角关闭）")
+            logger.info(color("bold_yellow") + "也可以直接按 a 键，根据当前画面自动识别起点和终点，按 s 键则开启/关闭连续模式，每次落地后自动进行下一跳")
+            if self.cfg.planner.enabled:
+                logger.info(color("bold_yellow") + "选择终点前可以依次在途经的各个平台上按 左shift 键标记，标记终点后将依次跳过整条路径")
+
+        logger.info(color("bold_yellow") + f"当前步骤为 {self.current_step}")
+
+    def handle(self, event: InputEvent) -> bool:
+        # 返回该事件是否被处理
+        received_at = self.clock.perf_counter_ns()
+        traced_at = 0
+        if tracer.enabled:
+            traced_at = time.perf_counter_ns()
+            if event.posted_at_ns is not None:
+                tracer.record("input.delivery", event.posted_at_ns, traced_at)
+
+        if event.kind == EVENT_MARK:
+            self.mark(Point(*event.position))
+        elif event.kind == EVENT_WAYPOINT:
+            self.add_waypoint(Point(*event.position))
+        elif event.kind == EVENT_SETTLED:
+            if len(self.pipeline) > 0:
+                self.continue_path()
+            elif not self.continuous_mode:
+                logger.info(color("bold_cyan") + "角色已落地，可以开始下一跳")
+            elif not self.auto_jump():
+                self.continuous_mode = False
+                logger.warning(color("bold_yellow") + "自动识别失败，已退出连续模式")
+        elif event.kind == EVENT_AUTO_JUMP:
+            self.auto_jump()
+        elif event.kind == EVENT_TOGGLE_CONTINUOUS:
+            self.continuous_mode = not self.continuous_mode
+            logger.info(color("bold_cyan") + f"连续模式已{'开启，每次落地后将自动进行下一跳' if self.continuous_mode else '关闭'}")
+            if self.continuous_mode:
+                self.auto_jump()
+        elif event.kind == EVENT_BOUNCE_FORCE:
+            self.bounce_force = event.value
+            if self.bounce_force == self.base_bounce_force:
+                logger.info(color("bold_cyan") + f"本轮弹跳力重置为{self.bounce_force}")
+            else:
+                logger.info(color("bold_cyan") + f"本轮弹跳力调整为{self.bounce_force}")
+        elif event.kind == EVENT_CANCEL:
+            self.jumper.cancel()
+            if self.landing_watcher is not None:
+                self.landing_watcher.cancel()
+            self.continuous_mode = False
+            self.last_auto_jump = None
+            self.waypoints = []
+            self.current_planned = None
+            self.pipeline.clear()
+            logger.info(color("bold_cyan") + "已取消进行中的跳跃")
+        elif event.kind == EVENT_ADJUST_COEFFICIENT:
+            if self.adjusting_coefficient:
+                return False
+
+            logger.info(color("bold_green") + "进入调整 修正系数 模式，并重置本轮步骤为 选择起始点 阶段，请按照提示输入新的系数~")
+
+            self.current_step = STEP_START
+            self.adjusting_coefficient = True
+            if self.request_coefficient is not None:
+                self.request_coefficient()
+        elif event.kind == EVENT_SET_COEFFICIENT:
+            self.set_coefficient(event.value)
+        elif event.kind == EVENT_JUMP_FINISHED:
+            self.on_jump_finished(*event.value)
+        else:
+            return False
+
+        elapsed_ns = self.clock.perf_counter_ns() - received_at
+        self.dispatch_latency.add(elapsed_ns)
+        metrics.observe("engine.dispatch", elapsed_ns)
+        if traced_at != 0:
+            tracer.record("engine." + event.kind, traced_at)
+        if debug_enabled():
+            # 累计的分布在退出时输出，这里仅输出本次的耗时
+            logger.debug(f"事件 {event.kind} 处理耗时 {elapsed_ns / 1000:.1f} 微秒")
+        return True
+
+    def mark(self, position: Point):
+        if self.current_step == STEP_START:
+            self.start_position = position
+            logger.info(f"起点为 {self.start_position}")
+        elif self.current_step == STEP_END:
+            logger.info(f"目标为 {position}")
+            self.last_auto_jump = None
+            self.resolve_pending_entry(OUTCOME_UNKNOWN)
+            if len(self.waypoints) > 0:
+                self.start_path(position)
+            else:
+                self.submit_jump(self.start_position, position)
+        else:
+            raise AssertionError()
+
+        # 更新步骤和区块
+        self.current_step = get_next_step(self.current_step)
+        if self.current_step == STEP_START:
+            self.current_block += 1
+
+        self.show_step_prompt()
+
+    def add_waypoint(self, position: Point):
+        if not self.cfg.planner.enabled:
+            return
+        if self.current_step != STEP_END:
+            logger.warning(color("bold_yellow") + "请先按 左ctrl 键选择起点，再标记途经的平台")
+            return
+
+        # 标记前调整的弹跳力用于跳向该点的这一跳
+        self.waypoints.append((position, self.bounce_force))
+        self.bounce_force = self.base_bounce_force
+        logger.info(f"途经点 {len(self.waypoints)} 为 {position}")
+
+    def start_path(self, end_position: Point):
+        # 一次计算整条路径上各跳的按压时长，先执行第一跳，其余的在每次落地后依次执行
+        targets = [position for position, _ in self.waypoints] + [end_position]
+        bounce_forces = [bounce_force for _, bounce_force in self.waypoints] + [self.bounce_force]
+        self.waypoints = []
+
+        jumps = self.pipeline.planner.plan(self.start_position, targets, bounce_forces)
+        logger.info(color("bold_green") + f"已规划 {len(jumps)} 跳，预计按压时长依次为 {', '.join(f'{jump.press_seconds:.3f}' for jump in jumps)} 秒")
+        self.pipeline.load(jumps)
+        self.submit_planned(self.pipeline.next_jump())
+
+    def continue_path(self):
+        # 落地后仅在预测的起点附近确认角色的实际位置，与预测一致时直接跳向下一个点
+        # 找不到角色或偏差过大时才识别整个画面，并保留用户标记的、仍在画面中平台上的目标重新规划
+        remaining = list(self.pipeline.pending)
+        jump = None
+        if self.vision is None:
+            jump = self.pipeline.next_jump()
+        else:
+            actual_start = self.locate(remaining[0].start_position)
+            if actual_start is not None:
+                jump = self.pipeline.next_jump(actual_start)
+            else:
+                self.pipeline.abandon()
+
+        if jump is None and self.vision is not None:
+            detection = self.detect()
+            if detection is not None:
+                marked = [(planned.end_position, planned.bounce_force) for planned in remaining]
+                if self.current_planned is not None:
+                    marked.insert(0, (self.current_planned.end_position, self.current_planned.bounce_force))
+                targets = remaining_targets(detection.start_position, detection.platforms, marked)
+                if len(targets) > 0:
+                    logger.warning(color("bold_yellow") + f"未能在预测的位置找到角色或偏差超过 {self.cfg.planner.max_deviation_px} 像素，根据当前画面重新规划剩余的 {len(targets)} 跳")
+                    self.pipeline.load(self.pipeline.planner.plan(detection.start_position, [target for target, _ in targets], [bounce_force for _, bounce_force in targets]))
+                    jump = self.pipeline.next_jump()
+
+        self.resolve_pending_entry(OUTCOME_UNKNOWN)
+        if jump is None:
+            logger.warning(color("bold_yellow") + f"无法确认落点或重新规划，已取消剩余的 {len(remaining)} 跳，请重新选择起点和终点")
+            self.show_step_prompt()
+            return
+
+        self.submit_planned(jump)
+        self.current_block += 1
+        self.show_step_prompt()
+
+    def submit_planned(self, jump: PlannedJump):
+        # 直接使用规划时计算出的按压时长
+        self.current_planned = jump
+        self.bounce_force = jump.bounce_force
+        self.submit_jump(jump.start_position, jump.end_position, jump.press_seconds)
+
+    def set_coefficient(self, new_coefficient: float):
+        cfg = self.cfg
+
+        old = cfg.adjustment_coefficient
+        cfg.adjustment_coefficient = float(new_coefficient)
+        logger.info(color("bold_yellow") + f"系数变更为 {cfg.adjustment_coefficient}，之前为 {old}，将保存到用户目录的配置")
+        if self.save_config is not None:
+            self.save_config(cfg)
+
+        if self.calibrator is not None:
+            self.calibrator.reset(cfg.adjustment_coefficient)
+            if self.save_calibration is not None:
+                self.save_calibration(self.calibrator)
+
+        metrics.set("config.coefficient", cfg.adjustment_coefficient)
+        self.adjusting_coefficient = False
+        self.show_step_prompt()
+
+    def coefficient_for(self, delta_x: float) -> float:
+        if self.calibrator is not None and self.cfg.calibration.enabled:
+            return self.calibrator.coefficient_for(delta_x)
+        return self.cfg.adjustment_coefficient
+
+    def submit_jump(self, start_position: Point, end_position: Point, press_seconds: Optional[float] = None) -> float:
+        # press_seconds 为 None 时根据当前的系数与弹跳力计算
+        bounce_force = self.bounce_force
+
+        delta_x = end_position.x - start_position.x
+        logger.info(f"X 差值为 {delta_x}")
+
+        # 计算需要按住的时间，考虑弹跳力的情况
+        speed_x_per_second = self.cfg.speed_for(bounce_force)
+        actual_speed = speed_x_per_second * bounce_force / self.base_bounce_force
+        coefficient = self.coefficient_for(delta_x)
+        if press_seconds is None:
+            press_seconds = press_seconds_for(delta_x, bounce_force, coefficient, speed_x_per_second, self.base_bounce_force)
+
+        with tracer.span("engine.log"):
+            logger.info(color("bold_green") + f"预计需要按住左键 {press_seconds} 秒 (实际速度={actual_speed} 基础速度={speed_x_per_second} 弹跳力={bounce_force} 最终修正系数={coefficient})")
+
+        metrics.inc("jumps.submitted")
+        metrics.set("jump.block", self.current_block)
+        metrics.set("jump.coefficient", coefficient)
+        metrics.set("jump.press_seconds", press_seconds)
+
+        if self.on_submit is not None:
+            self.on_submit(start_position, end_position, press_seconds)
+
+        # 交给执行线程去画线并点击对应时长，执行完毕后再补充实际按压时长与结果写入跳跃记录
+        entry = make_entry(self.current_block, start_position, end_position, bounce_force, coefficient, int(press_seconds * 1e9), 0, OUTCOME_UNKNOWN)
+        with tracer.span("executor.submit"):
+            self.jumper.submit(start_position, end_position, press_seconds, entry)
+        if self.vision is not None:
+            self.vision.notify_jump(delta_x)
+
+        if self.bounce_force != self.base_bounce_force:
+            self.bounce_force = self.base_bounce_force
+            logger.info("弹跳力重置为默认值")
+
+        return press_seconds
+
+    def resolve_pending_entry(self, outcome: int, offset: float = math.nan):
+        if self.pending_entry is not None and self.journal is not None:
+            self.journal.append(self.pending_entry._replace(outcome=outcome, offset=offset))
+        self.pending_entry = None
+
+    def jump_finished(self, task: JumpTask, record: PressRecord):
+        # 由执行跳跃的线程调用
+        if self.post_event is not None:
+            self.post_event(InputEvent(EVENT_JUMP_FINISHED, value=(task, record)))
+        else:
+            self.on_jump_finished(task, record)
+
+    def on_jump_finished(self, task: JumpTask, record: PressRecord):
+        # 仅在主循环中调用
+        entry = task.context._replace(actual_ns=record.actual_ns)
+        if record.cancelled:
+            metrics.inc("jumps.cancelled")
+            if self.journal is not None:
+                self.journal.append(entry._replace(outcome=OUTCOME_CANCELLED))
+            return
+
+        self.resolve_pending_entry(OUTCOME_UNKNOWN)
+        self.pending_entry = entry
+        if self.landing_watcher is not None:
+            self.landing_watcher.watch()
+
+    def calibrate(self, detection):
+        if self.last_auto_jump is None:
+            return
+
+        previous, previous_bounce_force, press_seconds = self.last_auto_jump
+        self.last_auto_jump = None
+
+        offset = observe_landing_offset(previous, detection)
+        if offset is None:
+            self.resolve_pending_entry(OUTCOME_UNKNOWN)
+            return
+
+        self.resolve_pending_entry(OUTCOME_LANDED, offset)
+        metrics.inc("jumps.landed")
+        metrics.set("jump.landing_offset_px", offset)
+        if self.calibrator is None or not self.cfg.calibration.enabled:
+            return
+
+        delta_x = previous.end_position.x - previous.start_position.x
+        if self.calibrator.record(delta_x, previous_bounce_force, press_seconds, offset, self.cfg.speed_for(previous_bounce_force)):
+            logger.info(color("bold_cyan") + f"上一跳落点偏差为 {offset} 像素，修正后 {self.calibrator.summary()}")
+            if self.save_calibration is not None:
+                self.save_calibration(self.calibrator)
+
+    def detect(self):
+        start = self.clock.perf_counter_ns()
+        with tracer.span("vision.detect"):
+            detection = self.vision.detect()
+        metrics.observe("vision.detect", self.clock.perf_counter_ns() - start)
+        if detection is None:
+            metrics.inc("vision.misses")
+        return detection
+
+    def locate(self, predicted: Point) -> Optional[Point]:
+        start = self.clock.perf_counter_ns()
+        with tracer.span("vision.locate"):
+            position = self.vision.locate(predicted)
+        metrics.observe("vision.locate", self.clock.perf_counter_ns() - start)
+        if position is None:
+            metrics.inc("vision.locate_misses")
+        return position
+
+    def auto_jump(self) -> bool:
+        # 根据截图自动识别角色和下一个平台的位置
+        detection = self.detect() if self.vision is not None else None
+        if detection is None:
+            self.last_auto_jump = None
+            self.resolve_pending_entry(OUTCOME_UNKNOWN)
+            logger.warning(color("bold_yellow") + "未能从当前画面中识别出角色和下一个平台，请手动选择起点和终点")
+            return False
+
+        self.calibrate(detection)
+
+        logger.info(f"自动识别 起点为 {detection.start_position} 目标为 {detection.end_position} 置信度为 {detection.confidence:.2f}")
+        bounce_force = self.bounce_force
+        press_seconds = self.submit_jump(detection.start_position, detection.end_position)
+        self.last_auto_jump = (detection, bounce_force, press_seconds)
+
+        self.current_step = STEP_START
+        self.current_block += 1
+        self.show_step_prompt()
+        return True
@@ -0,0 +1,179 @@
+import queue
+import threading
+import time
+from collections import namedtuple
+from typing import Callable, Optional
+
+from draw import OverlayRenderer, Point
+from log import color, debug_enabled, logger
+from metrics import metrics
+from press import Histogram, PressRecord, PressScheduler
+from tracing import tracer
+
+# 一次待执行的跳跃，dispatched_at_ns 为输入分发阶段提交任务的时间点，generation 用于判断提交后是否被取消过
+# context 为提交方附带的任意信息，执行完毕后随任务一起传给 on_finished
+JumpTask = namedtuple('JumpTask', ['start_position', 'end_position', 'press_seconds', 'dispatched_at_ns', 'generation', 'context'], defaults=[None])
+
+
+class JumpExecutor:
+    # 跳跃执行线程，与键盘事件分发阶段通过队列连接，使得按住鼠标期间键盘事件依然能被及时处理
+    def __init__(self, press_scheduler: PressScheduler, press: Callable[[], None], release: Callable[[], None], overlay: Optional[OverlayRenderer] = None):
+        self.press_scheduler = press_scheduler
+        self.press = press
+        self.release = release
+        self.overlay = overlay
+
+        self.tasks: queue.Queue = queue.Queue()
+        self.cancel_event = threading.Event()
+        self.generation = 0
+        self.lock = threading.Lock()
+        self.thread: Optional[threading.Thread] = None
+
+        # 从提交任务到开始按下的延迟
+        self.start_latency = Histogram()
+
+        self.on_finished: Optional[Callable[[JumpTask, PressRecord], None]] = None
+
+    def start(self):
+        if self.thread is not None:
+            return
+
+        self.thread = threading.Thread(target=self.run, name="JumpExecutor", daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        if self.thread is None:
+            return
+
+        self.cancel()
+        self.tasks.put(None)
+        self.thread.join(timeout)
+        self.thread = None
+
+    def submit(self, start_position: Point, end_position: Point, press_seconds: float, context=None) -> JumpTask:
+        task = JumpTask(start_position, end_position, press_seconds, time.perf_counter_ns(), self.generation, context)
+        self.tasks.put(task)
+        return task
+
+    def cancel(self):
+        # 丢弃尚未执行的跳跃，并立即松开正在进行中的跳跃
+        with self.lock:
+            self.generation += 1
+            self.cancel_event.set()
+
+        if self.overlay is not None:
+            self.overlay.clear()
+
+    def run(self):
+        while True:
+            task: Optional[JumpTask] = self.tasks.get()
+            if task is None:
+                break
+
+            with self.lock:
+                if task.generation != self.generation:
+                    # 提交后被取消了
+                    continue
+
+                # 之前的取消仅影响在此之前提交的跳跃
+                self.cancel_event.clear()
+
+            self.execute(task)
+
+    def execute(self, task: JumpTask) -> PressRecord:
+        queue_wait_ns = time.perf_counter_ns() - task.dispatched_at_ns
+        self.start_latency.add(queue_wait_ns)
+        metrics.observe("executor.queue_wait", queue_wait_ns)
+        tracer.record("executor.queue_wait", task.dispatched_at_ns)
+
+        # 画条线标记下
+        if self.overlay is not None:
+            with tracer.span("overlay.draw_line"):
+                self.overlay.draw_line(task.start_position, task.end_position, task.press_seconds)
+
+        # 点击对应时长
+        with tracer.span("press.hold"):
+            record = self.press_scheduler.hold(self.press, self.release, task.press_seconds, self.cancel_event)
+
+        with tracer.span("executor.log"):
+            if record.cancelled:
+                logger.info(color("bold_yellow") + f"本次跳跃已取消，实际按住 {record.actual_ns / 1e9:.6f} 秒")
+            else:
+                tracer.observe("press.overshoot", record.actual_ns - record.requested_ns)
+                metrics.observe("press.abs_error", abs(record.actual_ns - record.requested_ns))
+                if debug_enabled():
+                    logger.debug(f"实际按住 {record.actual_ns / 1e9:.6f} 秒，误差 {(record.actual_ns - record.requested_ns) / 1000:.1f} 微秒")
+
+        if self.on_finished is not None:
+            self.on_finished(task, record)
+
+        return record
+
+
+class SyncJumpExecutor(JumpExecutor):
+    # 在调用方线程中直接执行跳跃，用于回放与模拟，配合虚拟时钟时按压不会真正等待
+    def start(self):
+        return
+
+    def stop(self, timeout: Optional[float] = None):
+        return
+
+    def submit(self, start_position: Point, end_position: Point, press_seconds: float, context=None) -> JumpTask:
+        task = JumpTask(start_position, end_position, press_seconds, time.perf_counter_ns(), self.generation, context)
+        self.cancel_event.clear()
+        self.execute(task)
+        return task
+
+
+def benchmark(press_seconds=0.5, hotkeys=200):
+    # 模拟键盘事件线程在一次长按期间持续产生热键事件，统计从事件产生到分发阶段处理完成的延迟
+    from press import FakeMouseController
+
+    fake_mouse = FakeMouseController()
+    executor = JumpExecutor(PressScheduler(), fake_mouse.press, fake_mouse.release)
+    executor.start()
+
+    events: queue.Queue = queue.Queue()
+
+    def produce_events():
+        events.put(("jump", time.perf_counter_ns()))
+        time.sleep(0.01)
+        for i in range(hotkeys):
+            events.put((["z", "x", "c"][i % 3], time.perf_counter_ns()))
+            time.sleep(press_seconds / 2 / hotkeys)
+        events.put(("esc", time.perf_counter_ns()))
+        events.put((None, time.perf_counter_ns()))
+
+    threading.Thread(target=produce_events, daemon=True).start()
+
+    bounce_force = 100
+    hotkey_latency = Histogram(bucket_width_us=10)
+    cancel_at = 0
+    while True:
+        key, produced_at = events.get()
+        if key is None:
+            break
+
+        if key == "jump":
+            executor.submit(Point(0, 0), Point(150, 0), press_seconds)
+        elif key == "esc":
+            cancel_at = produced_at
+            executor.cancel()
+        else:
+            bounce_force = {"z": 90, "x": 100, "c": 110}[key]
+
+        hotkey_latency.add(time.perf_counter_ns() - produced_at)
+
+    while fake_mouse.pressed_at is not None or len(fake_mouse.holds_ns) == 0:
+        time.sleep(0.0001)
+    cancel_latency_us = (time.perf_counter_ns() - cancel_at) / 1000
+
+    executor.stop()
+
+    print(f"长按期间热键处理延迟: {hotkey_latency.summary()} (最终弹跳力={bounce_force})")
+    print(f"提交到开始按下的延迟: {executor.start_latency.summary()}")
+    print(f"取消热键到松开的延迟: <={cancel_latency_us:.1f}us，实际按住 {fake_mouse.holds_ns[0] / 1e9:.3f} 秒（预期 {press_seconds} 秒）")
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,296 @@
+import argparse
+import ctypes
+import os
+import struct
+import sys
+import time
+from abc import ABCMeta, abstractmethod
+from typing import List, Optional, Tuple
+
+from clock import Clock, real_clock
+from press import Histogram
+
+# 各实现的名称，可在配置文件的 input_backend 中指定，auto 表示 Windows 下使用 sendinput，其余平台使用 pynput
+BACKEND_AUTO = "auto"
+BACKEND_PYNPUT = "pynput"
+BACKEND_SENDINPUT = "sendinput"
+# 以下两个不会操作真实的鼠标，仅用于测试与对比调用开销，实际运行时不可使用
+BACKEND_UINPUT = "uinput"
+BACKEND_RECORDING = "recording"
+
+
+class InputBackend(metaclass=ABCMeta):
+    # 读取鼠标位置、按下与松开鼠标左键的统一接口，每次调用的耗时分别记录，便于在不同机器上选择最快的实现
+    name = ""
+
+    def __init__(self):
+        self.position_latency = Histogram(bucket_width_us=1)
+        self.press_latency = Histogram(bucket_width_us=1)
+        self.release_latency = Histogram(bucket_width_us=1)
+
+    def position(self) -> Tuple[int, int]:
+        start = time.perf_counter_ns()
+        position = self.read_position()
+        self.position_latency.add(time.perf_counter_ns() - start)
+        return position
+
+    def press(self):
+        start = time.perf_counter_ns()
+        self.press_left()
+        self.press_latency.add(time.perf_counter_ns() - start)
+
+    def release(self):
+        start = time.perf_counter_ns()
+        self.release_left()
+        self.release_latency.add(time.perf_counter_ns() - start)
+
+    def close(self):
+        return
+
+    @abstractmethod
+    def read_position(self) -> Tuple[int, int]:
+        pass
+
+    @abstractmethod
+    def press_left(self):
+        pass
+
+    @abstractmethod
+    def release_left(self):
+        pass
+
+    def summary(self) -> str:
+        return f"{self.name}: 读取位置 {self.position_latency.summary()} | 按下 {self.press_latency.summary()} | 松开 {self.release_latency.summary()}"
+
+
+class PynputBackend(InputBackend):
+    # 原来的实现，通过 pynput.mouse.Controller 操作鼠标
+    name = BACKEND_PYNPUT
+
+    def __init__(self):
+        super().__init__()
+        from pynput import mouse
+
+        self.controller = mouse.Controller()
+        self.button = mouse.Button.left
+
+    def read_position(self) -> Tuple[int, int]:
+        return self.controller.position
+
+    def press_left(self):
+        self.controller.press(self.button)
+
+    def release_left(self):
+        self.controller.release(self.button)
+
+
+class SendInputBackend(InputBackend):
+    # 直接调用 Win32 的 SendInput 注入鼠标事件，按下与松开的 INPUT 结构体预先构造好，调用时无需任何转换
+    # send 可以将多个事件放在一次 SendInput 调用中注入，系统保证这些事件连续到达，不会与其他输入交错
+    # 目前按下与松开之间必须间隔按压时长，每次调用都只有一个事件
+    name = BACKEND_SENDINPUT
+
+    INPUT_MOUSE = 0
+    MOUSEEVENTF_LEFTDOWN = 0x0002
+    MOUSEEVENTF_LEFTUP = 0x0004
+
+    def __init__(self):
+        super().__init__()
+        if sys.platform != "win32":
+            raise OSError("SendInput 仅在 Windows 下可用")
+
+        from ctypes import wintypes
+
+        class MOUSEINPUT(ctypes.Structure):
+            _fields_ = [("dx", wintypes.LONG), ("dy", wintypes.LONG), ("mouseData", wintypes.DWORD), ("dwFlags", wintypes.DWORD), ("time", wintypes.DWORD), ("dwExtraInfo", ctypes.c_size_t)]
+
+        # 联合体中 MOUSEINPUT 是最大的成员，仅声明它即可保证 INPUT 的大小与系统一致
+        class INPUT_UNION(ctypes.Union):
+            _fields_ = [("mi", MOUSEINPUT)]
+
+        class INPUT(ctypes.Structure):
+            _fields_ = [("type", wintypes.DWORD), ("union", INPUT_UNION)]
+
+        self.INPUT = INPUT
+        self.MOUSEINPUT = MOUSEINPUT
+
+        user32 = ctypes.WinDLL("user32", use_last_error=True)
+        self.send_input = user32.SendInput
+        self.send_input.argtypes = [wintypes.UINT, ctypes.c_void_p, ctypes.c_int]
+        self.send_input.restype = wintypes.UINT
+        self.get_cursor_pos = user32.GetCursorPos
+        self.get_cursor_pos.argtypes = [ctypes.POINTER(wintypes.POINT)]
+        self.get_cursor_pos.restype = wintypes.BOOL
+
+        self.input_size = ctypes.sizeof(INPUT)
+        self.point = wintypes.POINT()
+        self.press_inputs = self.make_inputs([self.MOUSEEVENTF_LEFTDOWN])
+        self.release_inputs = self.make_inputs([self.MOUSEEVENTF_LEFTUP])
+
+    def make_inputs(self, flags: List[int]):
+        inputs = (self.INPUT * len(flags))()
+        for index, flag in enumerate(flags):
+            inputs[index].type = self.INPUT_MOUSE
+            inputs[index].union.mi = self.MOUSEINPUT(0, 0, 0, flag, 0, 0)
+        return inputs
+
+    def send(self, inputs):
+        # 一次注入多个事件，返回成功注入的数目
+        sent = self.send_input(len(inputs), ctypes.byref(inputs), self.input_size)
+        if sent != len(inputs):
+            raise ctypes.WinError(ctypes.get_last_error())
+        return sent
+
+    def read_position(self) -> Tuple[int, int]:
+        self.get_cursor_pos(ctypes.byref(self.point))
+        return self.point.x, self.point.y
+
+    def press_left(self):
+        self.send(self.press_inputs)
+
+    def release_left(self):
+        self.send(self.release_inputs)
+
+
+class UinputBackend(InputBackend):
+    # Linux uinput 风格的实现：按照内核 struct input_event 的格式写入按键与同步事件，每次按下或松开只有一次 write
+    # 实际的 /dev/uinput 还需要通过 ioctl 注册设备，这里默认写入 os.devnull，仅用于测试与对比系统调用的开销
+    # uinput 无法读取鼠标位置，返回最近一次通过 move_to 设置的位置
+    name = BACKEND_UINPUT
+
+    # struct input_event: struct timeval (秒, 微秒), type, code, value
+    EVENT_STRUCT = struct.Struct("llHHi")
+    EV_SYN = 0x00
+    EV_KEY = 0x01
+    SYN_REPORT = 0
+    BTN_LEFT = 0x110
+
+    def __init__(self, path: str = os.devnull):
+        super().__init__()
+        self.fd = os.open(path, os.O_WRONLY)
+        self.current_position = (0, 0)
+
+        # 时间戳由内核填写，写入时为 0，按下与松开的数据可预先打包好
+        self.press_bytes = self.pack([(self.EV_KEY, self.BTN_LEFT, 1), (self.EV_SYN, self.SYN_REPORT, 0)])
+        self.release_bytes = self.pack([(self.EV_KEY, self.BTN_LEFT, 0), (self.EV_SYN, self.SYN_REPORT, 0)])
+
+    def pack(self, events: List[Tuple[int, int, int]]) -> bytes:
+        return b"".join(self.EVENT_STRUCT.pack(0, 0, event_type, code, value) for event_type, code, value in events)
+
+    def move_to(self, x: int, y: int):
+        self.current_position = (x, y)
+
+    def read_position(self) -> Tuple[int, int]:
+        return self.current_position
+
+    def press_left(self):
+        os.write(self.fd, self.press_bytes)
+
+    def release_left(self):
+        os.write(self.fd, self.release_bytes)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class RecordingBackend(InputBackend):
+    # 不操作真实的鼠标，仅按顺序记录每次调用及其时间点，用于测试与回放
+    name = BACKEND_RECORDING
+
+    def __init__(self, clock: Clock = real_clock):
+        super().__init__()
+        self.clock = clock
+        self.current_position = (0, 0)
+        # (调用, 时间点ns)
+        self.calls: List[Tuple[str, int]] = []
+        self.holds_ns: List[int] = []
+        self.pressed_at: Optional[int] = None
+
+    def move_to(self, x: int, y: int):
+        self.current_position = (x, y)
+
+    def read_position(self) -> Tuple[int, int]:
+        self.calls.append(("position", self.clock.perf_counter_ns()))
+        return self.current_position
+
+    def press_left(self):
+        self.pressed_at = self.clock.perf_counter_ns()
+        self.calls.append(("press", self.pressed_at))
+
+    def release_left(self):
+        now = self.clock.perf_counter_ns()
+        self.calls.append(("release", now))
+        if self.pressed_at is not None:
+            self.holds_ns.append(now - self.pressed_at)
+            self.pressed_at = None
+
+
+BACKENDS = {
+    BACKEND_PYNPUT: PynputBackend,
+    BACKEND_SENDINPUT: SendInputBackend,
+    BACKEND_UINPUT: UinputBackend,
+    BACKEND_RECORDING: RecordingBackend,
+}
+# 会真正操作鼠标的实现
+REAL_INPUT_BACKENDS = [BACKEND_PYNPUT, BACKEND_SENDINPUT]
+
+
+def create_input_backend(name: str = BACKEND_AUTO, real_input=False) -> InputBackend:
+    # real_input 为 True 时仅允许会真正操作鼠标的实现
+    if name == BACKEND_AUTO:
+        name = BACKEND_SENDINPUT if sys.platform == "win32" else BACKEND_PYNPUT
+
+    choices = REAL_INPUT_BACKENDS if real_input else list(BACKENDS)
+    if name not in choices:
+        raise ValueError(f"未知或不可用的输入实现 {name}，可选的有 {', '.join([BACKEND_AUTO] + choices)}")
+
+    return BACKENDS[name]()
+
+
+def benchmark(calls=10_000, real_input=False):
+    # 对当前机器上可用的各个实现分别进行大量的 读取位置、按下、松开 调用，统计每次调用的耗时
+    # pynput 与 sendinput 会真正操作鼠标（按下并立即松开左键），仅在 real_input 为 True 时测试
+    class UnbatchedUinputBackend(UinputBackend):
+        # 按键与同步事件分两次写入，用于对比批量写入的效果
+        name = "uinput(逐个事件写入)"
+
+        def press_left(self):
+            os.write(self.fd, self.press_bytes[:self.EVENT_STRUCT.size])
+            os.write(self.fd, self.press_bytes[self.EVENT_STRUCT.size:])
+
+        def release_left(self):
+            os.write(self.fd, self.release_bytes[:self.EVENT_STRUCT.size])
+            os.write(self.fd, self.release_bytes[self.EVENT_STRUCT.size:])
+
+    backend_types = [UinputBackend, UnbatchedUinputBackend, RecordingBackend]
+    if real_input:
+        backend_types = [PynputBackend, SendInputBackend] + backend_types
+
+    for backend_type in backend_types:
+        try:
+            backend = backend_type()
+        except (ImportError, OSError) as e:
+            print(f"{backend_type.name}: 当前环境不可用 ({e})")
+            continue
+
+        for _ in range(calls):
+            backend.position()
+            backend.press()
+            backend.release()
+        backend.close()
+
+        print(backend.summary())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="统计各个鼠标输入实现每次调用的耗时，用于选择配置中的 input_backend")
+    parser.add_argument("--all", action="store_true", help="同时测试会真正操作鼠标的实现（pynput、sendinput），测试期间会不断按下并松开鼠标左键")
+    args = parser.parse_args()
+
+    benchmark(real_input=args.all)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,279 @@
+import itertools
+import queue
+import threading
+import time
+from typing import Hashable, Iterable, List, Optional, Tuple
+
+from data_struct import ConfigInterface
+
+
+class InputFilterConfig(ConfigInterface):
+    def __init__(self):
+        # 同一个按键在这么短的时间内再次按下时视为重复（如按键抖动），直接丢弃，正常连按两次的间隔远大于此
+        self.dedup_window_seconds = 0.03
+        # 按住不放时系统会持续产生自动重复（首次重复前的延迟最长约 1 秒），超过这么久没有收到该按键的按下或重复时，
+        # 认为松开事件丢失了，下次按下按新的按下处理，避免漏掉一次松开后该按键一直被当作自动重复丢弃
+        self.held_expire_seconds = 1.5
+        # 键盘监听线程与主循环之间的环形缓冲区大小（会向上取整为 2 的幂），满了之后新的按键会被丢弃
+        self.ring_capacity = 256
+
+
+class KeyFilter:
+    # 在键盘监听的回调中过滤按键：忽略无关的按键、按住不放时系统产生的自动重复、去重窗口内的重复按下
+    # 仅由监听线程调用，无需加锁
+    def __init__(self, cfg: InputFilterConfig, relevant_keys: Iterable[Hashable]):
+        self.cfg = cfg
+        self.relevant_keys = frozenset(relevant_keys)
+        self.dedup_window_ns = int(cfg.dedup_window_seconds * 1e9)
+        self.held_expire_ns = int(cfg.held_expire_seconds * 1e9)
+
+        # 当前处于按下状态的按键 -> 最近一次收到按下或自动重复的时间，松开前再次收到按下即为自动重复
+        self.held = {}
+        # 按键 -> 最近一次接受的按下时间
+        self.last_accepted_ns = {}
+
+        self.accepted = 0
+        self.dropped_irrelevant = 0
+        self.dropped_repeat = 0
+        self.dropped_duplicate = 0
+        # 因长时间未收到松开而被当作新的按下的次数
+        self.expired_held = 0
+
+    def accept_press(self, key, now_ns: Optional[int] = None) -> bool:
+        if key not in self.relevant_keys:
+            self.dropped_irrelevant += 1
+            return False
+
+        now_ns = now_ns if now_ns is not None else time.perf_counter_ns()
+        last_held_ns = self.held.get(key)
+        self.held[key] = now_ns
+        if last_held_ns is not None:
+            if now_ns - last_held_ns < self.held_expire_ns:
+                self.dropped_repeat += 1
+                return False
+            self.expired_held += 1
+
+        if now_ns - self.last_accepted_ns.get(key, -self.dedup_window_ns) < self.dedup_window_ns:
+            self.dropped_duplicate += 1
+            return False
+
+        self.last_accepted_ns[key] = now_ns
+        self.accepted += 1
+        return True
+
+    def release(self, key):
+        self.held.pop(key, None)
+
+    def summary(self) -> str:
+        return f"接受={self.accepted} 无关按键={self.dropped_irrelevant} 自动重复={self.dropped_repeat} 去重={self.dropped_duplicate} 未收到松开={self.expired_held}"
+
+
+class SpscRing:
+    # 有界的单生产者单消费者环形缓冲区，push 仅由一个线程调用，pop 仅由另一个线程调用，双方都不需要加锁
+    # 生产者先写入槽位再推进 tail，消费者读取槽位后再推进 head，各自只修改自己的下标（CPython 中属性赋值是原子的）
+    def __init__(self, capacity: int):
+        size = 1
+        while size < capacity:
+            size *= 2
+
+        self.mask = size - 1
+        self.slots: List[object] = [None] * size
+        self.head = 0
+        self.tail = 0
+
+        self.dropped_full = 0
+
+    def __len__(self) -> int:
+        return self.tail - self.head
+
+    def push(self, item) -> bool:
+        tail = self.tail
+        if tail - self.head > self.mask:
+            self.dropped_full += 1
+            return False
+
+        self.slots[tail & self.mask] = item
+        self.tail = tail + 1
+        return True
+
+    def peek(self):
+        # 仅由消费者调用，返回下一个元素但不取出
+        head = self.head
+        if head == self.tail:
+            return None
+
+        return self.slots[head & self.mask]
+
+    def pop(self):
+        head = self.head
+        if head == self.tail:
+            return None
+
+        index = head & self.mask
+        item = self.slots[index]
+        self.slots[index] = None
+        self.head = head + 1
+        return item
+
+
+class EventInbox:
+    # 主循环的事件来源：键盘监听线程通过环形缓冲区投递，落地检测、输入系数等其他线程通过队列投递
+    # 投递时为每个事件分配递增的序号，主循环按序号合并两个来源，保证按投递的先后顺序处理
+    # 主循环在两者都为空时等待唤醒
+    def __init__(self, ring_capacity=256):
+        self.ring = SpscRing(ring_capacity)
+        self.others: queue.SimpleQueue = queue.SimpleQueue()
+        self.wakeup = threading.Event()
+        # itertools.count 的 next 在 CPython 中是原子的，可由多个线程同时调用
+        self.sequence = itertools.count()
+        # 已从 others 中取出、但序号比环形缓冲区中的下一个事件大而尚未返回的 (序号, 事件)
+        self.pending_other: Optional[Tuple[int, object]] = None
+
+    def push_from_listener(self, event) -> bool:
+        # 仅由键盘监听线程调用，缓冲区满时丢弃并返回 False
+        # 写入环形缓冲区不需要加锁，但唤醒主循环的 Event.set 内部会短暂获取 Event 的条件锁
+        if not self.ring.push((next(self.sequence), event)):
+            return False
+
+        self.wakeup.set()
+        return True
+
+    def post(self, event):
+        # 可由任意线程调用
+        self.others.put((next(self.sequence), event))
+        self.wakeup.set()
+
+    def poll(self):
+        if self.pending_other is None:
+            try:
+                self.pending_other = self.others.get_nowait()
+            except queue.Empty:
+                pass
+
+        listener, other = self.ring.peek(), self.pending_other
+        if listener is not None and (other is None or listener[0] < other[0]):
+            self.ring.pop()
+            return listener[1]
+
+        if other is not None:
+            self.pending_other = None
+            return other[1]
+
+        return None
+
+    def get(self, timeout: Optional[float] = None):
+        # 仅由主循环调用，timeout 为 None 时一直等待到有事件为止，超时返回 None
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            event = self.poll()
+            if event is not None:
+                return event
+
+            # 先清除再检查一次，避免在两次检查之间投递的事件的唤醒被清除掉
+            self.wakeup.clear()
+            event = self.poll()
+            if event is not None:
+                return event
+
+            if deadline is None:
+                self.wakeup.wait()
+            else:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self.wakeup.wait(remaining):
+                    return None
+
+
+def benchmark(bursts=200, repeats_per_hold=30, handler_us=2000, seed=0):
+    # 模拟按键风暴：反复按住 左ctrl 产生大量自动重复，夹杂无关按键与抖动导致的重复按下，主循环每处理一个事件耗时 handler_us
+    # 对比原来（所有按下都经队列送到主循环）与现在（监听回调中过滤后经环形缓冲区送到主循环）时送达的事件数、丢弃数与从按下到开始处理的延迟
+    import random
+
+    from press import Histogram
+
+    relevant = ["ctrl_l", "a", "s", "z", "x", "c", "esc"]
+    cfg = InputFilterConfig()
+
+    def storm() -> Tuple[List[tuple], int]:
+        # 返回 [(按下/松开, 按键, 与上一个事件的间隔秒)] 与其中有效的按下数（每次按住无论抖动与自动重复只算一次），两次有效按下之间的间隔均大于去重窗口
+        rnd = random.Random(seed)
+        events = []
+        meaningful = 0
+        for _ in range(bursts):
+            key = rnd.choice(relevant + ["w", "shift", "space"])
+            meaningful += int(key in relevant)
+            events.append(("press", key, rnd.uniform(cfg.dedup_window_seconds + 0.005, cfg.dedup_window_seconds + 0.02)))
+            if rnd.random() < 0.2:
+                # 抖动：松开后立即再次按下
+                events.append(("release", key, 0.001))
+                events.append(("press", key, 0.001))
+            if key == "ctrl_l":
+                for _ in range(repeats_per_hold):
+                    events.append(("press", key, 0.0005))
+            events.append(("release", key, 0.001))
+        return events, meaningful
+
+    def handle(handled: List[int], latency: Histogram, posted_at_ns: int):
+        latency.add(time.perf_counter_ns() - posted_at_ns)
+        handled.append(posted_at_ns)
+        # 处理事件主要是输出日志等IO操作，期间会释放GIL
+        time.sleep(handler_us / 1e6)
+
+    events, meaningful = storm()
+    presses = sum(1 for kind, _, _ in events if kind == "press")
+
+    # 原来的实现：监听回调中仅按映射表忽略无关按键，其余的全部放入队列，按下不放时的自动重复也会逐个送到主循环
+    legacy_queue: queue.Queue = queue.Queue()
+    legacy_latency, legacy_handled = Histogram(bucket_width_us=100), []
+
+    def legacy_consume():
+        while True:
+            posted_at_ns = legacy_queue.get()
+            if posted_at_ns is None:
+                return
+            handle(legacy_handled, legacy_latency, posted_at_ns)
+
+    consumer = threading.Thread(target=legacy_consume)
+    consumer.start()
+    start = time.perf_counter()
+    for kind, key, interval in events:
+        time.sleep(interval)
+        if kind == "press" and key in relevant:
+            legacy_queue.put(time.perf_counter_ns())
+    legacy_queue.put(None)
+    consumer.join()
+    legacy_seconds = time.perf_counter() - start
+
+    # 现在的实现
+    key_filter = KeyFilter(cfg, relevant)
+    inbox = EventInbox(cfg.ring_capacity)
+    latency, handled = Histogram(bucket_width_us=100), []
+    stop = object()
+
+    def consume():
+        while True:
+            posted_at_ns = inbox.get()
+            if posted_at_ns is stop:
+                return
+            handle(handled, latency, posted_at_ns)
+
+    consumer = threading.Thread(target=consume)
+    consumer.start()
+    start = time.perf_counter()
+    for kind, key, interval in events:
+        time.sleep(interval)
+        if kind == "release":
+            key_filter.release(key)
+        elif key_filter.accept_press(key):
+            inbox.push_from_listener(time.perf_counter_ns())
+    inbox.post(stop)
+    consumer.join()
+    seconds = time.perf_counter() - start
+
+    print(f"模拟按键风暴: 按下事件 {presses} 个（含自动重复与抖动），其中有效的按下 {meaningful} 个，主循环处理每个事件耗时 {handler_us}us")
+    print(f"原来: 送达主循环 {len(legacy_handled)} 个，总耗时 {legacy_seconds:.2f}秒，按下到开始处理的延迟 {legacy_latency.summary()}")
+    print(f"现在: 送达主循环 {len(handled)} 个，总耗时 {seconds:.2f}秒，按下到开始处理的延迟 {latency.summary()}")
+    print(f"现在: 过滤 {key_filter.summary()}，缓冲区满丢弃={inbox.ring.dropped_full}")
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,385 @@
+import collections
+import math
+import os.path
+import struct
+import threading
+import time
+from collections import namedtuple
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from data_struct import ConfigInterface
+from log import logger
+
+# 跳跃的结果
+OUTCOME_UNKNOWN = 0
+OUTCOME_LANDED = 1
+OUTCOME_MISSED = 2
+OUTCOME_CANCELLED = 3
+
+# 文件头：魔数、版本号、单条记录的字节数、保留
+HEADER_STRUCT = struct.Struct("<4sIII")
+JOURNAL_MAGIC = b"MJRJ"
+JOURNAL_VERSION = 1
+
+# 每次跳跃一条定长记录，offset 为实际落点与目标点的X差值，未知时为 NaN
+RECORD_DTYPE = np.dtype([
+    ("timestamp_ns", "<i8"),
+    ("block", "<i4"),
+    ("start_x", "<i4"),
+    ("start_y", "<i4"),
+    ("end_x", "<i4"),
+    ("end_y", "<i4"),
+    ("bounce_force", "<i2"),
+    ("outcome", "<i2"),
+    ("coefficient", "<f4"),
+    ("requested_ns", "<i8"),
+    ("actual_ns", "<i8"),
+    ("offset", "<f4"),
+])
+
+# 字段顺序与 RECORD_DTYPE 一致
+JournalEntry = namedtuple('JournalEntry', RECORD_DTYPE.names)
+
+
+class JournalConfig(ConfigInterface):
+    def __init__(self):
+        # 是否将每次跳跃记录到配置文件旁边的 jumps.journal 中
+        self.enabled = True
+        # 后台线程最长多久写一次文件
+        self.flush_interval_seconds = 1.0
+        # 积攒了这么多条记录时立即唤醒后台线程写入
+        self.batch_size = 256
+
+
+def make_entry(block: int, start_position, end_position, bounce_force: int, coefficient: float, requested_ns: int, actual_ns: int, outcome: int, offset: float = math.nan, timestamp_ns: Optional[int] = None) -> JournalEntry:
+    return JournalEntry(
+        timestamp_ns if timestamp_ns is not None else time.time_ns(),
+        block, start_position[0], start_position[1], end_position[0], end_position[1],
+        bounce_force, outcome, coefficient, requested_ns, actual_ns, offset,
+    )
+
+
+class JournalWriter:
+    # 追加写入跳跃记录，append 仅将记录放入队列，由后台线程批量写入文件，不会阻塞调用方
+    # 写入失败（如磁盘已满）时后台线程不会退出，未写入的记录留在队列中，下次重新打开文件后再写入；一直失败时队列最多保留 max_pending 条
+    def __init__(self, path: str, flush_interval_seconds=1.0, batch_size=256, max_pending=100_000):
+        self.path = path
+        self.flush_interval_seconds = flush_interval_seconds
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+
+        self.pending: collections.deque = collections.deque()
+        self.wakeup = threading.Event()
+        self.stopping = False
+        self.thread: Optional[threading.Thread] = None
+        self.file = None
+
+        # 最近一次写入失败的原因，写入成功后清除
+        self.error: Optional[Exception] = None
+
+        self.written = 0
+        # 因无法转换为记录格式或队列已满而丢弃的记录数
+        self.dropped = 0
+
+    def start(self):
+        if self.thread is not None:
+            return
+
+        self.file = open_for_append(self.path)
+        self.stopping = False
+        self.thread = threading.Thread(target=self.run, name="JournalWriter", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.thread is None:
+            return
+
+        self.stopping = True
+        self.wakeup.set()
+        self.thread.join()
+        self.thread = None
+
+        if len(self.pending) > 0:
+            logger.warning(f"跳跃记录写入失败，退出时仍有 {len(self.pending)} 条记录未能写入 {self.path}: {self.error}")
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def append(self, entry: JournalEntry) -> bool:
+        # deque 的 append 是线程安全的，调用方无需加锁；写入一直失败导致队列已满时丢弃并返回 False
+        if len(self.pending) >= self.max_pending:
+            if self.dropped == 0:
+                logger.warning(f"跳跃记录写入一直失败，队列已满，之后的记录将被丢弃: {self.error}")
+            self.dropped += 1
+            return False
+
+        self.pending.append(entry)
+        if len(self.pending) >= self.batch_size:
+            self.wakeup.set()
+        return True
+
+    def run(self):
+        while not self.stopping:
+            self.wakeup.wait(self.flush_interval_seconds)
+            self.wakeup.clear()
+            self.flush_safely()
+
+        self.flush_safely()
+
+    def flush_safely(self):
+        # 任何意外的异常都不能让后台线程退出，否则之后的记录只会在队列中不断堆积
+        try:
+            self.flush()
+        except Exception as e:
+            self.error = e
+            logger.exception(f"写入跳跃记录时出现意外错误: {e}")
+
+    def flush(self):
+        batch = []
+        while self.pending:
+            batch.append(self.pending.popleft())
+        if len(batch) == 0:
+            return
+
+        data, batch = self.pack(batch)
+        start = None
+        try:
+            if self.file is None:
+                self.file = open_for_append(self.path)
+            start = self.file.tell()
+            self.file.write(data)
+            self.file.flush()
+        except OSError as e:
+            if self.error is None:
+                logger.warning(f"写入跳跃记录到 {self.path} 失败，将在之后重试: {e}")
+            self.error = e
+            # 已完整写入的记录不再重复写入，其余的放回队列的最前面
+            kept = self.reopen(start)
+            self.written += kept
+            self.pending.extendleft(reversed(batch[kept:]))
+            return
+
+        if self.error is not None:
+            logger.info("写入跳跃记录已恢复正常")
+            self.error = None
+        self.written += len(data) // RECORD_DTYPE.itemsize
+
+    def pack(self, batch: List[JournalEntry]) -> Tuple[bytes, List[JournalEntry]]:
+        # 返回写入的数据及其中包含的记录
+        try:
+            return np.array(batch, dtype=RECORD_DTYPE).tobytes(), batch
+        except (TypeError, ValueError, OverflowError):
+            # 存在无法转换的记录，逐条转换并丢弃这些记录，不影响其他记录
+            pass
+
+        records, entries = [], []
+        for entry in batch:
+            try:
+                records.append(np.array([entry], dtype=RECORD_DTYPE).tobytes())
+                entries.append(entry)
+            except (TypeError, ValueError, OverflowError) as e:
+                self.dropped += 1
+                logger.warning(f"跳跃记录无法转换为记录格式，已丢弃: {entry} {e}")
+        return b"".join(records), entries
+
+    def reopen(self, start: Optional[int]) -> int:
+        # 关闭写入失败的文件，重新打开时会截断到完整记录的末尾，返回失败前已完整写入的记录数
+        if self.file is not None:
+            try:
+                self.file.close()
+            except OSError:
+                pass
+            self.file = None
+
+        try:
+            self.file = open_for_append(self.path)
+        except OSError:
+            return 0
+
+        if start is None:
+            return 0
+        return max(0, (self.file.tell() - start) // RECORD_DTYPE.itemsize)
+
+
+def open_for_append(path: str):
+    directory = os.path.dirname(path)
+    if directory != "":
+        os.makedirs(directory, exist_ok=True)
+
+    if os.path.isfile(path) and os.path.getsize(path) >= HEADER_STRUCT.size:
+        if read_header(path) == (JOURNAL_MAGIC, JOURNAL_VERSION, RECORD_DTYPE.itemsize):
+            journal_file = open(path, "ab")
+            # 上次异常退出时可能留下不完整的记录，截断到完整记录的末尾
+            size = os.path.getsize(path)
+            records_size = (size - HEADER_STRUCT.size) // RECORD_DTYPE.itemsize * RECORD_DTYPE.itemsize
+            if HEADER_STRUCT.size + records_size != size:
+                journal_file.truncate(HEADER_STRUCT.size + records_size)
+            return journal_file
+
+        backup_path = path + ".old"
+        logger.warning(f"跳跃记录文件 {path} 的格式与当前版本不一致，将其重命名为 {backup_path} 后重新开始记录")
+        os.replace(path, backup_path)
+
+    journal_file = open(path, "wb")
+    journal_file.write(HEADER_STRUCT.pack(JOURNAL_MAGIC, JOURNAL_VERSION, RECORD_DTYPE.itemsize, 0))
+    return journal_file
+
+
+def journal_path(config_path: str) -> str:
+    return os.path.join(os.path.dirname(config_path), "jumps.journal")
+
+
+def read_header(path: str) -> Tuple[bytes, int, int]:
+    with open(path, "rb") as journal_file:
+        magic, version, record_size, _ = HEADER_STRUCT.unpack(journal_file.read(HEADER_STRUCT.size))
+    return magic, version, record_size
+
+
+class JournalReader:
+    # 通过内存映射读取跳跃记录，查询时按需为 block、bounce_force 等字段建立排序索引
+    def __init__(self, path: str):
+        self.path = path
+
+        count = 0
+        if os.path.isfile(path) and os.path.getsize(path) > HEADER_STRUCT.size:
+            magic, version, record_size = read_header(path)
+            if (magic, version, record_size) != (JOURNAL_MAGIC, JOURNAL_VERSION, RECORD_DTYPE.itemsize):
+                raise ValueError(f"{path} 不是当前版本的跳跃记录文件")
+            count = (os.path.getsize(path) - HEADER_STRUCT.size) // RECORD_DTYPE.itemsize
+
+        if count > 0:
+            self.records = np.memmap(path, dtype=RECORD_DTYPE, mode="r", offset=HEADER_STRUCT.size, shape=(count,))
+        else:
+            self.records = np.zeros(0, dtype=RECORD_DTYPE)
+
+        # field -> (按该字段排序后的下标, 排序后的值)
+        self.indexes: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def index(self, field: str) -> Tuple[np.ndarray, np.ndarray]:
+        if field not in self.indexes:
+            column = np.asarray(self.records[field])
+            order = np.argsort(column, kind="stable")
+            self.indexes[field] = (order, column[order])
+        return self.indexes[field]
+
+    def lookup(self, field: str, value) -> np.ndarray:
+        # 返回该字段等于 value 的记录下标（按记录顺序）
+        order, sorted_values = self.index(field)
+        left, right = np.searchsorted(sorted_values, value, "left"), np.searchsorted(sorted_values, value, "right")
+        return np.sort(order[left:right])
+
+    def by_block(self, block: int) -> np.ndarray:
+        return self.records[self.lookup("block", block)]
+
+    def by_bounce_force(self, bounce_force: int) -> np.ndarray:
+        return self.records[self.lookup("bounce_force", bounce_force)]
+
+    def query(self, block: Optional[int] = None, bounce_force: Optional[int] = None, outcome: Optional[int] = None, since_ns: Optional[int] = None) -> np.ndarray:
+        # 组合多个条件，有索引的字段先通过索引缩小范围，其余条件在结果上过滤
+        indices = None
+        for field, value in [("block", block), ("bounce_force", bounce_force)]:
+            if value is None:
+                continue
+            matched = self.lookup(field, value)
+            indices = matched if indices is None else np.intersect1d(indices, matched, assume_unique=True)
+
+        records = self.records if indices is None else self.records[indices]
+        mask = np.ones(len(records), dtype=bool)
+        if outcome is not None:
+            mask &= records["outcome"] == outcome
+        if since_ns is not None:
+            mask &= records["timestamp_ns"] >= since_ns
+
+        return records[mask] if not mask.all() else records
+
+    def summary_by(self, field: str) -> str:
+        # 按字段分组统计 次数、落地率、平均落点偏差、平均按压误差
+        order, sorted_values = self.index(field)
+        values, starts = np.unique(sorted_values, return_index=True)
+        ends = list(starts[1:]) + [len(sorted_values)]
+
+        lines = []
+        for value, start, end in zip(values, starts, ends):
+            group = self.records[np.sort(order[start:end])]
+            landed = np.count_nonzero(group["outcome"] == OUTCOME_LANDED)
+            offsets = group["offset"][~np.isnan(group["offset"])]
+            press_error_us = (group["actual_ns"] - group["requested_ns"]).mean() / 1000
+            lines.append(
+                f"{field}={value}: 次数={len(group)} 落地率={landed / len(group):.1%} "
+                f"平均偏差={np.abs(offsets).mean() if len(offsets) > 0 else float('nan'):.2f}px 平均按压误差={press_error_us:.1f}us"
+            )
+
+        return "\n".join(lines)
+
+
+def benchmark(records=2_000_000, hot_path_appends=10_000):
+    # 统计热路径上 append 的耗时，以及百万级记录的写入、建立索引与查询耗时
+    import random
+    import tempfile
+
+    from press import Histogram
+
+    path = os.path.join(tempfile.mkdtemp(), "jumps.journal")
+    rnd = random.Random(0)
+
+    def random_entry(index: int) -> JournalEntry:
+        requested_ns = rnd.randint(100_000_000, 3_000_000_000)
+        return make_entry(
+            index // 3, (rnd.randint(0, 1920), 700), (rnd.randint(0, 1920), 720), rnd.choice([90, 100, 110]), 1.5,
+            requested_ns, requested_ns + rnd.randint(-50_000, 50_000), rnd.choice([OUTCOME_LANDED, OUTCOME_LANDED, OUTCOME_MISSED]), rnd.uniform(-20, 20),
+        )
+
+    writer = JournalWriter(path)
+    writer.start()
+    append_latency = Histogram(bucket_width_us=1)
+    entries = [random_entry(index) for index in range(hot_path_appends)]
+    for entry in entries:
+        start = time.perf_counter_ns()
+        writer.append(entry)
+        append_latency.add(time.perf_counter_ns() - start)
+        time.sleep(0.00005)
+    writer.stop()
+    print(f"热路径 append 耗时: {append_latency.summary()}")
+
+    # 批量生成大量记录，直接写入文件
+    start = time.perf_counter()
+    rng = np.random.default_rng(0)
+    bulk = np.zeros(records - hot_path_appends, dtype=RECORD_DTYPE)
+    bulk["timestamp_ns"] = time.time_ns() + np.arange(len(bulk))
+    bulk["block"] = rng.integers(1, 31, len(bulk))
+    bulk["bounce_force"] = rng.choice([90, 100, 110], len(bulk))
+    bulk["outcome"] = rng.choice([OUTCOME_LANDED, OUTCOME_MISSED], len(bulk), p=[0.9, 0.1])
+    bulk["offset"] = rng.normal(0, 5, len(bulk))
+    bulk["requested_ns"] = rng.integers(100_000_000, 3_000_000_000, len(bulk))
+    bulk["actual_ns"] = bulk["requested_ns"] + rng.integers(-50_000, 50_000, len(bulk))
+    with open_for_append(path) as journal_file:
+        journal_file.write(bulk.tobytes())
+    print(f"写入 {records} 条记录（{os.path.getsize(path) / 1024 / 1024:.1f}MB）耗时: {time.perf_counter() - start:.3f}秒")
+
+    reader = JournalReader(path)
+    for name, run in [
+        ("建立 block 索引", lambda: reader.index("block")[0]),
+        ("建立 bounce_force 索引", lambda: reader.index("bounce_force")[0]),
+        ("查询 block=15", lambda: reader.by_block(15)),
+        ("查询 bounce_force=90", lambda: reader.by_bounce_force(90)),
+        ("查询 block=15 且 bounce_force=110 且未落地", lambda: reader.query(block=15, bounce_force=110, outcome=OUTCOME_MISSED)),
+        ("按 bounce_force 分组统计", lambda: reader.summary_by("bounce_force").splitlines()),
+    ]:
+        start = time.perf_counter()
+        result = run()
+        print(f"{name}: {(time.perf_counter() - start) * 1000:.1f}ms 结果数目={len(result)}")
+
+    start = time.perf_counter()
+    matched = sum(1 for record in reader.records[:200_000] if record["block"] == 15)
+    print(f"(对比) 逐条遍历前20万条查询 block=15: {(time.perf_counter() - start) * 1000:.1f}ms 结果数目={matched}")
+
+    print(reader.summary_by("bounce_force"))
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -1,12 +1,19 @@
+import atexit
 import datetime
+import gzip
 import logging
+import logging.handlers
 import multiprocessing
+import multiprocessing.util
 import os
 import pathlib
 import platform
+import queue
+import shutil
+import threading
 import time
 from sys import exit
-from typing import Callable
+from typing import Callable, List, Optional
 
 import colorlog.escape_codes
 
@@ -74,7 +81,236 @@ consoleLogFormatter = colorlog.ColoredFormatter(
 consoleHandler = logging.StreamHandler()
 consoleHandler.setFormatter(consoleLogFormatter)
 consoleHandler.setLevel(logging.INFO)
-logger.addHandler(consoleHandler)
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    # 默认的 QueueHandler 会在调用方线程中先格式化好消息，这里改为原样放入队列，由后台线程中实际输出的handler负责格式化
+    # 因此通过参数传入的对象在放入队列后不应再被修改
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+# 实际输出日志的handler均由后台线程中的 logListener 调用，logger 上仅挂一个将日志放入队列的handler，避免控制台或文件输出阻塞调用方（如按压计时）
+logQueue: queue.SimpleQueue = queue.SimpleQueue()
+queueHandler = DeferredQueueHandler(logQueue)
+logger.addHandler(queueHandler)
+
+logListener = logging.handlers.QueueListener(logQueue, consoleHandler, respect_handler_level=True)
+logListener.start()
+
+
+def stop_log_listener():
+    # 等待后台线程输出完队列中剩余的日志后停止，可重复调用
+    if logListener._thread is not None:
+        logListener.stop()
+
+    # 文件日志是缓冲写入的，子进程中不会调用 logging.shutdown，需在这里写入文件
+    for handler in logListener.handlers:
+        handler.flush()
+
+
+# 退出时等待后台线程输出完队列中剩余的日志
+atexit.register(stop_log_listener)
+
+
+def add_handler(handler: logging.Handler):
+    # 添加实际输出日志的handler，将在后台线程中调用
+    logListener.handlers = logListener.handlers + (handler,)
+    update_queue_handler_level()
+
+
+def update_queue_handler_level():
+    # 所有handler都不会输出的级别无需放入队列，修改了handler的级别后需调用
+    queueHandler.setLevel(min(handler.level for handler in logListener.handlers))
+
+
+def debug_enabled() -> bool:
+    # 根 logger 固定为 DEBUG 级别，isEnabledFor 总是返回 True，实际是否会输出 debug 日志取决于 queueHandler 的级别（即所有handler中最低的级别）
+    return queueHandler.level <= logging.DEBUG and logger.isEnabledFor(logging.DEBUG)
+
+
+def restart_log_listener_in_child():
+    # fork 出的子进程中不存在父进程的后台线程，需要重新启动，否则子进程的日志将无人输出
+    logListener._thread = None
+    logListener.start()
+
+    # 汇总子进程日志的线程仅属于主进程，子进程中不应再停止它，但保留队列以便子进程通过 add_file_handler 使用
+    global aggregationListener
+    aggregationListener = None
+
+
+def register_exit_flush_in_child(_listener):
+    # multiprocessing 的子进程结束时直接调用 os._exit，不会执行 atexit 注册的函数，需通过其 Finalize 机制输出剩余日志
+    multiprocessing.util.Finalize(None, stop_log_listener, exitpriority=-100)
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=restart_log_listener_in_child)
+# 子进程启动时会先清空继承来的 Finalize，再调用这里注册的函数，fork 与 spawn 方式均适用
+multiprocessing.util.register_after_fork(logListener, register_exit_flush_in_child)
+
+update_queue_handler_level()
+
+
+class RotatingLogFileHandler(logging.Handler):
+    # 按大小或时间滚动的日志文件，滚动出的分段由后台线程压缩为 .gz，并在所有分段总大小超过上限时删除最旧的分段
+    # 日志先写入内存缓冲，达到 flush_level 级别、缓冲超过 buffer_bytes 或距上次写盘超过 flush_interval_seconds 时才写入文件
+    def __init__(
+        self,
+        filename: str,
+        max_bytes=10 * 1024 * 1024,
+        rotate_interval_seconds=24 * 3600,
+        max_total_bytes=200 * 1024 * 1024,
+        buffer_bytes=64 * 1024,
+        flush_interval_seconds=1.0,
+        flush_level=logging.WARNING,
+    ):
+        super().__init__()
+        self.filename = os.path.abspath(filename)
+        self.max_bytes = max_bytes
+        self.rotate_interval_seconds = rotate_interval_seconds
+        self.max_total_bytes = max_total_bytes
+        self.buffer_bytes = buffer_bytes
+        self.flush_interval_seconds = flush_interval_seconds
+        self.flush_level = flush_level
+
+        self.stream = None
+        self.buffer: List[bytes] = []
+        self.buffered_bytes = 0
+        self.file_bytes = 0
+        self.opened_at = time.monotonic()
+        self.last_flush_at = time.monotonic()
+        self.segment_index = 0
+        # 写盘次数，用于性能测试
+        self.writes = 0
+
+        # 待压缩的分段，None 表示停止
+        self.segments: queue.SimpleQueue = queue.SimpleQueue()
+        self.closed = threading.Event()
+        self.worker = threading.Thread(target=self.maintain, name="LogFileMaintenance", daemon=True)
+        self.worker.start()
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            data = (self.format(record) + "\n").encode("utf-8")
+        except Exception:
+            self.handleError(record)
+            return
+
+        self.buffer.append(data)
+        self.buffered_bytes += len(data)
+
+        if self.file_bytes + self.buffered_bytes >= self.max_bytes or time.monotonic() - self.opened_at >= self.rotate_interval_seconds:
+            self.rotate()
+        elif record.levelno >= self.flush_level or self.buffered_bytes >= self.buffer_bytes:
+            self.write_buffer()
+
+    def write_buffer(self):
+        # 调用方需持有 self.lock
+        self.last_flush_at = time.monotonic()
+        if len(self.buffer) == 0:
+            return
+
+        if self.stream is None:
+            self.stream = open(self.filename, "ab")
+            self.file_bytes = self.stream.tell()
+
+        self.stream.write(b"".join(self.buffer))
+        self.stream.flush()
+        self.writes += 1
+        self.file_bytes += self.buffered_bytes
+        self.buffer.clear()
+        self.buffered_bytes = 0
+
+    def rotate(self):
+        # 调用方需持有 self.lock，将当前文件重命名为新的分段，交给后台线程压缩
+        self.write_buffer()
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+
+        root, ext = os.path.splitext(self.filename)
+        while True:
+            self.segment_index += 1
+            segment = f"{root}_{self.segment_index:03d}{ext}"
+            if not os.path.exists(segment) and not os.path.exists(segment + ".gz"):
+                break
+
+        os.replace(self.filename, segment)
+        self.segments.put(segment)
+
+        self.file_bytes = 0
+        self.opened_at = time.monotonic()
+
+    def flush(self):
+        self.acquire()
+        try:
+            self.write_buffer()
+        finally:
+            self.release()
+
+    def close(self):
+        self.acquire()
+        try:
+            if not self.closed.is_set():
+                self.write_buffer()
+                if self.stream is not None:
+                    self.stream.close()
+                    self.stream = None
+
+                self.closed.set()
+                self.segments.put(None)
+        finally:
+            self.release()
+
+        # 等待已滚动的分段压缩完成
+        self.worker.join()
+        super().close()
+
+    def maintain(self):
+        while True:
+            try:
+                segment = self.segments.get(timeout=self.flush_interval_seconds)
+            except queue.Empty:
+                # 定时将缓冲中的日志写入文件
+                if time.monotonic() - self.last_flush_at >= self.flush_interval_seconds:
+                    self.flush()
+                continue
+
+            if segment is None:
+                break
+
+            try:
+                self.compress(segment)
+                self.remove_oldest_segments()
+            except OSError as e:
+                print(f"压缩日志分段 {segment} 失败，e={e}")
+
+    def compress(self, segment: str):
+        with open(segment, "rb") as source, gzip.open(segment + ".gz.tmp", "wb") as target:
+            shutil.copyfileobj(source, target)
+        os.replace(segment + ".gz.tmp", segment + ".gz")
+        os.remove(segment)
+
+    def segment_files(self) -> List[str]:
+        # 按从旧到新的顺序返回已压缩的分段
+        root, ext = os.path.splitext(os.path.basename(self.filename))
+        directory = os.path.dirname(self.filename)
+        prefix = f"{root}_"
+        suffix = f"{ext}.gz"
+        paths = [os.path.join(directory, name) for name in os.listdir(directory) if name.startswith(prefix) and name.endswith(suffix)]
+        return sorted(paths, key=lambda path: (os.path.getmtime(path), path))
+
+    def remove_oldest_segments(self):
+        # 当前文件按滚动前可能达到的最大大小计算，确保总大小始终不超过上限
+        segments = self.segment_files()
+        total_bytes = self.max_bytes + sum(os.path.getsize(segment) for segment in segments)
+        for segment in segments:
+            if total_bytes <= self.max_total_bytes:
+                break
+
+            total_bytes -= os.path.getsize(segment)
+            os.remove(segment)
 
 
 # 文件输出需自行调用，不会默认创建
@@ -95,41 +331,87 @@ def add_file_handler(log_directory="logs", logger_name="", deal_with_multiproces
     log_filename = f"{log_directory}/{logger.name}_{time_str}.log"
 
     if deal_with_multiprocessing:
-        # 为了兼容多进程模式，仅主进程确定日志文件名并存盘，后续其他进程则读取该文件内容作为写日志的目标地址，比如出现很多日志文件
+        # 多进程模式下仅主进程写日志文件，其他进程的日志通过队列发送给主进程汇总输出，见 child_logging_args
         process_name = multiprocessing.current_process().name
+        if multiprocessing.parent_process() is not None:
+            if aggregationQueue is not None:
+                # fork 出的子进程继承了主进程的日志队列，直接使用
+                init_child_logging(aggregationQueue, queueHandler.level)
+                return
 
-        log_filename_file = ".log.filename"
-        if "MainProcess" in process_name:
-            log_filename = f"{log_directory}/{logger.name}_{process_name}_{time_str}.log"
-            pathlib.Path(log_filename_file).write_text(log_filename, encoding="utf-8")
-
-        for _i in range(3):
-            try:
-                with open(log_filename_file, encoding="utf-8") as f:
-                    log_filename = f.read()
-            except Exception as e:
-                print(f"读取日志文件名的时候出错了，等待一秒，e={e}")
-            if log_filename != "":
-                break
+            print("子进程未通过 init_child_logging 传入主进程的日志队列，只能另建一个日志文件了~")
 
-            time.sleep(1)
-
-        if log_filename == "":
-            print("无法读取到主进程的日志文件名，只能另建一个了~")
-            time_str = datetime.datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
-            log_filename = f"{log_directory}/{logger.name}_{process_name}_{time_str}.log"
+        log_filename = f"{log_directory}/{logger.name}_{process_name}_{time_str}.log"
 
     # 初始化fileHandler
-    fileHandler = logging.FileHandler(log_filename, encoding="utf-8", delay=True)
+    fileHandler = RotatingLogFileHandler(log_filename)
     fileLogFormatter = logging.Formatter(fileFmtStr)
     fileHandler.setFormatter(fileLogFormatter)
     fileHandler.setLevel(logging.DEBUG)
 
-    logger.addHandler(fileHandler)
+    add_handler(fileHandler)
+
+    if deal_with_multiprocessing:
+        start_log_aggregation()
+
+
+# 多进程日志汇总：主进程持有唯一的日志输出，子进程通过 multiprocessing 队列将日志发送给主进程，由主进程的后台线程转交给 logListener 输出
+aggregationQueue: Optional[multiprocessing.Queue] = None
+aggregationListener: Optional[logging.handlers.QueueListener] = None
+
+
+def start_log_aggregation() -> multiprocessing.Queue:
+    global aggregationQueue, aggregationListener
+
+    if aggregationListener is None:
+        aggregationQueue = multiprocessing.Queue()
+        # 子进程发来的日志已格式化好消息，原样放入本进程的日志队列，由各handler按自身的级别输出
+        aggregationListener = logging.handlers.QueueListener(aggregationQueue, DeferredQueueHandler(logQueue))
+        aggregationListener.start()
+
+    return aggregationQueue
+
+
+def stop_log_aggregation():
+    # 在 stop_log_listener 之前调用，确保子进程发来的日志也能输出
+    if aggregationListener is not None and aggregationListener._thread is not None:
+        aggregationListener.stop()
+
+
+# atexit 的调用顺序与注册顺序相反，汇总子进程日志的线程会先于 logListener 停止
+atexit.register(stop_log_aggregation)
+
+
+def child_logging_args() -> tuple:
+    # 在主进程中调用，返回值作为子进程（或进程池的 initializer）的参数传给 init_child_logging，spawn 方式启动的子进程也适用
+    return start_log_aggregation(), queueHandler.level
+
+
+def init_child_logging(log_queue: Optional[multiprocessing.Queue], level=logging.DEBUG):
+    # 在子进程中调用，此后本进程的日志均发送给主进程统一输出
+    if log_queue is None:
+        return
+
+    # 标准的 QueueHandler 会先格式化好消息并去掉参数与异常对象，确保日志可以 pickle 后发送
+    childHandler = logging.handlers.QueueHandler(log_queue)
+    childHandler.setLevel(level)
+
+    logger.removeHandler(queueHandler)
+    logger.addHandler(childHandler)
+    stop_log_listener()
+
+
+# 颜色名称到转义码的缓存，避免每次调用都重新解析
+color_escape_codes = {}
 
 
 def color(color_name):
-    return consoleLogFormatter._get_escape_code(consoleLogFormatter.log_colors, color_name)
+    escape_code = color_escape_codes.get(color_name)
+    if escape_code is None:
+        escape_code = consoleLogFormatter._get_escape_code(consoleLogFormatter.log_colors, color_name)
+        color_escape_codes[color_name] = escape_code
+
+    return escape_code
 
 
 def with_color(color_name: str, value) -> str:
@@ -143,8 +425,191 @@ def get_log_func(log_func: Callable, show_log=True) -> Callable:
     return log_func
 
 
+def benchmark(calls=5000, console_write_seconds=0.0002):
+    # 模拟较慢的控制台（每次写入耗时 console_write_seconds），统计在调用方线程中每次 logger.info 的耗时
+    # 对比 直接在调用方线程中输出（原来的方式） 与 通过队列由后台线程输出 两种方式
+    import io
+    import sys
+    import timeit
+
+    from press import Histogram
+
+    class SlowConsole(io.StringIO):
+        def write(self, s):
+            time.sleep(console_write_seconds)
+            return super().write(s)
+
+    def measure() -> Histogram:
+        histogram = Histogram(bucket_width_us=1)
+        for i in range(calls):
+            start = time.perf_counter_ns()
+            logger.info(color("bold_green") + f"预计需要按住左键 {i / 1000} 秒 (实际速度=300 弹跳力=100)")
+            histogram.add(time.perf_counter_ns() - start)
+        return histogram
+
+    uncached_ns = timeit.timeit(lambda: consoleLogFormatter._get_escape_code(consoleLogFormatter.log_colors, "bold_green"), number=calls) / calls * 1e9
+    cached_ns = timeit.timeit(lambda: color("bold_green"), number=calls) / calls * 1e9
+    print(f"color(): 每次解析 {uncached_ns:.0f}ns，缓存后 {cached_ns:.0f}ns")
+
+    slow_handler = logging.StreamHandler(SlowConsole())
+    slow_handler.setFormatter(consoleLogFormatter)
+    slow_handler.setLevel(logging.INFO)
+
+    # 直接在调用方线程中输出
+    original_handlers = logListener.handlers
+    logger.removeHandler(queueHandler)
+    logger.addHandler(slow_handler)
+    sync = measure()
+    logger.removeHandler(slow_handler)
+    logger.addHandler(queueHandler)
+
+    # 通过队列由后台线程输出
+    logListener.handlers = (slow_handler,)
+    asynchronous = measure()
+    drain_start = time.perf_counter()
+    while not logQueue.empty():
+        time.sleep(0.01)
+    drain_seconds = time.perf_counter() - drain_start
+    logListener.handlers = original_handlers
+
+    print(f"同步输出: {sync.summary()}", file=sys.stderr)
+    print(f"异步输出: {asynchronous.summary()} (后台线程在调用结束后又花了 {drain_seconds:.2f} 秒输出完剩余日志)", file=sys.stderr)
+
+    benchmark_file_handler()
+    benchmark_worker_startup()
+
+
+def benchmark_file_handler(records=100_000, max_bytes=1024 * 1024, max_total_bytes=1100 * 1024):
+    # 在后台线程所在的位置直接调用handler，统计每条日志写入文件的耗时：原来的 FileHandler 每条都会写入并flush，新的handler缓冲写入
+    # 同时使用较小的滚动大小与总大小上限，检查滚动、压缩与删除旧分段的结果
+    import tempfile
+
+    log_directory = tempfile.mkdtemp()
+    formatter = logging.Formatter(fileFmtStr)
+    log_records = [
+        logger.makeRecord(logger.name, logging.DEBUG, __file__, i, f"预计需要按住左键 {i / 1000} 秒 (实际速度=300 弹跳力=100)", (), None, "benchmark_file_handler")
+        for i in range(records)
+    ]
+
+    handlers = [
+        ("FileHandler", logging.FileHandler(os.path.join(log_directory, "file_handler.log"), encoding="utf-8")),
+        ("RotatingLogFileHandler", RotatingLogFileHandler(os.path.join(log_directory, "rotating.log"), max_bytes=max_bytes, max_total_bytes=max_total_bytes)),
+    ]
+    start = time.perf_counter()
+    for record in log_records:
+        formatter.format(record)
+    print(f"仅格式化: 平均每条 {(time.perf_counter() - start) / records * 1e6:.1f}us")
+
+    for name, handler in handlers:
+        handler.setFormatter(formatter)
+
+        start = time.perf_counter()
+        for record in log_records:
+            handler.handle(record)
+        elapsed = time.perf_counter() - start
+        handler.close()
+
+        # FileHandler 每条日志都会写入并flush一次
+        writes = getattr(handler, "writes", records)
+        print(f"{name}: 写入 {records} 条日志耗时 {elapsed:.2f}秒，平均每条 {elapsed / records * 1e6:.1f}us，写盘 {writes} 次")
+
+    log_files = sorted(os.listdir(log_directory))
+    total_bytes = sum(os.path.getsize(os.path.join(log_directory, name)) for name in log_files if name.startswith("rotating"))
+    print(f"滚动后的文件: {' '.join(log_files)}，rotating 总大小 {total_bytes / 1024:.0f}KB (上限 {max_total_bytes / 1024:.0f}KB)")
+
+    shutil.rmtree(log_directory, ignore_errors=True)
+
+
+def legacy_file_handler_in_worker(log_directory: str, log_filename_file: str) -> str:
+    # 原来的多进程方式：读取主进程写入文件中的日志文件名，读不到时最多等待三次，每次一秒，仅用于对比
+    log_filename = ""
+    for _i in range(3):
+        try:
+            with open(log_filename_file, encoding="utf-8") as f:
+                log_filename = f.read()
+        except Exception:
+            pass
+        if log_filename != "":
+            break
+
+        time.sleep(1)
+
+    if log_filename == "":
+        log_filename = f"{log_directory}/{logger.name}_{multiprocessing.current_process().name}.log"
+
+    fileHandler = logging.FileHandler(log_filename, encoding="utf-8", delay=True)
+    fileHandler.setFormatter(logging.Formatter(fileFmtStr))
+    add_handler(fileHandler)
+    return log_filename
+
+
+def benchmark_worker(mode: str, log_directory: str, log_filename_file: str, logging_args: tuple, ready: multiprocessing.Queue):
+    if mode == "legacy":
+        consoleHandler.setLevel(logging.WARNING)
+        legacy_file_handler_in_worker(log_directory, log_filename_file)
+    else:
+        init_child_logging(*logging_args)
+
+    logger.info(f"工作进程 {multiprocessing.current_process().name} 已启动")
+    ready.put(time.perf_counter())
+
+
+def benchmark_worker_startup(workers=4):
+    # 统计启动 workers 个工作进程直到各进程都能写日志所需的时间
+    # 原来的方式中，主进程在启动工作进程后才写入日志文件名，与实际使用时一样存在竞争，读到空文件的进程需等待一秒
+    import shutil
+    import tempfile
+
+    context = multiprocessing.get_context()
+    consoleLevel = consoleHandler.level
+    consoleHandler.setLevel(logging.WARNING)
+
+    for mode in ["legacy", "aggregation"]:
+        log_directory = tempfile.mkdtemp()
+        log_filename_file = os.path.join(log_directory, ".log.filename")
+        log_filename = os.path.join(log_directory, f"{mode}.log")
+        fileHandler = logging.FileHandler(log_filename, encoding="utf-8")
+        fileHandler.setFormatter(logging.Formatter(fileFmtStr))
+        add_handler(fileHandler)
+
+        # 原来的方式中，主进程先创建空的文件名文件，再写入内容
+        pathlib.Path(log_filename_file).write_text("", encoding="utf-8")
+        logging_args = child_logging_args() if mode == "aggregation" else (None,)
+
+        ready = context.Queue()
+        start = time.perf_counter()
+        processes = [context.Process(target=benchmark_worker, args=(mode, log_directory, log_filename_file, logging_args, ready)) for _ in range(workers)]
+        for process in processes:
+            process.start()
+        if mode == "legacy":
+            pathlib.Path(log_filename_file).write_text(log_filename, encoding="utf-8")
+
+        ready_at = [ready.get() for _ in processes]
+        elapsed = max(ready_at) - start
+        for process in processes:
+            process.join()
+
+        # 等待子进程发来的日志输出到文件
+        time.sleep(0.2)
+        while not logQueue.empty():
+            time.sleep(0.01)
+        logListener.handlers = tuple(handler for handler in logListener.handlers if handler is not fileHandler)
+        fileHandler.close()
+
+        log_files = [name for name in os.listdir(log_directory) if name.endswith(".log")]
+        with open(log_filename, encoding="utf-8") as f:
+            lines = sum(1 for line in f if "工作进程" in line)
+        print(f"{mode}: 启动 {workers} 个工作进程耗时 {elapsed:.2f}秒，日志文件数={len(log_files)}，主日志文件中的工作进程日志条数={lines}")
+
+        shutil.rmtree(log_directory, ignore_errors=True)
+
+    consoleHandler.setLevel(consoleLevel)
+    update_queue_handler_level()
+
+
 if __name__ == "__main__":
     consoleHandler.setLevel(logging.DEBUG)
+    update_queue_handler_level()
 
     logger.debug("debug")
     logger.info("info")
@@ -0,0 +1,298 @@
+import argparse
+import http.server
+import json
+import threading
+import time
+from typing import Dict, List, Optional
+
+from data_struct import ConfigInterface
+from press import BUCKET_COUNT, SUB_BUCKETS, bucket_upper_bound
+
+# 直方图按数值（纳秒）分桶，与 press.Histogram 的分桶方式相同
+# 每个线程的直方图单元中，桶之后依次为 次数 与 总和
+COUNT_INDEX = BUCKET_COUNT
+SUM_INDEX = BUCKET_COUNT + 1
+
+
+class MetricsConfig(ConfigInterface):
+    def __init__(self):
+        # 是否在本机开启统计数据的 HTTP 接口，长时间无人值守运行时可通过 python metrics.py 在另一个窗口查看
+        self.enabled = False
+        # 仅监听本机地址，不对外开放
+        self.host = "127.0.0.1"
+        self.port = 9137
+
+
+class Metrics:
+    # 进程内的计数器、数值与直方图，写入方为跳跃流程中的各个线程，读取方为统计接口的线程
+    # 计数器与直方图按线程分开存储，每个单元只有一个线程写入，更新只需常数时间且无需加锁，也不会丢失更新
+    # 读取时直接汇总各个线程的单元，不阻塞写入方，得到的是某一时刻附近的近似快照
+    def __init__(self):
+        self.start_time = time.time()
+
+        # 名称 -> {线程id: [值]}
+        self.counters: Dict[str, Dict[int, List[int]]] = {}
+        # 名称 -> 最近一次设置的值
+        self.gauges: Dict[str, float] = {}
+        # 名称 -> {线程id: [各个桶的次数..., 次数, 总和]}
+        self.histograms: Dict[str, Dict[int, List[int]]] = {}
+        # 仅在某个线程首次更新某个名称时用于创建单元，之后的更新不会用到
+        self.create_lock = threading.Lock()
+        # 当前线程的单元缓存，名称 -> 单元，计数器与直方图分开缓存，允许两者同名
+        self.local_counters = threading.local()
+        self.local_histograms = threading.local()
+
+    def cell(self, table: Dict[str, Dict[int, List[int]]], cache: threading.local, name: str, size: int) -> List[int]:
+        # 某个线程首次更新某个名称时创建单元并写入共享的表，之后直接从线程局部的缓存中取得
+        # 线程退出后其 id 可能被新线程复用，此时沿用已有的单元继续累加，不能覆盖掉之前线程的数据
+        # 同一时刻存活的线程 id 各不相同，因此每个单元仍然只有一个线程写入
+        with self.create_lock:
+            cell = table.setdefault(name, {}).setdefault(threading.get_ident(), [0] * size)
+        cache.__dict__[name] = cell
+        return cell
+
+    # 以下更新方法位于热路径上，将缓存查找与分桶计算直接写在方法内，避免额外的函数调用
+    def inc(self, name: str, amount=1):
+        cell = self.local_counters.__dict__.get(name)
+        if cell is None:
+            cell = self.cell(self.counters, self.local_counters, name, 1)
+        cell[0] += amount
+
+    def set(self, name: str, value: float):
+        self.gauges[name] = value
+
+    def observe(self, name: str, value_ns: int):
+        cell = self.local_histograms.__dict__.get(name)
+        if cell is None:
+            cell = self.cell(self.histograms, self.local_histograms, name, BUCKET_COUNT + 2)
+
+        if value_ns < SUB_BUCKETS:
+            cell[value_ns if value_ns > 0 else 0] += 1
+        else:
+            bits = value_ns.bit_length()
+            cell[(bits - 3) * SUB_BUCKETS + (value_ns >> (bits - 4)) - SUB_BUCKETS] += 1
+        cell[COUNT_INDEX] += 1
+        cell[SUM_INDEX] += value_ns
+
+    def snapshot(self) -> dict:
+        # 复制 dict 与 list 均在持有 GIL 的一次调用中完成，写入方在此期间新增的名称或线程不会导致遍历出错
+        counters = {name: sum(cell[0] for cell in tuple(cells.values())) for name, cells in tuple(self.counters.items())}
+
+        histograms = {}
+        for name, cells in tuple(self.histograms.items()):
+            merged = [0] * (BUCKET_COUNT + 2)
+            for cell in tuple(cells.values()):
+                for index, value in enumerate(cell[:]):
+                    if value:
+                        merged[index] += value
+            histograms[name] = summarize_histogram(merged)
+
+        return {
+            "uptime_seconds": time.time() - self.start_time,
+            "counters": counters,
+            "gauges": dict(self.gauges),
+            "histograms": histograms,
+        }
+
+
+def summarize_histogram(merged: List[int]) -> dict:
+    count = merged[COUNT_INDEX]
+    summary = {"count": count, "mean_us": merged[SUM_INDEX] / count / 1000 if count else 0.0}
+    for name, p in [("p50_us", 50), ("p95_us", 95), ("p99_us", 99), ("max_us", 100)]:
+        summary[name] = percentile_from_buckets(merged, count, p) / 1000
+    return summary
+
+
+def percentile_from_buckets(merged: List[int], count: int, p: float) -> int:
+    # 返回该百分位所在桶的上界
+    if count == 0:
+        return 0
+
+    rank = max(1, int(count * p / 100 + 0.5))
+    seen = 0
+    for index in range(BUCKET_COUNT):
+        seen += merged[index]
+        if seen >= rank:
+            return bucket_upper_bound(index)
+    return bucket_upper_bound(BUCKET_COUNT - 1)
+
+
+# 全局统计数据，各模块直接使用
+metrics = Metrics()
+
+
+class MetricsRequestHandler(http.server.BaseHTTPRequestHandler):
+    # GET /metrics 返回 JSON 格式的快照
+    def do_GET(self):
+        if self.path.rstrip("/") != "/metrics":
+            self.send_error(404)
+            return
+
+        body = json.dumps(self.server.metrics.snapshot(), ensure_ascii=False).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # 不输出访问日志，避免干扰主进程的控制台
+        return
+
+
+class MetricsServer:
+    # 在后台线程中提供统计数据的 HTTP 接口
+    def __init__(self, source: Metrics, host="127.0.0.1", port=9137):
+        self.source = source
+        self.host = host
+        self.port = port
+
+        self.server: Optional[http.server.ThreadingHTTPServer] = None
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self.thread is not None:
+            return
+
+        self.server = http.server.ThreadingHTTPServer((self.host, self.port), MetricsRequestHandler)
+        self.server.daemon_threads = True
+        self.server.metrics = self.source
+        # 端口为 0 时由系统分配
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, name="MetricsServer", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.thread is None:
+            return
+
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        self.thread = None
+        self.server = None
+
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}/metrics"
+
+
+def fetch(url: str, timeout=2.0) -> dict:
+    import urllib.request
+
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        return json.loads(response.read().decode("utf-8"))
+
+
+def format_snapshot(snapshot: dict) -> List[str]:
+    uptime = int(snapshot["uptime_seconds"])
+    lines = [f"已运行 {uptime // 3600}小时{uptime % 3600 // 60}分{uptime % 60}秒"]
+
+    for name, value in sorted(snapshot["gauges"].items()):
+        lines.append(f"  {name:<32} {value}")
+    for name, value in sorted(snapshot["counters"].items()):
+        lines.append(f"  {name:<32} {value}")
+
+    if snapshot["histograms"]:
+        lines.append(f"  {'分布':<30} {'次数':>8} {'平均':>10} {'p50':>10} {'p95':>10} {'p99':>10} {'max':>10}")
+        for name, summary in sorted(snapshot["histograms"].items()):
+            values = " ".join(f"{summary[key]:>8.1f}us" for key in ["mean_us", "p50_us", "p95_us", "p99_us", "max_us"])
+            lines.append(f"  {name:<32} {summary['count']:>8} {values}")
+
+    return lines
+
+
+def watch(url: str, interval_seconds: float):
+    # 定时拉取并在当前终端中刷新显示，与主进程的控制台互不影响
+    while True:
+        try:
+            lines = format_snapshot(fetch(url))
+        except OSError as e:
+            lines = [f"无法连接到 {url}: {e}"]
+
+        # 清屏并将光标移到左上角
+        print("\x1b[2J\x1b[H" + time.strftime("%H:%M:%S") + f" {url}\n" + "\n".join(lines), flush=True)
+        time.sleep(interval_seconds)
+
+
+def benchmark(updates=200_000, threads=4):
+    # 统计热路径上每次更新的耗时、多线程并发更新时计数是否准确，以及读取快照与通过 HTTP 拉取的耗时
+    local = Metrics()
+
+    start = time.perf_counter_ns()
+    for _ in range(updates):
+        pass
+    empty_ns = time.perf_counter_ns() - start
+
+    start = time.perf_counter_ns()
+    for _ in range(updates):
+        local.inc("benchmark.counter")
+    inc_ns = (time.perf_counter_ns() - start - empty_ns) / updates
+
+    start = time.perf_counter_ns()
+    for index in range(updates):
+        local.observe("benchmark.histogram", index)
+    observe_ns = (time.perf_counter_ns() - start - empty_ns) / updates
+
+    start = time.perf_counter_ns()
+    for index in range(updates):
+        local.set("benchmark.gauge", index)
+    set_ns = (time.perf_counter_ns() - start - empty_ns) / updates
+    print(f"每次更新: inc {inc_ns:.0f}ns observe {observe_ns:.0f}ns set {set_ns:.0f}ns")
+
+    # 多个线程同时更新，同时另一个线程不断读取快照
+    concurrent = Metrics()
+    done = threading.Event()
+    snapshots = [0]
+
+    def update():
+        for index in range(updates // threads):
+            concurrent.inc("concurrent.counter")
+            concurrent.observe("concurrent.histogram", index)
+
+    def read():
+        while not done.is_set():
+            concurrent.snapshot()
+            snapshots[0] += 1
+
+    reader = threading.Thread(target=read)
+    reader.start()
+    writers = [threading.Thread(target=update) for _ in range(threads)]
+    start = time.perf_counter()
+    for writer in writers:
+        writer.start()
+    for writer in writers:
+        writer.join()
+    elapsed = time.perf_counter() - start
+    done.set()
+    reader.join()
+
+    snapshot = concurrent.snapshot()
+    expected = updates // threads * threads
+    print(f"{threads} 个线程并发更新 {expected} 次（期间读取快照 {snapshots[0]} 次）耗时 {elapsed:.3f}秒: "
+          f"计数器={snapshot['counters']['concurrent.counter']} 直方图次数={snapshot['histograms']['concurrent.histogram']['count']} 预期={expected}")
+
+    server = MetricsServer(concurrent, port=0)
+    server.start()
+    start = time.perf_counter()
+    for _ in range(100):
+        fetch(server.url())
+    print(f"读取快照 {len(concurrent.histograms)} 个直方图: 通过 HTTP 拉取平均耗时 {(time.perf_counter() - start) * 10:.2f}ms")
+    server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="定时拉取运行中的工具的统计数据并显示（需在配置中开启 metrics.enabled）")
+    parser.add_argument("--url", default=f"http://127.0.0.1:{MetricsConfig().port}/metrics", help="统计数据接口的地址")
+    parser.add_argument("--interval", type=float, default=1.0, help="刷新间隔（秒）")
+    parser.add_argument("--benchmark", action="store_true", help="统计更新与读取的耗时")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark()
+        return
+
+    watch(args.url, args.interval)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,60 +1,33 @@
+import argparse
+import atexit
 import ctypes
-import math
+import multiprocessing
 import os.path
+import threading
 import time
 
-import win32api
-from pynput import keyboard, mouse
-
-from data_struct import ConfigInterface
-from draw import draw_line_async, Point
 from log import logger, color
 from util import show_head_line
 
-STEP_START = "选择起始点"
-STEP_END = "选择终点"
-
-
-# 计算下一步是什么
-def get_next_step(current_step: str) -> str:
-    next_step = STEP_END
-    if current_step == STEP_START:
-        next_step = STEP_END
-    elif current_step == STEP_END:
-        next_step = STEP_START
-    else:
-        raise AssertionError(f"unexpected step {current_step}")
-
-    return next_step
-
-
-class Config(ConfigInterface):
-    def __init__(self):
-        # 由于实际分辨率问题，按照像素计算出来，可能与实际的有区别，这里用一个系数自行调整，使其能恰好跳到目标点
-        # 如果跳的过远，就把这个数值调小点。太近了，则调大，直到找到一个在当前设置下比较合适的数目
-        self.adjustment_coefficient = 1.5
-
+# 入口脚本启动时仅导入上面这些较小的模块，以便尽快显示说明；其余模块在 main 中显示说明后才导入
+# 注意配置中包含识别、截图、跳跃记录等模块的配置类，读取配置时就会导入这些模块（以及 numpy），显示首个提示前的导入耗时主要在此
+# 显示首个提示后才导入的仅有识别进程、落地检测、录制等少量模块，真正推迟的是识别进程的启动等准备工作
+# 各阶段的导入耗时与到显示首个提示的耗时可通过 python startup.py 查看
 
-def load_config() -> Config:
-    cfg = Config()
-    cfg.load_from_json_file(config_path())
-    return cfg
 
+def key_events(keyboard) -> dict:
+    # 按键与引擎事件的对应关系，其余按键直接忽略
+    from engine import EVENT_ADJUST_COEFFICIENT, EVENT_AUTO_JUMP, EVENT_BOUNCE_FORCE, EVENT_CANCEL, EVENT_TOGGLE_CONTINUOUS, InputEvent
 
-def save_config(cfg: Config):
-    save_path = config_path()
-    make_sure_dir_exists(os.path.dirname(save_path))
-
-    cfg.save_to_json_file(save_path)
-
-
-def make_sure_dir_exists(dir_path):
-    if not os.path.exists(dir_path):
-        os.makedirs(dir_path, exist_ok=True)
-
-
-def config_path() -> str:
-    return os.path.join(os.path.expandvars("%APPDATA%"), "mo_jie_ren", "config.json")
+    return {
+        keyboard.KeyCode.from_char("a"): InputEvent(EVENT_AUTO_JUMP),
+        keyboard.KeyCode.from_char("s"): InputEvent(EVENT_TOGGLE_CONTINUOUS),
+        keyboard.KeyCode.from_char("z"): InputEvent(EVENT_BOUNCE_FORCE, value=90),
+        keyboard.KeyCode.from_char("x"): InputEvent(EVENT_BOUNCE_FORCE, value=100),
+        keyboard.KeyCode.from_char("c"): InputEvent(EVENT_BOUNCE_FORCE, value=110),
+        keyboard.Key.esc: InputEvent(EVENT_CANCEL),
+        keyboard.Key.caps_lock: InputEvent(EVENT_ADJUST_COEFFICIENT),
+    }
 
 
 def ensure_get_actual_position():
@@ -66,6 +39,8 @@ def ensure_get_actual_position():
 
 def disable_quick_edit_mode():
     # https://docs.microsoft.com/en-us/windows/console/setconsolemode
+    import win32api
+
     ENABLE_EXTENDED_FLAGS = 0x0080
 
     logger.info(color("bold_green") + "将禁用命令行的快速编辑模式，避免鼠标误触时程序暂停")
@@ -74,12 +49,9 @@ def disable_quick_edit_mode():
 
 
 def main():
-    # disable_quick_edit_mode()
-    cfg = load_config()
-
-    ensure_get_actual_position()
-
-    mouseController = mouse.Controller()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--profile", action="store_true", help="统计跳跃流程各阶段的耗时，退出时输出分布并将 trace 导出到配置文件旁边的 traces 目录")
+    args = parser.parse_args()
 
     show_head_line("""
 Powered by 风之凌殇
@@ -90,104 +62,181 @@ Powered by 风之凌殇
 使用前务必确保已看过上述文档
     """.strip(), )
 
-    current_step = STEP_START
-    current_block = 1
-    start_position = Point(0, 0)
-    end_position = Point(0, 0)
-    actual_position = Point(0, 0)
-
-    bounce_force = 100
-    base_bounce_force = 100
-
-    def show_step_prompt():
-        if current_step == STEP_START:
-            logger.info("")
-            logger.info(color("bold_yellow") + f"当前开始第 {current_block} 个格子，请依次将鼠标放到当前位置和目标位置，并分别点击 左ctrl 键（键盘左下角那个）(停止使用可以点击右上角关闭）")
-
-        logger.info(color("bold_yellow") + f"当前步骤为 {current_step}")
-
-    logger.info(f"当前修正系数为 {cfg.adjustment_coefficient}")
-
-    show_step_prompt()
-
-    with keyboard.Events() as events:
-        for event in events:
-            if type(event) != keyboard.Events.Press:
-                continue
-
-            if event.key == keyboard.Key.ctrl_l:
-                x, y = mouseController.position
-
-                if current_step == STEP_START:
-                    start_position = Point(x, y)
-                    logger.info(f"起点为 {start_position}")
-                elif current_step == STEP_END:
-                    end_position = Point(x, y)
-
-                    delta_x = end_position.x - start_position.x
-                    logger.info(f"目标为 {end_position}")
-                    logger.info(f"X 差值为 {delta_x}")
-
-                    # 计算需要按住的时间
-                    # 游戏中设定的x速度
-                    speed_x_per_second = 300
-                    # 考虑弹跳力的情况
-                    actual_speed = speed_x_per_second * bounce_force / base_bounce_force
-                    press_seconds = cfg.adjustment_coefficient * math.fabs(delta_x) / actual_speed
-
-                    logger.info(color("bold_green") + f"预计需要按住左键 {press_seconds} 秒 (实际速度={actual_speed} 基础速度={speed_x_per_second} 弹跳力={bounce_force} 最终修正系数={cfg.adjustment_coefficient})")
-
-                    # 画条线标记下
-                    draw_line_async(start_position, end_position, press_seconds)
-
-                    # 点击对应时长
-                    mouseController.press(mouse.Button.left)
-                    time.sleep(press_seconds)
-                    mouseController.release(mouse.Button.left)
-
-                    if bounce_force != base_bounce_force:
-                        bounce_force = base_bounce_force
-                        logger.info("弹跳力重置为默认值")
-                else:
-                    raise AssertionError()
-
-                # 更新步骤和区块
-                current_step = get_next_step(current_step)
-                if current_step == STEP_START:
-                    current_block += 1
-
-                show_step_prompt()
-            elif event.key == keyboard.KeyCode.from_char("z"):
-                bounce_force = 90
-                logger.info(color("bold_cyan") + f"本轮弹跳力调整为{bounce_force}")
-            elif event.key == keyboard.KeyCode.from_char("c"):
-                bounce_force = 110
-                logger.info(color("bold_cyan") + f"本轮弹跳力调整为{bounce_force}")
-            elif event.key == keyboard.KeyCode.from_char("x"):
-                bounce_force = 100
-                logger.info(color("bold_cyan") + f"本轮弹跳力重置为{bounce_force}")
-            elif event.key == keyboard.Key.caps_lock:
-                logger.info(color("bold_green") + "进入调整 修正系数 模式，并重置本轮步骤为 选择起始点 阶段，请按照提示输入新的系数~")
-
-                current_step = STEP_START
-                time.sleep(0.5)
-
-                new_coefficient = 1.0
-                while True:
-                    try:
-                        new_coefficient = float(input(f"当前修正系数为 {cfg.adjustment_coefficient}，请输入新的系数（如果跳太远，就填个小点的数，跳太近则填个大点的数）: "))
-                        break
-                    except Exception as e:
-                        logger.error(color("bold_yellow") + "输入的不是一个数字，请确保输入的是浮点数")
-
-
-                old = cfg.adjustment_coefficient
-                cfg.adjustment_coefficient = float(new_coefficient)
-                logger.info(color("bold_yellow") + f"系数变更为 {cfg.adjustment_coefficient}，之前为 {old}，将保存到用户目录的配置")
-                save_config(cfg)
-
-                show_step_prompt()
+    from calibration import Calibrator, calibration_path, load_model
+    from config import ConfigSaver, config_path, load_config, make_sure_dir_exists
+    from draw import OverlayRenderer, Point, WxOverlayBackend
+    from engine import EVENT_JUMP_FINISHED, EVENT_MARK, EVENT_SET_COEFFICIENT, EVENT_SETTLED, EVENT_WAYPOINT, InputEvent, JumpEngine
+    from executor import JumpExecutor
+    from input_backend import create_input_backend
+    from input_filter import EventInbox, KeyFilter
+    from metrics import MetricsServer, metrics
+    from press import PressScheduler
+    from tracing import start_profiling, trace_path, tracer
+
+    # disable_quick_edit_mode()
+    cfg = load_config()
+
+    if args.profile:
+        start_profiling(trace_path(config_path()))
+
+    ensure_get_actual_position()
+
+    from pynput import keyboard
+
+    # 鼠标操作通过可替换的实现进行，Windows 下默认直接调用 SendInput，避免 pynput 的额外开销影响按压计时
+    mouse_backend = create_input_backend(cfg.input_backend, real_input=True)
+    atexit.register(lambda: logger.info(mouse_backend.summary()))
+
+    # 常驻的标记线渲染服务，仅创建一次，在显示首个提示后才启动，wx 在渲染线程中导入并初始化，不影响主线程
+    overlay = OverlayRenderer(WxOverlayBackend())
+
+    # 跳跃在单独的线程中执行，键盘事件循环仅负责分发，避免按住鼠标期间无法响应其他按键
+    # 按压计时使用高精度计时器，避免 time.sleep 多睡一个调度周期导致跳跃距离出现误差
+    press_scheduler = PressScheduler()
+    jump_executor = JumpExecutor(
+        press_scheduler,
+        mouse_backend.press,
+        mouse_backend.release,
+        overlay,
+    )
+    jump_executor.start()
+
+    # 修正系数的模型保存在配置文件旁边
+    calibrator = Calibrator(cfg.calibration, load_model(calibration_path(config_path())))
+    if calibrator.model.overall.samples == 0:
+        calibrator.reset(cfg.adjustment_coefficient)
+
+    # 识别、落地检测、跳跃记录等在显示首个提示后再创建与启动，之后再设置到引擎中，键盘监听也在此之后才开始
+    engine = JumpEngine(cfg, jump_executor, calibrator=calibrator)
+    # 配置与修正模型在后台线程中合并保存，键盘事件循环中调整系数时不会因写文件而卡顿
+    saver = ConfigSaver()
+    saver.start()
+    atexit.register(saver.stop)
+    engine.save_config = lambda current: saver.save(current, config_path())
+    engine.save_calibration = lambda current: saver.save(current.model, calibration_path(config_path()))
+    engine.start()
+
+    # 长时间无人值守运行时，可在另一个窗口中通过 python metrics.py 查看跳跃次数、按压误差、各阶段耗时等统计数据
+    if cfg.metrics.enabled:
+        metrics_server = MetricsServer(metrics, cfg.metrics.host, cfg.metrics.port)
+        try:
+            metrics_server.start()
+            atexit.register(metrics_server.stop)
+            logger.info(color("bold_green") + f"统计数据接口已开启: {metrics_server.url()}，可在另一个窗口中运行 python metrics.py --url {metrics_server.url()} 查看")
+        except OSError as e:
+            logger.warning(color("bold_yellow") + f"统计数据接口开启失败（端口 {cfg.metrics.port} 可能已被占用），本次运行不提供统计数据: {e}")
+
+    overlay.start()
+
+    from capture import create_capture
+    from journal import JournalWriter, journal_path
+    from motion import LandingWatcher
+    from replay import RecordingVision, SessionRecorder, session_path
+    from vision_worker import create_vision
+
+    # 自动识别时仅截取游戏窗口，并根据上一跳的结果仅搜索画面中的一小部分区域，默认在单独的进程中进行
+    # 识别进程在后台启动，处理第一个按键前会确保已启动完毕
+    vision = create_vision(cfg.vision, cfg.capture)
+    vision_starter = threading.Thread(target=vision.start, name="VisionStarter", daemon=True)
+    vision_starter.start()
+    # 落地检测在跳跃结束后才进行，不影响按压计时，直接在当前进程中截图
+    capture = create_capture(cfg.capture)
+
+    # 每次跳跃记录到配置文件旁边的二进制文件中，便于之后分析与回放
+    journal = None
+    if cfg.journal.enabled:
+        journal = JournalWriter(journal_path(config_path()), cfg.journal.flush_interval_seconds, cfg.journal.batch_size)
+        journal.start()
+        atexit.register(journal.stop)
+
+    # 录制本次运行的输入事件与识别结果，之后可通过 replay.py 回放
+    recorder = None
+    if cfg.record_session:
+        path = session_path(config_path())
+        make_sure_dir_exists(os.path.dirname(path))
+        recorder = SessionRecorder(open(path, "w", encoding="utf-8"))
+        recorder.header(cfg, calibrator)
+        vision = RecordingVision(vision, recorder)
+        atexit.register(recorder.close)
+
+    # 键盘按键经过滤后通过环形缓冲区投递，落地、输入系数等其他事件通过队列投递，由下面的循环按投递的先后顺序依次分发处理
+    inbox = EventInbox(cfg.input_filter.ring_capacity)
+
+    def traced(event: InputEvent) -> InputEvent:
+        if tracer.enabled:
+            event = event._replace(posted_at_ns=time.perf_counter_ns())
+        return event
+
+    def post_event(event: InputEvent):
+        inbox.post(traced(event))
+
+    def on_settled(seconds: float):
+        logger.debug(f"画面已静止，距离跳跃结束 {seconds:.3f} 秒")
+        post_event(InputEvent(EVENT_SETTLED))
+
+    engine.vision = vision
+    engine.journal = journal
+    # 跳跃执行完毕后的记录与落地检测交给主循环处理，避免与按键事件同时修改引擎的状态
+    engine.post_event = post_event
+    atexit.register(lambda: logger.info(f"事件处理耗时 {engine.dispatch_latency.summary()} | 提交到开始按下 {jump_executor.start_latency.summary()} | 按压误差 {press_scheduler.error_histogram.summary()}"))
+    engine.landing_watcher = LandingWatcher(capture, cfg.motion, on_settled)
+    if recorder is not None:
+        engine.on_submit = recorder.jump
+
+    def adjust_coefficient():
+        # 在单独线程中等待输入，避免阻塞键盘事件循环
+        time.sleep(0.5)
+
+        while True:
+            try:
+                new_coefficient = float(input(f"当前修正系数为 {cfg.adjustment_coefficient}，请输入新的系数（如果跳太远，就填个小点的数，跳太近则填个大点的数）: "))
+                break
+            except Exception as e:
+                logger.error(color("bold_yellow") + "输入的不是一个数字，请确保输入的是浮点数")
+
+        post_event(InputEvent(EVENT_SET_COEFFICIENT, value=new_coefficient))
+
+    engine.request_coefficient = lambda: threading.Thread(target=adjust_coefficient, daemon=True).start()
+
+    KEY_EVENTS = key_events(keyboard)
+
+    # 需要记录鼠标位置的按键
+    POSITION_EVENTS = {keyboard.Key.ctrl_l: EVENT_MARK, keyboard.Key.shift_l: EVENT_WAYPOINT}
+
+    # 在监听回调中直接丢弃无关按键、按住不放时的自动重复与抖动导致的重复按下，避免按住 左ctrl 时连续标记多个点
+    key_filter = KeyFilter(cfg.input_filter, list(POSITION_EVENTS) + list(KEY_EVENTS))
+    atexit.register(lambda: logger.info(f"按键过滤: {key_filter.summary()} 缓冲区满丢弃={inbox.ring.dropped_full}"))
+
+    def on_press(key):
+        if not key_filter.accept_press(key):
+            return
+
+        if key in POSITION_EVENTS:
+            with tracer.span("input.mouse_position"):
+                x, y = mouse_backend.position()
+            event = InputEvent(POSITION_EVENTS[key], Point(x, y))
+        else:
+            event = KEY_EVENTS[key]
+
+        if not inbox.push_from_listener(traced(event)):
+            logger.warning(color("bold_yellow") + f"待处理的按键过多，已丢弃 {event.kind}")
+
+    keyboard.Listener(on_press=on_press, on_release=key_filter.release).start()
+
+    while True:
+        event = inbox.get()
+        # 已启动完毕时 join 会立即返回
+        vision_starter.join()
+
+        # 在处理时记录事件，文件中的顺序即为实际处理的顺序；跳跃执行完毕的事件在回放时会由同步执行的跳跃重新产生，无需记录
+        if recorder is not None and event.kind != EVENT_JUMP_FINISHED:
+            recorder.event(event)
+        engine.handle(event)
+        if recorder is not None:
+            recorder.flush()
 
 
 if __name__ == '__main__':
+    # 打包为exe后，识别进程需要此调用才能正常启动
+    multiprocessing.freeze_support()
     main()
@@ -0,0 +1,224 @@
+import threading
+import time
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+
+from capture import ScreenCapture
+from data_struct import ConfigInterface
+from log import logger
+from press import Histogram
+
+
+class MotionConfig(ConfigInterface):
+    def __init__(self):
+        # 计算块均值前先按该步长下采样
+        self.sample_step = 2
+        # 块均值哈希中每个块的边长（下采样后的像素）
+        self.block_size = 8
+        # 块均值（三个通道之和）变化超过该值时认为这个块发生了变化
+        self.change_threshold = 12
+        # 变化的块数不超过该值时认为画面静止，用于容忍角色待机动作等小范围变化
+        self.max_changed_blocks = 3
+        # 连续多少帧静止后认为角色已落地
+        self.stable_frames = 2
+        # 跳跃后最多等待多少帧来观察到画面变化，超过后直接视为已静止（如跳跃被取消）
+        self.max_wait_frames = 30
+        # 落地检测时的截图间隔
+        self.poll_interval_seconds = 0.01
+        # 最长等待落地的时间
+        self.timeout_seconds = 5.0
+
+
+def block_means(frame: np.ndarray, block_size: int, step: int) -> np.ndarray:
+    # 下采样后按块计算三个通道之和的均值，得到一个很小的网格
+    sampled = frame[::step, ::step]
+    rows, cols = sampled.shape[0] // block_size, sampled.shape[1] // block_size
+    blocks = sampled[:rows * block_size, :cols * block_size, :3].reshape(rows, block_size, cols, block_size, 3)
+    return blocks.sum(axis=(1, 3, 4), dtype=np.int32).astype(np.float32) / (block_size * block_size)
+
+
+class SettleDetector:
+    # 通过比较相邻两帧的块均值哈希判断画面是否已经静止
+    # arm 之后需要先观察到画面变化（角色起跳），之后连续 stable_frames 帧静止时才视为落地
+    def __init__(self, cfg: MotionConfig):
+        self.cfg = cfg
+
+        self.previous: Optional[np.ndarray] = None
+        self.armed = False
+        self.seen_motion = False
+        self.stable_count = 0
+        self.waited_frames = 0
+
+    def arm(self):
+        self.previous = None
+        self.armed = True
+        self.seen_motion = False
+        self.stable_count = 0
+        self.waited_frames = 0
+
+    def changed_blocks(self, frame: np.ndarray) -> int:
+        current = block_means(frame, self.cfg.block_size, self.cfg.sample_step)
+
+        changed = 0
+        if self.previous is not None and self.previous.shape == current.shape:
+            changed = int(np.count_nonzero(np.abs(current - self.previous) > self.cfg.change_threshold))
+        elif self.previous is not None:
+            # 画面尺寸变化，视为发生了变化
+            changed = current.size
+
+        self.previous = current
+        return changed
+
+    def feed(self, frame: np.ndarray) -> bool:
+        # 返回本帧是否刚刚判定为落地
+        if not self.armed:
+            return False
+
+        moving = self.changed_blocks(frame) > self.cfg.max_changed_blocks
+        self.waited_frames += 1
+
+        if moving:
+            self.seen_motion = True
+            self.stable_count = 0
+            return False
+
+        if not self.seen_motion and self.waited_frames < self.cfg.max_wait_frames:
+            return False
+
+        self.stable_count += 1
+        if self.stable_count >= self.cfg.stable_frames:
+            self.armed = False
+            return True
+
+        return False
+
+
+class LandingWatcher:
+    # 跳跃结束后在后台持续截图，一旦画面静止就调用 on_settled
+    # 每次观察使用单独的线程与 SettleDetector，已取消的观察即使还在截图中，也不会影响之后的观察，更不会误报落地
+    def __init__(self, capture: ScreenCapture, cfg: MotionConfig, on_settled: Callable[[float], None], join_timeout_seconds=0.05):
+        self.capture = capture
+        self.cfg = cfg
+        self.on_settled = on_settled
+        self.join_timeout_seconds = join_timeout_seconds
+
+        self.thread: Optional[threading.Thread] = None
+        self.stop_event = threading.Event()
+        # 取消与判定落地后调用 on_settled 互斥，取消之后不会再有 on_settled 被调用
+        self.lock = threading.Lock()
+
+        # 从开始观察到判定落地的耗时
+        self.settle_time = Histogram(bucket_width_us=10_000)
+
+    def watch(self):
+        self.cancel()
+
+        # 等待上一次的观察退出，截图耗时过长时不再等待，它使用自己的 stop_event 与 detector，不会影响本次观察
+        previous = self.thread
+        if previous is not None and previous is not threading.current_thread():
+            previous.join(self.join_timeout_seconds)
+
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, args=(self.stop_event, SettleDetector(self.cfg)), name="LandingWatcher", daemon=True)
+        self.thread.start()
+
+    def cancel(self):
+        with self.lock:
+            self.stop_event.set()
+
+    def run(self, stop_event: threading.Event, detector: SettleDetector):
+        detector.arm()
+        start = time.perf_counter_ns()
+        deadline = start + int(self.cfg.timeout_seconds * 1e9)
+
+        while not stop_event.is_set() and time.perf_counter_ns() < deadline:
+            frame = self.capture.grab()
+            if frame is not None and detector.feed(frame):
+                elapsed_ns = time.perf_counter_ns() - start
+                with self.lock:
+                    # 截图期间可能已被取消
+                    if stop_event.is_set():
+                        return
+                    self.settle_time.add(elapsed_ns)
+                    self.on_settled(elapsed_ns / 1e9)
+                return
+
+            stop_event.wait(self.cfg.poll_interval_seconds)
+
+        if not stop_event.is_set():
+            logger.debug(f"等待 {self.cfg.timeout_seconds} 秒后画面仍未静止")
+
+
+def synthetic_jump_sequence(jumps: int, width=960, height=540, seed=0) -> Tuple[List[np.ndarray], List[Tuple[int, int, int]]]:
+    # 生成若干次跳跃的逐帧画面（60帧每秒），返回画面列表以及每次跳跃的 (起跳帧, 角色实际停下的帧, 结束帧) 下标
+    # 角色在待机时会有轻微的上下浮动，用于检验对小范围变化的容忍度
+    from vision import Box, Platform, VisionConfig, render_synthetic_frame
+
+    cfg = VisionConfig()
+    rng = np.random.default_rng(seed)
+
+    frames = []
+    segments = []
+    x = 100
+    for _ in range(jumps):
+        distance = int(rng.integers(60, 300))
+        flight_frames = int(rng.integers(20, 50))
+        idle_frames = int(rng.integers(20, 40))
+        apex = int(rng.integers(40, 120))
+
+        begin = len(frames)
+        for i in range(flight_frames + idle_frames):
+            t = min(i, flight_frames) / flight_frames
+            cx = int((x + distance * t) % (width - 60))
+            bob = 2 if (i // 10) % 2 == 0 and i >= flight_frames else 0
+            feet = int(400 - apex * 4 * t * (1 - t)) - bob
+            frames.append(render_synthetic_frame(width, height, [Platform(0, width - 1, 401)], Box(cx, feet - 40, cx + 29, feet), cfg))
+
+        segments.append((begin, begin + flight_frames, len(frames) - 1))
+        x += distance
+
+    return frames, segments
+
+
+def benchmark(jumps=30):
+    # 在合成的跳跃画面序列上统计不同 stable_frames 下的 落地检测延迟（帧）、提前误判落地的比例，以及单帧耗时
+    frames, segments = synthetic_jump_sequence(jumps)
+
+    cfg = MotionConfig()
+    for stable_frames in [1, 2, 3, 5]:
+        cfg.stable_frames = stable_frames
+        detector = SettleDetector(cfg)
+
+        latencies = []
+        false_settles = 0
+        missed = 0
+        fed = 0
+        cost_ns = 0
+        for begin, stop, end in segments:
+            detector.arm()
+            settled_index = None
+            for index in range(begin, end + 1):
+                start = time.perf_counter_ns()
+                settled = detector.feed(frames[index])
+                cost_ns += time.perf_counter_ns() - start
+                fed += 1
+                if settled:
+                    settled_index = index
+                    break
+
+            if settled_index is None:
+                missed += 1
+            elif settled_index < stop:
+                false_settles += 1
+            else:
+                latencies.append(settled_index - stop)
+
+        print(
+            f"stable_frames={stable_frames}: 平均检测延迟 {np.mean(latencies) if latencies else float('nan'):.1f} 帧，"
+            f"提前误判 {false_settles}/{len(segments)}，未检测到 {missed}/{len(segments)}，单帧耗时 {cost_ns / max(1, fed) / 1000:.1f}us"
+        )
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,118 @@
+import collections
+import math
+from collections import namedtuple
+from typing import Callable, List, Optional, Sequence, Tuple
+
+from data_struct import ConfigInterface
+from draw import Point
+from press import press_seconds_for
+
+# 规划好的一跳，press_seconds 为规划时按预测的起点计算出的按压时长
+PlannedJump = namedtuple('PlannedJump', ['start_position', 'end_position', 'bounce_force', 'press_seconds'])
+
+
+class PlannerConfig(ConfigInterface):
+    def __init__(self):
+        # 是否允许一次规划多跳：手动模式下可用 左shift 依次标记途经的各个平台，最后用 左ctrl 标记终点，之后每次落地后自动跳向下一个
+        self.enabled = True
+        # 一次最多规划多少跳
+        self.max_planned_jumps = 8
+        # 落地后的实际起点与规划时预测的起点相差超过这么多像素时（如没跳到、镜头移动），丢弃剩余的规划并重新规划
+        self.max_deviation_px = 15
+
+
+def path_targets(start_position: Point, platforms, max_targets: int) -> List[Point]:
+    # 根据一帧画面中的所有平台，依次得出角色右侧各个平台的顶部中心，与 vision.detect 中选取目标的方式一致
+    current_right = start_position.x
+    for platform in platforms:
+        if platform.left <= start_position.x <= platform.right:
+            current_right = max(current_right, platform.right)
+            break
+
+    targets = [Point((platform.left + platform.right) // 2, platform.top) for platform in sorted(platforms, key=lambda platform: platform.left) if platform.left > current_right]
+    return targets[:max_targets]
+
+
+def remaining_targets(start_position: Point, platforms, targets: Sequence[Tuple[Point, int]]) -> List[Tuple[Point, int]]:
+    # 落点偏差过大需要重新规划时，从用户标记的 (目标, 弹跳力) 中保留仍位于角色右侧、且落在当前画面中某个平台上的
+    # 没跳到时上一跳的目标会被保留下来重新跳一次；镜头移动后原来标记的位置通常不再落在平台上，此时需要用户重新选择
+    current_right = start_position.x
+    for platform in platforms:
+        if platform.left <= start_position.x <= platform.right:
+            current_right = max(current_right, platform.right)
+            break
+
+    return [(target, bounce_force) for target, bounce_force in targets if target.x > current_right and any(platform.left <= target.x <= platform.right for platform in platforms)]
+
+
+class JumpPlanner:
+    # 计算一串跳跃的按压时长与弹跳力，系数与各弹跳力下的x速度由外部传入，与引擎中单跳的计算方式一致
+    def __init__(self, coefficient_for: Callable[[float], float], speed_for: Callable[[int], float], base_bounce_force=100):
+        self.coefficient_for = coefficient_for
+        self.speed_for = speed_for
+        self.base_bounce_force = base_bounce_force
+
+    def plan_jump(self, start_position: Point, end_position: Point, bounce_force: int) -> PlannedJump:
+        delta_x = end_position.x - start_position.x
+        press_seconds = press_seconds_for(delta_x, bounce_force, self.coefficient_for(delta_x), self.speed_for(bounce_force), self.base_bounce_force)
+        return PlannedJump(start_position, end_position, bounce_force, press_seconds)
+
+    def plan(self, start_position: Point, targets: Sequence[Point], bounce_forces: Optional[Sequence[int]] = None) -> List[PlannedJump]:
+        # 假设每一跳都恰好落在目标点上，上一跳的目标即为下一跳的起点；未指定弹跳力的跳跃使用基础弹跳力
+        jumps = []
+        for index, target in enumerate(targets):
+            bounce_force = bounce_forces[index] if bounce_forces is not None and index < len(bounce_forces) else self.base_bounce_force
+            jumps.append(self.plan_jump(start_position, target, bounce_force))
+            start_position = Point(target.x, start_position.y)
+
+        return jumps
+
+
+class JumpPipeline:
+    # 依次执行规划好的跳跃，每次落地后根据实际起点决定继续执行还是重新规划
+    # 实际起点与预测相差不大时仅按实际起点重新计算下一跳的按压时长，无需重新识别所有平台
+    def __init__(self, planner: JumpPlanner, cfg: PlannerConfig):
+        self.planner = planner
+        self.cfg = cfg
+
+        self.pending: collections.deque = collections.deque()
+
+        self.plans = 0
+        self.replans = 0
+        self.executed = 0
+
+    def __len__(self) -> int:
+        return len(self.pending)
+
+    def load(self, jumps: List[PlannedJump]):
+        self.pending = collections.deque(jumps)
+        self.plans += 1
+
+    def clear(self):
+        self.pending.clear()
+
+    def abandon(self):
+        # 无法确认落地后的位置时，丢弃剩余的规划
+        if len(self.pending) > 0:
+            self.pending.clear()
+            self.replans += 1
+
+    def next_jump(self, actual_start: Optional[Point] = None) -> Optional[PlannedJump]:
+        # actual_start 为落地后观察到的实际起点，为 None 时认为落在了预测的位置
+        # 没有剩余的规划，或者实际起点偏差过大时返回 None，此时剩余的规划已被丢弃，需要重新规划
+        if len(self.pending) == 0:
+            return None
+
+        planned = self.pending.popleft()
+        if actual_start is not None and actual_start != planned.start_position:
+            if math.fabs(actual_start.x - planned.start_position.x) > self.cfg.max_deviation_px:
+                self.pending.clear()
+                self.replans += 1
+                return None
+            planned = self.planner.plan_jump(actual_start, planned.end_position, planned.bounce_force)
+
+        self.executed += 1
+        return planned
+
+    def summary(self) -> str:
+        return f"规划次数={self.plans} 因落点偏差重新规划={self.replans} 执行的规划跳跃={self.executed}"
@@ -0,0 +1,232 @@
+import math
+import random
+import threading
+from collections import deque, namedtuple
+from typing import Callable, Dict, List, Optional, Tuple
+
+from clock import Clock, real_clock
+
+# 单次按压的记录，时间单位均为纳秒，若中途被取消，则 cancelled 为 True
+PressRecord = namedtuple('PressRecord', ['requested_ns', 'actual_ns', 'cancelled'], defaults=[False])
+
+
+# 按数值分桶：小于 8 的值各占一个桶，之后每翻一倍的范围再均分为 8 个桶，相对误差不超过 12.5%，64 位以内的数值共需 512 个桶
+SUB_BUCKETS = 8
+BUCKET_COUNT = 64 * SUB_BUCKETS
+
+
+def bucket_index(value: int) -> int:
+    if value < SUB_BUCKETS:
+        return max(0, value)
+
+    bits = value.bit_length()
+    return (bits - 3) * SUB_BUCKETS + (value >> (bits - 4)) - SUB_BUCKETS
+
+
+def bucket_upper_bound(index: int) -> int:
+    # 桶内最大的数值
+    if index < SUB_BUCKETS:
+        return index
+
+    bits = index // SUB_BUCKETS + 3
+    mantissa = index % SUB_BUCKETS + SUB_BUCKETS
+    return ((mantissa + 1) << (bits - 4)) - 1
+
+
+def bucket_lower_bound(index: int) -> int:
+    # 桶内最小的数值
+    return bucket_upper_bound(index - 1) + 1 if index > 0 else 0
+
+
+class Histogram:
+    # 以纳秒记录数值，如 实际按住时长 - 预期按住时长 的误差、各阶段的延迟
+    # 数值按上面的方式分桶计数，负数按绝对值另外分桶，无论记录多少次，占用的内存与计算百分位的耗时都是固定的
+    # 百分位返回所在桶的上界（不超过最大值），最大值与最小值是精确的；显示分布时再将这些桶按 bucket_width_us 微秒合并
+    def __init__(self, bucket_width_us=100):
+        self.bucket_width_us = bucket_width_us
+        self.positive = [0] * BUCKET_COUNT
+        self.negative = [0] * BUCKET_COUNT
+        self.total = 0
+        self.min_ns = 0
+        self.max_ns = 0
+
+    def add(self, value_ns: int):
+        if value_ns >= 0:
+            self.positive[bucket_index(value_ns)] += 1
+        else:
+            self.negative[bucket_index(-value_ns)] += 1
+
+        if self.total == 0:
+            self.min_ns = self.max_ns = value_ns
+        elif value_ns < self.min_ns:
+            self.min_ns = value_ns
+        elif value_ns > self.max_ns:
+            self.max_ns = value_ns
+        self.total += 1
+
+    def count(self) -> int:
+        return self.total
+
+    def percentile(self, p: float) -> float:
+        # 返回对应百分位的数值，单位为微秒
+        if self.total == 0:
+            return 0.0
+
+        rank = min(self.total - 1, int(self.total * p / 100)) + 1
+        seen = 0
+        value_ns = self.max_ns
+        # 负数从绝对值最大的桶开始，之后是正数从小到大
+        for index in range(BUCKET_COUNT - 1, -1, -1):
+            seen += self.negative[index]
+            if seen >= rank:
+                value_ns = -bucket_lower_bound(index)
+                break
+        else:
+            for index in range(BUCKET_COUNT):
+                seen += self.positive[index]
+                if seen >= rank:
+                    value_ns = bucket_upper_bound(index)
+                    break
+
+        return min(max(value_ns, self.min_ns), self.max_ns) / 1000
+
+    def histogram(self) -> List[Tuple[int, int]]:
+        # 返回 (区间起始微秒, 次数) 列表，由上面固定的桶按 bucket_width_us 合并得到
+        # 数值较大时一个桶可能比 bucket_width_us 更宽，此时整个桶按绝对值较小的一端归入对应的区间
+        buckets: Dict[int, int] = {}
+        for index in range(BUCKET_COUNT):
+            for count, value_ns in [(self.positive[index], bucket_lower_bound(index)), (self.negative[index], -bucket_lower_bound(index))]:
+                if count:
+                    bucket = (value_ns // 1000) // self.bucket_width_us
+                    buckets[bucket] = buckets.get(bucket, 0) + count
+
+        return [(bucket * self.bucket_width_us, buckets[bucket]) for bucket in sorted(buckets)]
+
+    def summary(self) -> str:
+        return f"count={self.count()} p50={self.percentile(50):.1f}us p99={self.percentile(99):.1f}us max={self.percentile(100):.1f}us"
+
+    def format_histogram(self, max_bar_width=50) -> str:
+        histogram = self.histogram()
+        if len(histogram) == 0:
+            return ""
+
+        max_count = max(count for _, count in histogram)
+        lines = []
+        for bucket_start_us, count in histogram:
+            bar = "#" * max(1, count * max_bar_width // max_count)
+            lines.append(f"{bucket_start_us:>8}us {count:>6} {bar}")
+
+        return "\n".join(lines)
+
+
+class PressScheduler:
+    # 高精度按压计时器
+    # time.sleep 通常会多睡一个调度周期（1-15ms），因此先粗略sleep到距离目标时间 spin_threshold_ns 的位置，剩下的时间通过 perf_counter_ns 自旋等待
+    def __init__(self, spin_threshold_ns=2_000_000, bucket_width_us=100, clock: Clock = real_clock, max_records=1000):
+        self.spin_threshold_ns = spin_threshold_ns
+        self.clock = clock
+        self.error_histogram = Histogram(bucket_width_us)
+        # 仅保留最近的按压记录，便于测试与排查，长时间运行时不会无限增长
+        self.records: deque = deque(maxlen=max_records)
+
+        self.lock = threading.Lock()
+
+    def hold(self, press: Callable[[], None], release: Callable[[], None], press_seconds: float, cancel_event: Optional[threading.Event] = None) -> PressRecord:
+        # 按下后等待指定时长再松开，若等待期间 cancel_event 被设置，则立即松开
+        requested_ns = int(press_seconds * 1_000_000_000)
+
+        press()
+        press_at = self.clock.perf_counter_ns()
+
+        finished = self.wait_until(press_at + requested_ns, cancel_event)
+
+        release_at = self.clock.perf_counter_ns()
+        release()
+
+        return self.record(requested_ns, release_at - press_at, cancelled=not finished)
+
+    def wait_until(self, deadline_ns: int, cancel_event: Optional[threading.Event] = None) -> bool:
+        # 等待到指定时间点，返回是否完整等待（未被取消）
+        while True:
+            remaining_ns = deadline_ns - self.clock.perf_counter_ns()
+            if remaining_ns <= self.spin_threshold_ns:
+                break
+
+            timeout = (remaining_ns - self.spin_threshold_ns) / 1_000_000_000
+            if cancel_event is None or self.clock.virtual:
+                # 虚拟时钟下等待不消耗真实时间，期间也不会被其他线程取消
+                self.clock.sleep(timeout)
+            elif cancel_event.wait(timeout):
+                return False
+
+        self.clock.spin_until(deadline_ns)
+
+        return cancel_event is None or not cancel_event.is_set()
+
+    def record(self, requested_ns: int, actual_ns: int, cancelled=False) -> PressRecord:
+        record = PressRecord(requested_ns, actual_ns, cancelled)
+        if cancelled:
+            # 被取消的按压不计入误差统计
+            return record
+
+        with self.lock:
+            self.records.append(record)
+            self.error_histogram.add(actual_ns - requested_ns)
+
+        return record
+
+
+class SleepPressScheduler(PressScheduler):
+    # 仅使用 time.sleep 的计时方式，即原来的实现，用于对比
+    def wait_until(self, deadline_ns: int, cancel_event: Optional[threading.Event] = None) -> bool:
+        remaining_ns = deadline_ns - self.clock.perf_counter_ns()
+        if remaining_ns <= 0:
+            return True
+
+        if cancel_event is None or self.clock.virtual:
+            self.clock.sleep(remaining_ns / 1_000_000_000)
+            return cancel_event is None or not cancel_event.is_set()
+
+        return not cancel_event.wait(remaining_ns / 1_000_000_000)
+
+
+class FakeMouseController:
+    # 模拟的鼠标控制器，仅记录按下与松开的时间点，用于测试与性能测试
+    def __init__(self, clock: Clock = real_clock):
+        self.clock = clock
+        self.position = (0, 0)
+        self.pressed_at: Optional[int] = None
+        self.holds_ns: List[int] = []
+
+    def press(self, button=None):
+        self.pressed_at = self.clock.perf_counter_ns()
+
+    def release(self, button=None):
+        if self.pressed_at is not None:
+            self.holds_ns.append(self.clock.perf_counter_ns() - self.pressed_at)
+            self.pressed_at = None
+
+
+def press_seconds_for(delta_x: float, bounce_force: int, adjustment_coefficient: float, speed_x_per_second: float = 300, base_bounce_force: int = 100) -> float:
+    # 计算需要按住的时间，speed_x_per_second 为游戏中设定的x速度，并考虑弹跳力的情况
+    actual_speed = speed_x_per_second * bounce_force / base_bounce_force
+    return adjustment_coefficient * math.fabs(delta_x) / actual_speed
+
+
+def benchmark(presses=1000, min_seconds=0.001, max_seconds=0.02, seed=0):
+    # 使用模拟的鼠标控制器进行大量短时间按压，统计预期与实际按住时长的误差分布
+    for scheduler_type in [SleepPressScheduler, PressScheduler]:
+        rnd = random.Random(seed)
+        scheduler = scheduler_type()
+        fake_mouse = FakeMouseController()
+
+        for _ in range(presses):
+            scheduler.hold(fake_mouse.press, fake_mouse.release, rnd.uniform(min_seconds, max_seconds))
+
+        print(f"{scheduler_type.__name__}: {scheduler.error_histogram.summary()}")
+        print(scheduler.error_histogram.format_histogram())
+        print()
+
+
+if __name__ == '__main__':
+    benchmark()
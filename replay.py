@@ -0,0 +1,335 @@
+import argparse
+import io
+import json
+import logging
+import math
+import os.path
+import threading
+import time
+from collections import namedtuple
+from typing import List, Optional, TextIO
+
+from calibration import CalibrationModel, Calibrator
+from clock import Clock, VirtualClock, real_clock
+from config import Config
+from data_struct import to_raw_type
+from draw import Point
+from engine import (EVENT_ADJUST_COEFFICIENT, EVENT_AUTO_JUMP, EVENT_BOUNCE_FORCE, EVENT_MARK, EVENT_SET_COEFFICIENT, EVENT_SETTLED, EVENT_TOGGLE_CONTINUOUS,
+                    EVENT_WAYPOINT, InputEvent, JumpEngine)
+from executor import SyncJumpExecutor
+from log import logger
+from planner import path_targets
+from press import FakeMouseController, PressScheduler
+from tracing import start_profiling
+from vision import Box, Detection, Platform
+
+# 录制的一次运行：开始时的配置与修正模型、输入事件 (相对时间ns, InputEvent)、按顺序的识别结果、按顺序提交的跳跃 (起点, 终点, 按压时长)、按顺序的落地后确认的角色位置
+Session = namedtuple('Session', ['config', 'calibration', 'events', 'detections', 'jumps', 'locations'])
+# 回放的结果，mismatches 为与录制时提交的跳跃不一致的数目
+ReplayResult = namedtuple('ReplayResult', ['jumps', 'mismatches', 'virtual_seconds'])
+
+
+class SessionRecorder:
+    # 将输入事件、识别结果与提交的跳跃按发生顺序写入 JSON Lines 文件，每行一条记录
+    def __init__(self, output: TextIO, clock: Clock = real_clock):
+        self.output = output
+        self.clock = clock
+        self.start_ns = clock.perf_counter_ns()
+        self.lock = threading.Lock()
+
+    def write(self, record: dict):
+        with self.lock:
+            self.output.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def header(self, cfg: Config, calibrator: Optional[Calibrator]):
+        self.write({"type": "header", "config": to_raw_type(cfg), "calibration": to_raw_type(calibrator.model) if calibrator is not None else None})
+
+    def event_record(self, event: InputEvent) -> dict:
+        return {"type": "event", "t": self.clock.perf_counter_ns() - self.start_ns, "kind": event.kind, "position": event.position, "value": event.value}
+
+    def event(self, event: InputEvent):
+        self.write(self.event_record(event))
+
+    def detection(self, detection: Optional[Detection]):
+        self.write({"type": "detection", "detection": detection_to_raw(detection)})
+
+    def location(self, position: Optional[Point]):
+        self.write({"type": "location", "position": list(position) if position is not None else None})
+
+    def jump(self, start_position: Point, end_position: Point, press_seconds: float):
+        self.write({"type": "jump", "start": list(start_position), "end": list(end_position), "press_seconds": press_seconds})
+
+    def flush(self):
+        with self.lock:
+            self.output.flush()
+
+    def close(self):
+        with self.lock:
+            self.output.close()
+
+
+class RecordingVision:
+    # 包装实际的识别，将每次的识别结果写入录制文件
+    def __init__(self, vision, recorder: SessionRecorder):
+        self.vision = vision
+        self.recorder = recorder
+
+    def start(self):
+        self.vision.start()
+
+    def stop(self):
+        self.vision.stop()
+
+    def detect(self, timeout: Optional[float] = 1.0) -> Optional[Detection]:
+        detection = self.vision.detect(timeout)
+        self.recorder.detection(detection)
+        return detection
+
+    def locate(self, predicted: Point, timeout: Optional[float] = 1.0) -> Optional[Point]:
+        position = self.vision.locate(predicted, timeout)
+        self.recorder.location(position)
+        return position
+
+    def notify_jump(self, delta_x: int):
+        self.vision.notify_jump(delta_x)
+
+
+class ReplayVision:
+    # 按顺序返回录制的识别结果与角色位置
+    def __init__(self, detections: List[Optional[Detection]], locations: List[Optional[Point]]):
+        self.detections = detections
+        self.next_index = 0
+        self.locations = locations
+        self.next_location_index = 0
+
+    def start(self):
+        return
+
+    def stop(self):
+        return
+
+    def detect(self, timeout: Optional[float] = None) -> Optional[Detection]:
+        if self.next_index >= len(self.detections):
+            return None
+
+        detection = self.detections[self.next_index]
+        self.next_index += 1
+        return detection
+
+    def locate(self, predicted: Point, timeout: Optional[float] = None) -> Optional[Point]:
+        if self.next_location_index >= len(self.locations):
+            return None
+
+        position = self.locations[self.next_location_index]
+        self.next_location_index += 1
+        return position
+
+    def notify_jump(self, delta_x: int):
+        return
+
+
+def detection_to_raw(detection: Optional[Detection]) -> Optional[dict]:
+    if detection is None:
+        return None
+
+    return {
+        "start": list(detection.start_position),
+        "end": list(detection.end_position),
+        "confidence": detection.confidence,
+        "character_box": list(detection.character_box),
+        "platforms": [list(platform) for platform in detection.platforms],
+    }
+
+
+def detection_from_raw(raw: Optional[dict]) -> Optional[Detection]:
+    if raw is None:
+        return None
+
+    return Detection(Point(*raw["start"]), Point(*raw["end"]), raw["confidence"], Box(*raw["character_box"]), [Platform(*platform) for platform in raw["platforms"]])
+
+
+def session_path(config_path: str) -> str:
+    return os.path.join(os.path.dirname(config_path), "sessions", time.strftime("%Y%m%d_%H%M%S") + ".jsonl")
+
+
+def load_session(lines) -> Session:
+    config, calibration = {}, None
+    events, detections, jumps, locations = [], [], [], []
+    for line in lines:
+        if line.strip() == "":
+            continue
+
+        record = json.loads(line)
+        record_type = record["type"]
+        if record_type == "header":
+            config, calibration = record["config"], record["calibration"]
+        elif record_type == "event":
+            position = Point(*record["position"]) if record["position"] is not None else None
+            events.append((record["t"], InputEvent(record["kind"], position, record["value"])))
+        elif record_type == "detection":
+            detections.append(detection_from_raw(record["detection"]))
+        elif record_type == "jump":
+            jumps.append((Point(*record["start"]), Point(*record["end"]), record["press_seconds"]))
+        elif record_type == "location":
+            locations.append(Point(*record["position"]) if record["position"] is not None else None)
+
+    return Session(config, calibration, events, detections, jumps, locations)
+
+
+def load_session_file(path: str) -> Session:
+    with open(path, encoding="utf-8") as session_file:
+        return load_session(session_file)
+
+
+def replay_session(session: Session) -> ReplayResult:
+    # 使用虚拟时钟、模拟鼠标与录制的识别结果，以不受限制的速度重新执行一遍跳跃流程
+    clock = VirtualClock()
+    cfg = Config().auto_update_config(json.loads(json.dumps(session.config)))
+
+    calibrator = None
+    if session.calibration is not None:
+        calibrator = Calibrator(cfg.calibration, CalibrationModel().auto_update_config(json.loads(json.dumps(session.calibration))))
+
+    fake_mouse = FakeMouseController(clock)
+    jumper = SyncJumpExecutor(PressScheduler(clock=clock), fake_mouse.press, fake_mouse.release)
+    engine = JumpEngine(cfg, jumper, ReplayVision(session.detections, session.locations), calibrator, clock=clock)
+
+    jumps = []
+    engine.on_submit = lambda start_position, end_position, press_seconds: jumps.append((start_position, end_position, press_seconds))
+
+    for timestamp_ns, event in session.events:
+        clock.spin_until(timestamp_ns)
+        engine.handle(event)
+
+    mismatches = abs(len(jumps) - len(session.jumps))
+    for (start, end, press_seconds), (expected_start, expected_end, expected_press_seconds) in zip(jumps, session.jumps):
+        if start != expected_start or end != expected_end or not math.isclose(press_seconds, expected_press_seconds, rel_tol=1e-9):
+            mismatches += 1
+
+    return ReplayResult(len(jumps), mismatches, clock.perf_counter_ns() / 1e9)
+
+
+class QuietLogging:
+    # 回放时仅输出 error 级别的日志，避免日志输出成为瓶颈
+    def __enter__(self):
+        self.level = logger.level
+        logger.setLevel(logging.ERROR)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        logger.setLevel(self.level)
+
+
+def record_simulated_session(seed: int, max_events=2000) -> str:
+    # 在模拟器中按照随机的操作方式（手动选点、自动识别、连续模式、调整弹跳力与系数）玩一关，返回录制的内容
+    import random
+
+    from simulator import GameSimulator, SimulatedVision, SimulatorConfig
+
+    rnd = random.Random(seed)
+    sim_cfg = SimulatorConfig()
+    sim_cfg.seed = seed
+    sim_cfg.game_coefficient = 1.6
+    sim = GameSimulator(sim_cfg)
+    clock = sim.clock
+
+    cfg = Config()
+    calibrator = Calibrator(cfg.calibration)
+    calibrator.reset(cfg.adjustment_coefficient)
+
+    output = io.StringIO()
+    recorder = SessionRecorder(output, clock)
+    recorder.header(cfg, calibrator)
+
+    jumper = SyncJumpExecutor(PressScheduler(clock=clock), sim.mouse.press, sim.mouse.release)
+    engine = JumpEngine(cfg, jumper, RecordingVision(SimulatedVision(sim), recorder), calibrator, clock=clock)
+    engine.on_submit = recorder.jump
+
+    def post(event: InputEvent):
+        clock.advance(rnd.randint(50_000_000, 500_000_000))
+        recorder.event(event)
+        engine.handle(event)
+
+    for _ in range(max_events):
+        if sim.finished():
+            break
+
+        observation = sim.observe()
+        if observation.bounce_force != engine.base_bounce_force:
+            post(InputEvent(EVENT_BOUNCE_FORCE, value=observation.bounce_force))
+
+        action = rnd.random()
+        if action < 0.3:
+            post(InputEvent(EVENT_MARK, observation.start_position))
+            post(InputEvent(EVENT_MARK, observation.end_position))
+        elif action < 0.4:
+            # 标记途经的平台，一次跳过多个平台，每次落地后自动跳向下一个
+            targets = path_targets(observation.start_position, observation.platforms, 3) or [observation.end_position]
+            post(InputEvent(EVENT_MARK, observation.start_position))
+            for target in targets[:-1]:
+                post(InputEvent(EVENT_WAYPOINT, target))
+            post(InputEvent(EVENT_MARK, targets[-1]))
+            for _ in targets[:-1]:
+                post(InputEvent(EVENT_SETTLED))
+        elif action < 0.8:
+            post(InputEvent(EVENT_AUTO_JUMP))
+        elif action < 0.95:
+            post(InputEvent(EVENT_TOGGLE_CONTINUOUS))
+            post(InputEvent(EVENT_SETTLED))
+            post(InputEvent(EVENT_TOGGLE_CONTINUOUS))
+        else:
+            post(InputEvent(EVENT_ADJUST_COEFFICIENT))
+            post(InputEvent(EVENT_SET_COEFFICIENT, value=round(rnd.uniform(1.4, 1.8), 2)))
+
+    return output.getvalue()
+
+
+def benchmark(sessions=50, replays=2000):
+    # 在模拟器中录制若干局，验证回放结果与录制时完全一致，并统计每秒能回放的局数
+    with QuietLogging():
+        start = time.perf_counter()
+        recorded = [load_session(record_simulated_session(seed).splitlines()) for seed in range(sessions)]
+        print(f"录制 {sessions} 局耗时 {time.perf_counter() - start:.3f}秒，平均每局 {sum(len(session.events) for session in recorded) / sessions:.0f} 个事件、{sum(len(session.jumps) for session in recorded) / sessions:.0f} 次跳跃")
+
+        mismatches = sum(replay_session(session).mismatches for session in recorded)
+        print(f"回放结果与录制时不一致的跳跃数目: {mismatches}")
+
+        start = time.perf_counter()
+        jumps = 0
+        virtual_seconds = 0.0
+        for index in range(replays):
+            result = replay_session(recorded[index % sessions])
+            jumps += result.jumps
+            virtual_seconds += result.virtual_seconds
+        elapsed = time.perf_counter() - start
+
+    print(f"回放 {replays} 局耗时 {elapsed:.3f}秒，每秒 {replays / elapsed:.0f} 局 / {jumps / elapsed:.0f} 次跳跃，相当于实际游戏时间 {virtual_seconds / 3600:.1f} 小时")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="回放录制的运行记录，检查提交的跳跃是否与录制时一致")
+    parser.add_argument("sessions", nargs="*", help="录制文件（位于配置文件旁边的 sessions 目录中）")
+    parser.add_argument("--verbose", action="store_true", help="输出回放过程中的日志")
+    parser.add_argument("--benchmark", action="store_true", help="在模拟器中录制并回放大量对局，统计回放速度")
+    parser.add_argument("--profile", default="", help="统计回放过程中各阶段的耗时，退出时输出分布并将 trace 导出到该文件")
+    args = parser.parse_args()
+
+    if args.profile != "":
+        start_profiling(args.profile)
+
+    if args.benchmark:
+        benchmark()
+
+    for path in args.sessions:
+        session = load_session_file(path)
+        if args.verbose:
+            result = replay_session(session)
+        else:
+            with QuietLogging():
+                result = replay_session(session)
+
+        status = "一致" if result.mismatches == 0 else f"有 {result.mismatches} 次跳跃不一致"
+        print(f"{path}: 事件数={len(session.events)} 跳跃次数={result.jumps} 录制时长={result.virtual_seconds:.1f}秒 回放结果与录制时{status}")
+
+
+if __name__ == '__main__':
+    main()
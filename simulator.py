@@ -0,0 +1,433 @@
+from __future__ import annotations
+
+import random
+import time
+from collections import namedtuple
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from calibration import Calibrator
+from clock import VirtualClock
+from data_struct import ConfigInterface
+from draw import Point
+from planner import JumpPipeline, JumpPlanner, PlannerConfig, path_targets
+from press import FakeMouseController, Histogram, PressScheduler, press_seconds_for
+from vision import Box, Detection, Platform, VisionConfig, detect, locate_character, render_synthetic_frame
+
+# 模拟关卡中的平台（世界坐标），bounce_force 为从该平台起跳时的弹跳力
+SimPlatform = namedtuple('SimPlatform', ['left', 'right', 'top', 'bounce_force'])
+# 一次跳跃的结果，offset 为实际落点与目标平台中心的水平距离（正数表示跳远了）
+JumpOutcome = namedtuple('JumpOutcome', ['block', 'delta_x', 'bounce_force', 'press_seconds', 'distance', 'offset', 'landed'])
+# 驱动方每次跳跃前能观察到的信息（屏幕坐标）
+Observation = namedtuple('Observation', ['start_position', 'end_position', 'bounce_force', 'platforms'])
+
+
+class SimulatorConfig(ConfigInterface):
+    def __init__(self):
+        # 游戏实际的x速度与基础弹跳力
+        self.speed_x_per_second = 300
+        self.base_bounce_force = 100
+        # 各个弹跳力下实际的x速度（key 为弹跳力），未设置的弹跳力使用 speed_x_per_second
+        self.speed_x_per_second_by_bounce_force: Dict[str, float] = {}
+        # 游戏中实际的 按压时长 与 跳跃距离 的比例，跳跃距离 = 按压时长 * 实际速度 / game_coefficient
+        # 当工具中的修正系数与之相等时即可恰好跳到目标点
+        self.game_coefficient = 1.5
+        # 实际系数 = game_coefficient + game_coefficient_per_press_second * 按压时长，用于模拟系数随距离略有变化的情况
+        self.game_coefficient_per_press_second = 0.0
+        # 游戏按帧统计按压时长，为0时不取整
+        self.frame_seconds = 0.0
+        # 按压时长的随机误差（标准差，秒）
+        self.press_noise_seconds = 0.002
+        # 落点超出平台边缘多少像素以内仍算落在平台上
+        self.landing_tolerance = 0
+
+        # 关卡生成参数
+        self.platform_count = 30
+        self.min_platform_width = 80
+        self.max_platform_width = 240
+        self.min_gap = 60
+        self.max_gap = 420
+        self.min_top = 680
+        self.max_top = 800
+        # 各个格子的弹跳力从中随机选择
+        self.bounce_forces = [100, 100, 100, 90, 110]
+
+        # 空中停留时间 = base_flight_seconds + flight_seconds_per_press * 按压时长
+        self.base_flight_seconds = 0.5
+        self.flight_seconds_per_press = 0.5
+
+        self.screen_width = 1920
+        self.screen_height = 1080
+        self.character_width = 40
+        self.character_height = 60
+
+        self.seed = 0
+
+    def speed_for(self, bounce_force: int) -> float:
+        return self.speed_x_per_second_by_bounce_force.get(str(bounce_force), self.speed_x_per_second)
+
+
+class GameSimulator:
+    # 无界面的游戏模拟器，使用虚拟时钟，按压时长由模拟的鼠标按下与松开的时间点决定
+    def __init__(self, cfg: SimulatorConfig, clock: Optional[VirtualClock] = None):
+        self.cfg = cfg
+        self.clock = clock or VirtualClock()
+        self.rnd = random.Random(cfg.seed)
+
+        self.platforms = generate_platforms(cfg, self.rnd)
+
+        self.current_block = 0
+        self.character_x = center_of(self.platforms[0])
+        self.camera_x = 0
+
+        self.outcomes: List[JumpOutcome] = []
+
+        self.mouse = SimulatedMouse(self)
+
+    def finished(self) -> bool:
+        return self.current_block >= len(self.platforms) - 1
+
+    def update_camera(self):
+        # 下一个平台超出画面时，镜头右移使角色位于画面左侧
+        next_platform = self.platforms[min(self.current_block + 1, len(self.platforms) - 1)]
+        if next_platform.right - self.camera_x >= self.cfg.screen_width or self.character_x - self.camera_x < 0:
+            self.camera_x = int(self.character_x) - 300
+
+    def observe(self) -> Observation:
+        # 返回屏幕坐标下角色脚下的位置与下一个平台的顶部中心
+        self.update_camera()
+
+        current = self.platforms[self.current_block]
+        target = self.platforms[self.current_block + 1]
+
+        start = Point(int(self.character_x) - self.camera_x, current.top - 1)
+        end = Point(int(center_of(target)) - self.camera_x, target.top)
+        return Observation(start, end, current.bounce_force, self.visible_platforms())
+
+    def visible_platforms(self) -> List[Platform]:
+        width = self.cfg.screen_width
+        visible = []
+        for platform in self.platforms:
+            left, right = platform.left - self.camera_x, platform.right - self.camera_x
+            if right < 0 or left >= width:
+                continue
+            visible.append(Platform(max(0, left), min(width - 1, right), platform.top))
+
+        return visible
+
+    def character_box(self) -> Box:
+        cfg = self.cfg
+        current = self.platforms[self.current_block]
+        x = int(self.character_x) - self.camera_x
+        return Box(x - cfg.character_width // 2, current.top - cfg.character_height, x + cfg.character_width // 2 - 1, current.top - 1)
+
+    def render(self, vision_cfg: VisionConfig) -> np.ndarray:
+        self.update_camera()
+        return render_synthetic_frame(self.cfg.screen_width, self.cfg.screen_height, self.visible_platforms(), self.character_box(), vision_cfg)
+
+    def jump(self, press_seconds: float) -> JumpOutcome:
+        cfg = self.cfg
+        current = self.platforms[self.current_block]
+        target = self.platforms[self.current_block + 1]
+
+        if cfg.frame_seconds > 0:
+            press_seconds = round(press_seconds / cfg.frame_seconds) * cfg.frame_seconds
+        if cfg.press_noise_seconds > 0:
+            press_seconds = max(0.0, press_seconds + self.rnd.gauss(0, cfg.press_noise_seconds))
+
+        speed = cfg.speed_for(current.bounce_force) * current.bounce_force / cfg.base_bounce_force
+        distance = press_seconds * speed / self.effective_coefficient(press_seconds)
+        landing_x = self.character_x + distance
+
+        landed = target.left - cfg.landing_tolerance <= landing_x <= target.right + cfg.landing_tolerance
+        outcome = JumpOutcome(
+            self.current_block + 1,
+            center_of(target) - self.character_x,
+            current.bounce_force,
+            press_seconds,
+            distance,
+            landing_x - center_of(target),
+            landed,
+        )
+        self.outcomes.append(outcome)
+
+        if landed:
+            self.current_block += 1
+            self.character_x = landing_x
+        # 没有跳到目标平台时，重新回到当前平台上的原位置
+
+        # 空中停留的时间
+        self.clock.sleep(cfg.base_flight_seconds + cfg.flight_seconds_per_press * press_seconds)
+
+        return outcome
+
+    def effective_coefficient(self, press_seconds: float) -> float:
+        return self.cfg.game_coefficient + self.cfg.game_coefficient_per_press_second * press_seconds
+
+    def skip_block(self):
+        # 直接将角色放到下一个平台的中心，用于只关心每一跳的落点偏差、不需要重跳的评估
+        self.current_block += 1
+        self.character_x = center_of(self.platforms[self.current_block])
+
+
+class SimulatedMouse(FakeMouseController):
+    # 松开时根据按住的时长让模拟器中的角色起跳
+    def __init__(self, simulator: GameSimulator):
+        super().__init__(simulator.clock)
+        self.simulator = simulator
+
+    def release(self, button=None):
+        pressed_at = self.pressed_at
+        super().release(button)
+        if pressed_at is not None:
+            self.simulator.jump(self.holds_ns[-1] / 1e9)
+
+
+class SimulatedVision:
+    # 直接根据模拟器的状态给出识别结果，接口与 vision_worker 中的 LocalVision 一致
+    def __init__(self, simulator: GameSimulator):
+        self.simulator = simulator
+
+    def start(self):
+        return
+
+    def stop(self):
+        return
+
+    def detect(self, timeout: Optional[float] = None) -> Optional[Detection]:
+        if self.simulator.finished():
+            return None
+
+        observation = self.simulator.observe()
+        return Detection(observation.start_position, observation.end_position, 1.0, self.simulator.character_box(), observation.platforms)
+
+    def locate(self, predicted: Point, timeout: Optional[float] = None) -> Optional[Point]:
+        if self.simulator.finished():
+            return None
+
+        return self.simulator.observe().start_position
+
+    def notify_jump(self, delta_x: int):
+        return
+
+
+def center_of(platform) -> float:
+    return (platform.left + platform.right) / 2
+
+
+def generate_platforms(cfg: SimulatorConfig, rnd: random.Random) -> List[SimPlatform]:
+    platforms = []
+    x = 200
+    for index in range(cfg.platform_count):
+        width = rnd.randint(cfg.min_platform_width, cfg.max_platform_width)
+        bounce_force = cfg.base_bounce_force if index == 0 else rnd.choice(cfg.bounce_forces)
+        platforms.append(SimPlatform(x, x + width - 1, rnd.randint(cfg.min_top, cfg.max_top), bounce_force))
+        x += width + rnd.randint(cfg.min_gap, cfg.max_gap)
+
+    return platforms
+
+
+class PlayStats:
+    def __init__(self):
+        self.jumps = 0
+        self.landed = 0
+        self.levels = 0
+        self.blocks = 0
+        self.wall_seconds = 0.0
+        self.virtual_seconds = 0.0
+        # 落地后到下一次按下鼠标之间，观察、识别与计算按压时长的实际耗时，游戏在此期间等待
+        self.decision_seconds = 0.0
+        self.abs_offsets: List[float] = []
+        # 使用在线修正时，每次跳跃所用系数与游戏实际系数的相对误差
+        self.coefficient_errors: List[float] = []
+        # 识别失败的次数，与实际的工具一样，识别失败后不再继续自动跳跃，该关卡就此结束
+        self.vision_misses = 0
+
+        # 各阶段的实际耗时
+        self.stage_latency: Dict[str, Histogram] = {}
+
+    def stage(self, name: str) -> Histogram:
+        if name not in self.stage_latency:
+            self.stage_latency[name] = Histogram(bucket_width_us=10)
+        return self.stage_latency[name]
+
+    def add_outcome(self, outcome: JumpOutcome):
+        self.jumps += 1
+        self.landed += int(outcome.landed)
+        self.abs_offsets.append(abs(outcome.offset))
+
+    def blocks_per_minute(self) -> float:
+        # 按游戏中经过的时间（按压、空中停留）加上每跳之前的决策耗时计算
+        return self.blocks / max(1e-9, self.virtual_seconds + self.decision_seconds) * 60
+
+    def summary(self) -> str:
+        lines = [
+            f"关卡数={self.levels} 跳跃次数={self.jumps} 成功落地={self.landed} 落地率={self.landed / max(1, self.jumps):.1%} "
+            f"平均偏差={np.mean(self.abs_offsets) if self.abs_offsets else 0:.2f}px p95偏差={np.percentile(self.abs_offsets, 95) if self.abs_offsets else 0:.2f}px",
+            f"实际耗时={self.wall_seconds:.3f}秒 每秒跳跃次数={self.jumps / max(1e-9, self.wall_seconds):.1f} "
+            f"模拟的游戏时间={self.virtual_seconds:.1f}秒 加速比={self.virtual_seconds / max(1e-9, self.wall_seconds):.0f}x",
+            f"通过的格子数={self.blocks} 决策耗时={self.decision_seconds * 1000:.1f}ms 每分钟通过的格子数={self.blocks_per_minute():.1f} 因识别失败提前结束的关卡数={self.vision_misses}",
+        ]
+        for name, histogram in self.stage_latency.items():
+            lines.append(f"  {name}: {histogram.summary()}")
+
+        return "\n".join(lines)
+
+
+def play_level(sim: GameSimulator, adjustment_coefficient: float, stats: PlayStats, speed_x_per_second: float = 300, vision_cfg: Optional[VisionConfig] = None, max_jumps=1000, calibrator: Optional[Calibrator] = None, speed_by_bounce_force: Optional[Dict[str, float]] = None):
+    # 按照工具的逻辑玩完一整个关卡：观察起点与终点（可选通过渲染画面+识别），计算按压时长，通过模拟鼠标按压，等待落地
+    # 传入 calibrator 时使用其给出的系数，并在每次成功落地后（实际游戏中只有落地后才能观察到落点）用落点偏差修正系数
+    scheduler = PressScheduler(clock=sim.clock)
+    wall_start = time.perf_counter()
+    virtual_start = sim.clock.perf_counter_ns()
+
+    jumps = 0
+    while not sim.finished() and jumps < max_jumps:
+        decision_start = stage_start = time.perf_counter_ns()
+        observation = sim.observe()
+        start_position, end_position = observation.start_position, observation.end_position
+        stats.stage("observe").add(time.perf_counter_ns() - stage_start)
+
+        if vision_cfg is not None:
+            stage_start = time.perf_counter_ns()
+            frame = sim.render(vision_cfg)
+            stats.stage("render").add(time.perf_counter_ns() - stage_start)
+
+            stage_start = time.perf_counter_ns()
+            detection = detect(frame, vision_cfg)
+            stats.stage("detect").add(time.perf_counter_ns() - stage_start)
+            if detection is None:
+                stats.vision_misses += 1
+                break
+            start_position, end_position = detection.start_position, detection.end_position
+
+        stage_start = time.perf_counter_ns()
+        delta_x = end_position.x - start_position.x
+        coefficient = calibrator.coefficient_for(delta_x) if calibrator is not None else adjustment_coefficient
+        speed = speed_by_bounce_force.get(str(observation.bounce_force), speed_x_per_second) if speed_by_bounce_force else speed_x_per_second
+        press_seconds = press_seconds_for(delta_x, observation.bounce_force, coefficient, speed)
+        stats.stage("plan").add(time.perf_counter_ns() - stage_start)
+        stats.decision_seconds += (time.perf_counter_ns() - decision_start) / 1e9
+
+        stage_start = time.perf_counter_ns()
+        scheduler.hold(sim.mouse.press, sim.mouse.release, press_seconds)
+        stats.stage("press+land").add(time.perf_counter_ns() - stage_start)
+
+        outcome = sim.outcomes[-1]
+        stats.add_outcome(outcome)
+        jumps += 1
+
+        if calibrator is not None:
+            effective_coefficient = sim.effective_coefficient(press_seconds)
+            stats.coefficient_errors.append(abs(coefficient - effective_coefficient) / effective_coefficient)
+            if outcome.landed:
+                calibrator.record(delta_x, observation.bounce_force, press_seconds, outcome.offset, speed)
+
+    stats.levels += 1
+    stats.blocks += sim.current_block
+    stats.wall_seconds += time.perf_counter() - wall_start
+    stats.virtual_seconds += (sim.clock.perf_counter_ns() - virtual_start) / 1e9
+
+
+def locate_start(sim: GameSimulator, vision_cfg: Optional[VisionConfig], predicted: Point) -> Optional[Point]:
+    # 落地后确认角色的实际位置，使用识别时仅在预测位置附近的一条竖直区域内寻找角色，不识别平台
+    if vision_cfg is None:
+        return sim.observe().start_position
+
+    character = locate_character(sim.render(vision_cfg), vision_cfg, predicted.x)
+    if character is None:
+        return None
+
+    box, _ = character
+    return Point((box.left + box.right) // 2, box.bottom)
+
+
+def play_level_planned(sim: GameSimulator, adjustment_coefficient: float, stats: PlayStats, speed_x_per_second: float = 300, vision_cfg: Optional[VisionConfig] = None, max_jumps=1000, planner_cfg: Optional[PlannerConfig] = None):
+    # 与 play_level 相同地玩完一整个关卡，但每次观察（可选通过渲染画面+识别）后一次规划画面中所有可见平台的跳跃
+    # 之后每次落地仅确认角色位置，与预测一致时直接执行下一跳，偏差过大（没跳到、镜头移动）时才重新观察与规划
+    # 弹跳力由游戏决定，工具只能看到角色当前所在格子上显示的弹跳力，因此规划时之后各跳均按基础弹跳力计算，落地后按当前格子的弹跳力重新计算这一跳
+    planner = JumpPlanner(lambda delta_x: adjustment_coefficient, lambda bounce_force: speed_x_per_second)
+    pipeline = JumpPipeline(planner, planner_cfg or PlannerConfig())
+    scheduler = PressScheduler(clock=sim.clock)
+    wall_start = time.perf_counter()
+    virtual_start = sim.clock.perf_counter_ns()
+
+    jumps = 0
+    jump = None
+    while not sim.finished() and jumps < max_jumps:
+        decision_start = time.perf_counter_ns()
+
+        if jump is not None and len(pipeline) > 0:
+            stage_start = time.perf_counter_ns()
+            actual_start = locate_start(sim, vision_cfg, jump.end_position)
+            stats.stage("verify").add(time.perf_counter_ns() - stage_start)
+
+            if actual_start is None:
+                pipeline.abandon()
+            jump = pipeline.next_jump(actual_start)
+
+            bounce_force = sim.observe().bounce_force
+            if jump is not None and jump.bounce_force != bounce_force:
+                jump = planner.plan_jump(jump.start_position, jump.end_position, bounce_force)
+        else:
+            jump = None
+
+        if jump is None:
+            stage_start = time.perf_counter_ns()
+            observation = sim.observe()
+            start_position, end_position, platforms = observation.start_position, observation.end_position, observation.platforms
+            bounce_force = observation.bounce_force
+            stats.stage("observe").add(time.perf_counter_ns() - stage_start)
+
+            if vision_cfg is not None:
+                stage_start = time.perf_counter_ns()
+                frame = sim.render(vision_cfg)
+                stats.stage("render").add(time.perf_counter_ns() - stage_start)
+
+                stage_start = time.perf_counter_ns()
+                detection = detect(frame, vision_cfg)
+                stats.stage("detect").add(time.perf_counter_ns() - stage_start)
+                if detection is None:
+                    stats.vision_misses += 1
+                    break
+                start_position, end_position, platforms = detection.start_position, detection.end_position, detection.platforms
+
+            stage_start = time.perf_counter_ns()
+            targets = path_targets(start_position, platforms, pipeline.cfg.max_planned_jumps) or [end_position]
+            pipeline.load(planner.plan(start_position, targets, [bounce_force]))
+            jump = pipeline.next_jump()
+            stats.stage("plan").add(time.perf_counter_ns() - stage_start)
+
+        stats.decision_seconds += (time.perf_counter_ns() - decision_start) / 1e9
+
+        stage_start = time.perf_counter_ns()
+        scheduler.hold(sim.mouse.press, sim.mouse.release, jump.press_seconds)
+        stats.stage("press+land").add(time.perf_counter_ns() - stage_start)
+
+        stats.add_outcome(sim.outcomes[-1])
+        jumps += 1
+
+    stats.levels += 1
+    stats.blocks += sim.current_block
+    stats.wall_seconds += time.perf_counter() - wall_start
+    stats.virtual_seconds += (sim.clock.perf_counter_ns() - virtual_start) / 1e9
+    return pipeline
+
+
+def benchmark(levels=20, use_vision=False):
+    # 对比每跳都重新观察与规划、一次规划多跳两种方式的落地率与每分钟通过的格子数
+    cfg = SimulatorConfig()
+    for name, play in [("逐跳规划", play_level), ("多跳规划", play_level_planned)]:
+        stats = PlayStats()
+        for seed in range(levels):
+            cfg.seed = seed
+            pipeline = play(GameSimulator(cfg), 1.5, stats, vision_cfg=VisionConfig() if use_vision else None)
+
+        print(f"{name}: {stats.summary()}")
+        if pipeline is not None:
+            print(f"  最后一关 {pipeline.summary()}")
+
+
+if __name__ == '__main__':
+    benchmark()
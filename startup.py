@@ -0,0 +1,145 @@
+import argparse
+import io
+import math
+import os
+import re
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+from typing import List, Tuple
+
+# 从启动到显示首个提示（当前开始第 1 个格子...）的目标耗时
+TARGET_FIRST_PROMPT_SECONDS = 1.0
+
+# 入口脚本显示首个提示时输出的文字，用于在子进程的输出中判断到达的时间点
+PROMPT_TEXT = "当前开始第 1 个格子"
+
+# 作为对比的原来的版本，未指定时使用仓库历史中的第一个提交
+DEFAULT_BASELINE_REF = "root"
+
+# 以与直接运行入口脚本相同的方式调用其 main
+ENTRY_SCRIPT = """
+import sys
+sys.argv = ["mo_jie_ren.py"]
+import mo_jie_ren
+mo_jie_ren.main()
+"""
+
+# 现在显示首个提示前导入的模块
+PROMPT_IMPORTS = """
+from calibration import Calibrator
+from config import Config
+from engine import JumpEngine
+from executor import SyncJumpExecutor
+from input_backend import create_input_backend
+from press import FakeMouseController, PressScheduler
+"""
+
+
+def git(*args: str) -> str:
+    result = subprocess.run(["git", *args], capture_output=True, cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+    return result.stdout.decode("utf-8", errors="replace")
+
+
+def resolve_baseline(ref: str) -> str:
+    # 返回 ref 对应的提交，ref 为 root 时使用当前分支历史中的第一个提交；无法解析时抛出 ValueError
+    try:
+        if ref == DEFAULT_BASELINE_REF:
+            return git("rev-list", "--max-parents=0", "HEAD").split()[-1]
+        return git("rev-parse", "--verify", "--quiet", ref + "^{commit}").strip()
+    except (OSError, subprocess.CalledProcessError, IndexError):
+        raise ValueError(f"无法找到作为对比的原来的版本 {ref}，请通过 --baseline 指定一个存在的提交、分支或标签")
+
+
+def export_baseline(commit: str, directory: str):
+    # 将原来的版本的全部文件导出到 directory 中，不影响当前的工作区
+    with tarfile.open(fileobj=io.BytesIO(subprocess.run(["git", "archive", "--format=tar", commit], capture_output=True, cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout)) as tar:
+        tar.extractall(directory)
+
+
+def time_to_prompt(directory: str) -> Tuple[float, str]:
+    # 在 directory 中启动子进程运行入口脚本的 main，返回从启动到输出首个提示的耗时，以及未能到达首个提示时的最后一行输出
+    # 到达首个提示后即结束子进程，不会继续进入键盘监听
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "-c", ENTRY_SCRIPT], stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=directory, text=True, encoding="utf-8", errors="replace")
+
+    elapsed, last_line = float("nan"), ""
+    for line in process.stdout:
+        if PROMPT_TEXT in line:
+            elapsed = time.perf_counter() - start
+            break
+        if line.strip() != "":
+            last_line = line.strip()
+
+    process.kill()
+    process.stdout.close()
+    process.wait()
+    return elapsed, last_line
+
+
+def import_breakdown(statement: str, top=8) -> List[Tuple[str, int, int]]:
+    # 通过 -X importtime 统计执行 statement 时各模块的导入耗时，返回按累计耗时排序的 (模块, 自身耗时us, 累计耗时us)
+    # 解释器自身启动时导入的模块（如 site、encodings）不计入
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", statement], capture_output=True, cwd=os.path.dirname(os.path.abspath(__file__)), text=True, encoding="utf-8")
+
+    entries = []
+    for line in result.stderr.splitlines():
+        match = re.match(r"import time:\s+(\d+) \|\s+(\d+) \|(\s+)(\S+)", line)
+        if match is None:
+            continue
+
+        self_us, cumulative_us, indent, module_name = match.groups()
+        # 仅统计顶层导入，嵌套导入的耗时已包含在其累计耗时中
+        if len(indent) <= 2 and module_name not in sys.modules:
+            entries.append((module_name, int(self_us), int(cumulative_us)))
+
+    entries.sort(key=lambda entry: entry[2], reverse=True)
+    return entries[:top]
+
+
+def benchmark(baseline_ref=DEFAULT_BASELINE_REF, runs=11):
+    # 对比原来的版本与现在的入口脚本从启动到显示首个提示的耗时（取多次运行的中位数），并列出现在导入耗时最多的模块
+    # 两者都需要 pywin32、pynput 与 wxPython，缺少时无法到达首个提示，此时仅输出失败原因，不做对比
+    baseline_commit = resolve_baseline(baseline_ref)
+    with tempfile.TemporaryDirectory() as baseline_directory:
+        export_baseline(baseline_commit, baseline_directory)
+        candidates = [(f"原来的入口脚本({baseline_commit[:7]})", baseline_directory), ("现在的入口脚本", os.path.dirname(os.path.abspath(__file__)))]
+
+        for name, directory in candidates:
+            results = [time_to_prompt(directory) for _ in range(runs)]
+            timings = sorted(elapsed for elapsed, _ in results if not math.isnan(elapsed))
+            if len(timings) == 0:
+                print(f"{name}: 未能到达首个提示，无法在当前环境中统计，最后的输出为: {results[0][1]}")
+                continue
+
+            median = timings[len(timings) // 2]
+            status = "达标" if median <= TARGET_FIRST_PROMPT_SECONDS else "超出目标"
+            print(f"{name}: 到显示首个提示耗时 中位数={median:.3f}秒 最小={timings[0]:.3f}秒 最大={timings[-1]:.3f}秒 成功 {len(timings)}/{runs} 次 (目标 {TARGET_FIRST_PROMPT_SECONDS}秒，{status})")
+
+    for title, statement in [
+        ("入口脚本 mo_jie_ren 模块加载时", "import mo_jie_ren"),
+        ("现在显示首个提示前", "import mo_jie_ren\n" + PROMPT_IMPORTS),
+    ]:
+        print(f"{title}导入耗时最多的模块:")
+        for module_name, self_us, cumulative_us in import_breakdown(statement):
+            print(f"  {module_name:<20} 累计 {cumulative_us / 1000:>7.1f}ms 自身 {self_us / 1000:>7.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对比原来的版本与现在的入口脚本从启动到显示首个提示的耗时")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE_REF, help="作为对比的原来的版本（提交、分支或标签），默认为 root，即当前分支历史中的第一个提交")
+    parser.add_argument("--runs", type=int, default=11, help="每个版本运行的次数")
+    args = parser.parse_args()
+
+    try:
+        resolve_baseline(args.baseline)
+    except ValueError as e:
+        parser.error(str(e))
+
+    benchmark(args.baseline, args.runs)
+
+
+if __name__ == '__main__':
+    main()
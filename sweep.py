@@ -0,0 +1,220 @@
+import argparse
+import itertools
+import math
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from config import Config
+from journal import OUTCOME_LANDED, JournalReader
+from log import child_logging_args, init_child_logging
+
+# 待评估的一组参数，speeds 为 ((弹跳力, x速度), ...)
+Candidate = namedtuple('Candidate', ['adjustment_coefficient', 'speeds'])
+# 评估结果，score 为平均落点偏差（像素），越小越好
+Evaluation = namedtuple('Evaluation', ['candidate', 'score', 'landed_rate', 'jumps'])
+
+# 参与搜索的弹跳力
+BOUNCE_FORCES = [90, 100, 110]
+# 使用跳跃记录评估时，偏差不超过该像素数即视为能够落地
+JOURNAL_LANDING_TOLERANCE = 20
+
+# 每个工作进程各自持有的评估数据，由 init_worker 加载一次，避免每个任务都传输一遍
+worker_source = None
+
+
+class SimulatedSource:
+    # 在模拟器生成的关卡上逐跳评估，每一跳都从目标平台的中心重新起跳，只统计落点偏差
+    def __init__(self, levels: int, sim_cfg=None):
+        self.levels = levels
+        self.sim_cfg = sim_cfg or default_simulator_config()
+
+    def evaluate(self, candidate: Candidate) -> Evaluation:
+        from press import press_seconds_for
+        from simulator import GameSimulator
+
+        speeds = dict(candidate.speeds)
+        offsets = []
+        landed = 0
+        for seed in range(self.levels):
+            self.sim_cfg.seed = seed
+            sim = GameSimulator(self.sim_cfg)
+            while not sim.finished():
+                observation = sim.observe()
+                delta_x = observation.end_position.x - observation.start_position.x
+                press_seconds = press_seconds_for(delta_x, observation.bounce_force, candidate.adjustment_coefficient, speeds[observation.bounce_force])
+
+                outcome = sim.jump(press_seconds)
+                offsets.append(abs(outcome.offset))
+                landed += int(outcome.landed)
+                if not outcome.landed:
+                    sim.skip_block()
+
+        return Evaluation(candidate, float(np.mean(offsets)), landed / len(offsets), len(offsets))
+
+
+class JournalSource:
+    # 在跳跃记录中已知落点的跳跃上评估：由记录中的 按压时长 与 实际跳跃距离 得到游戏中每秒按压对应的距离，
+    # 再计算若使用候选参数计算按压时长，每一跳会产生的落点偏差
+    def __init__(self, path: str):
+        records = JournalReader(path).query(outcome=OUTCOME_LANDED)
+        records = records[~np.isnan(records["offset"]) & (records["requested_ns"] > 0)]
+
+        self.delta_x = np.abs(records["end_x"] - records["start_x"]).astype(np.float64)
+        traveled = self.delta_x + np.sign(records["end_x"] - records["start_x"]) * records["offset"]
+        self.distance_per_second = traveled / (records["requested_ns"] / 1e9)
+        self.bounce_force = records["bounce_force"].astype(np.float64)
+
+    def evaluate(self, candidate: Candidate) -> Evaluation:
+        if len(self.delta_x) == 0:
+            return Evaluation(candidate, float("inf"), 0.0, 0)
+
+        actual_speed = np.full(len(self.delta_x), np.nan)
+        for bounce_force, speed in candidate.speeds:
+            actual_speed[self.bounce_force == bounce_force] = speed * bounce_force / 100
+        press_seconds = candidate.adjustment_coefficient * self.delta_x / actual_speed
+        offsets = np.abs(press_seconds * self.distance_per_second - self.delta_x)
+
+        # 记录中没有平台宽度，以偏差不超过 JOURNAL_LANDING_TOLERANCE 像素的比例作为落地率
+        return Evaluation(candidate, float(np.nanmean(offsets)), float(np.mean(offsets <= JOURNAL_LANDING_TOLERANCE)), len(offsets))
+
+
+def default_simulator_config():
+    # 默认用于搜索的模拟关卡：游戏中各弹跳力下的实际速度与默认的 300 略有不同
+    from simulator import SimulatorConfig
+
+    sim_cfg = SimulatorConfig()
+    sim_cfg.game_coefficient = 1.6
+    sim_cfg.speed_x_per_second_by_bounce_force = {"90": 290, "100": 300, "110": 315}
+    sim_cfg.press_noise_seconds = 0.002
+    return sim_cfg
+
+
+def init_worker(source, logging_args: tuple):
+    global worker_source
+    init_child_logging(*logging_args)
+    worker_source = source
+
+
+def evaluate_in_worker(candidate: Candidate) -> Evaluation:
+    return worker_source.evaluate(candidate)
+
+
+def make_grid(center: Candidate, coefficient_step: float, speed_step: float, points: int, fixed_bounce_force: int) -> List[Candidate]:
+    # 以 center 为中心生成网格，fixed_bounce_force 对应的速度保持不变：
+    # 系数与速度只有比值会影响按压时长，若全部参与搜索会有无数组等价的解，因此固定其中一个弹跳力的速度作为基准
+    half = points // 2
+    offsets = [step - half for step in range(points)]
+
+    centers = dict(center.speeds)
+    free_bounce_forces = [bounce_force for bounce_force in BOUNCE_FORCES if bounce_force != fixed_bounce_force]
+
+    grid = []
+    for coefficient_offset in offsets:
+        for speed_offsets in itertools.product(offsets, repeat=len(free_bounce_forces)):
+            speeds = dict(centers)
+            for bounce_force, speed_offset in zip(free_bounce_forces, speed_offsets):
+                speeds[bounce_force] = centers[bounce_force] + speed_offset * speed_step
+            grid.append(Candidate(round(center.adjustment_coefficient + coefficient_offset * coefficient_step, 6), tuple(sorted(speeds.items()))))
+
+    return grid
+
+
+def sweep(source, initial: Candidate, workers: int, rounds=3, points=7, coefficient_step=0.1, speed_step=10.0, fixed_bounce_force=100) -> Tuple[Evaluation, int]:
+    # 自适应网格搜索：每轮在当前最优参数附近搜索一个网格，下一轮将步长减半，返回最优结果与评估的参数组数目
+    best: Optional[Evaluation] = None
+    evaluated = 0
+    center = initial
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(source, child_logging_args())) as pool:
+        for _ in range(rounds):
+            grid = make_grid(center, coefficient_step, speed_step, points, fixed_bounce_force)
+            chunksize = max(1, len(grid) // (workers * 4))
+            for evaluation in pool.map(evaluate_in_worker, grid, chunksize=chunksize):
+                if best is None or evaluation.score < best.score:
+                    best = evaluation
+
+            evaluated += len(grid)
+            center = best.candidate
+            coefficient_step /= 2
+            speed_step /= 2
+
+    return best, evaluated
+
+
+def save_profile(evaluation: Evaluation, path: str, base: Optional[Config] = None):
+    # 将最优参数写为可直接加载的配置文件
+    cfg = base or Config()
+    cfg.adjustment_coefficient = evaluation.candidate.adjustment_coefficient
+    cfg.speed_x_per_second_by_bounce_force = {str(bounce_force): speed for bounce_force, speed in evaluation.candidate.speeds}
+
+    directory = os.path.dirname(path)
+    if directory != "":
+        os.makedirs(directory, exist_ok=True)
+    cfg.save_to_json_file(path)
+
+
+def initial_candidate(cfg: Config) -> Candidate:
+    return Candidate(cfg.adjustment_coefficient, tuple((bounce_force, float(cfg.speed_for(bounce_force))) for bounce_force in BOUNCE_FORCES))
+
+
+def format_candidate(candidate: Candidate) -> str:
+    speeds = " ".join(f"弹跳力{bounce_force}={speed:.2f}" for bounce_force, speed in candidate.speeds)
+    return f"修正系数={candidate.adjustment_coefficient:.4f} x速度: {speeds}"
+
+
+def benchmark(levels=5, rounds=2, points=5):
+    # 在模拟关卡上使用不同数目的工作进程进行同样的搜索，统计耗时与加速比
+    source = SimulatedSource(levels)
+    initial = initial_candidate(Config())
+
+    baseline = None
+    worker_counts = sorted({1, 2, max(1, (os.cpu_count() or 1) // 2), os.cpu_count() or 1})
+    for workers in worker_counts:
+        start = time.perf_counter()
+        best, evaluated = sweep(source, initial, workers, rounds=rounds, points=points)
+        elapsed = time.perf_counter() - start
+        baseline = baseline or elapsed
+        print(f"工作进程数={workers}: 评估 {evaluated} 组参数耗时 {elapsed:.2f}秒 加速比={baseline / elapsed:.2f}x 最优平均偏差={best.score:.2f}px")
+
+    print(f"最优参数: {format_candidate(best.candidate)} (CPU核心数={os.cpu_count()})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线搜索修正系数与各弹跳力下的x速度，并将最优参数保存为配置文件")
+    parser.add_argument("--journal", default="", help="使用该跳跃记录文件中已知落点的跳跃进行评估，不指定时使用模拟关卡")
+    parser.add_argument("--levels", type=int, default=10, help="使用模拟关卡评估时的关卡数")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="工作进程数，默认使用全部核心")
+    parser.add_argument("--rounds", type=int, default=3, help="自适应搜索的轮数，每轮步长减半")
+    parser.add_argument("--points", type=int, default=7, help="每个参数在每轮中取值的个数")
+    parser.add_argument("--output", default="sweep_profile.json", help="最优参数保存的配置文件路径")
+    parser.add_argument("--scaling", action="store_true", help="对比不同工作进程数下的耗时")
+    args = parser.parse_args()
+
+    if args.scaling:
+        benchmark()
+        return
+
+    source = JournalSource(args.journal) if args.journal != "" else SimulatedSource(args.levels)
+    if isinstance(source, JournalSource) and len(source.delta_x) == 0:
+        parser.error(f"跳跃记录 {args.journal} 中没有已知落点的跳跃，无法评估参数，未保存配置文件")
+    initial = initial_candidate(Config())
+
+    start = time.perf_counter()
+    best, evaluated = sweep(source, initial, args.workers, rounds=args.rounds, points=args.points)
+    print(f"使用 {args.workers} 个工作进程评估 {evaluated} 组参数，耗时 {time.perf_counter() - start:.2f}秒")
+    if not math.isfinite(best.score):
+        # 如跳跃记录中的弹跳力都不在候选参数中，所有候选的偏差都无法计算
+        parser.error("所有候选参数的平均偏差都无法计算，未保存配置文件")
+    print(f"最优参数: {format_candidate(best.candidate)} 平均偏差={best.score:.2f}px 落地率={best.landed_rate:.1%} 跳跃次数={best.jumps}")
+
+    save_profile(best, args.output)
+    print(f"已保存到 {args.output}，将其复制为用户目录下的 mo_jie_ren/config.json 即可使用")
+
+
+if __name__ == '__main__':
+    main()
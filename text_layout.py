@@ -0,0 +1,236 @@
+import bisect
+import itertools
+import unicodedata
+from typing import List, Tuple
+
+# 自动换行时在被分割的行末尾增加的标记
+WRAP_MARKER = "\\n"
+
+
+class CharWidths(dict):
+    # 字符 -> 在终端中显示的宽度，首次遇到某个字符时根据 East Asian Width 计算并缓存
+    def __missing__(self, char: str) -> int:
+        width = char_width(char)
+        self[char] = width
+        return width
+
+
+def char_width(char: str) -> int:
+    # ASCII 字符（含控制字符）均按 1 计算，与原来的计算方式保持一致
+    if ord(char) < 128:
+        return 1
+
+    # 组合字符、零宽字符等不占位置
+    if unicodedata.combining(char) or unicodedata.category(char) in ("Mn", "Me", "Cf", "Cc"):
+        return 0
+
+    # 全角与宽字符（中日韩文字、全角标点、emoji 等）占两格，其余（含歧义宽度的字符）占一格
+    if unicodedata.east_asian_width(char) in ("W", "F"):
+        return 2
+
+    return 1
+
+
+char_widths = CharWidths((chr(code), 1) for code in range(128))
+
+
+def printed_width(msg: str) -> int:
+    if msg.isascii():
+        return len(msg)
+
+    return sum(map(char_widths.__getitem__, msg))
+
+
+def split_by_printed_width(msg: str, expect_width: int) -> Tuple[str, str]:
+    # 将 msg 分为显示宽度不超过 expect_width 的前半部分与剩余部分
+    if msg.isascii():
+        return msg[:expect_width], msg[expect_width:]
+
+    index = fit_index(msg, expect_width)
+    return msg[:index], msg[index:]
+
+
+def fit_index(msg: str, expect_width: int) -> int:
+    # 返回显示宽度不超过 expect_width 的最长前缀的结束位置
+    current_width = 0
+    index = 0
+    for char in msg:
+        current_width += char_widths[char]
+        if current_width > expect_width:
+            break
+        index += 1
+
+    return index
+
+
+def wrap_line(line: str, max_line_width: int, padding=WRAP_MARKER) -> List[str]:
+    # 将超过 max_line_width 的行分割为若干个符合条件的行，除最后一行外均在末尾增加 padding 来标记，整行仅扫描一遍
+    if printed_width(line) <= max_line_width:
+        return [line]
+
+    expect_width = max_line_width - printed_width(padding)
+    if line.isascii():
+        # 每个字符宽度均为 1，直接按长度切分
+        expect_width = max(expect_width, 1)
+        lines = []
+        start = 0
+        while len(line) - start > max_line_width:
+            lines.append(line[start:start + expect_width] + padding)
+            start += expect_width
+        lines.append(line[start:])
+        return lines
+
+    # prefix_widths[i] 为 line[:i + 1] 的显示宽度，每段的结束位置通过二分查找得到
+    prefix_widths = list(itertools.accumulate(map(char_widths.__getitem__, line)))
+    total_width = prefix_widths[-1]
+    lines = []
+    start, start_width = 0, 0
+    while total_width - start_width > max_line_width:
+        end = bisect.bisect_right(prefix_widths, start_width + expect_width, start)
+        # 单个字符就超过宽度时也至少分出一个字符，避免死循环
+        end = max(end, start + 1)
+
+        lines.append(line[start:end] + padding)
+        start, start_width = end, prefix_widths[end - 1]
+    lines.append(line[start:])
+    return lines
+
+
+def split_line_if_too_long(msg: str, max_line_width) -> str:
+    # 确保每行不超过指定大小，超过的行分割为若干个符合条件的行，并在末尾增加\n来标记
+    lines = []
+    for line in msg.splitlines():
+        lines.extend(wrap_line(line, max_line_width))
+
+    return "\n".join(lines)
+
+
+def get_max_line_width(msg: str) -> int:
+    line_length = 0
+    for line in msg.splitlines():
+        line_length = max(line_length, printed_width(line))
+
+    return line_length
+
+
+def padLeftRight(msg, target_size, pad_char=" ", mode="middle", need_truncate=False):
+    msg = str(msg)
+    if need_truncate:
+        msg = truncate(msg, target_size)
+    msg_len = printed_width(msg)
+    pad_left_len, pad_right_len = 0, 0
+    if msg_len < target_size:
+        total = target_size - msg_len
+        pad_left_len = total // 2
+        pad_right_len = total - pad_left_len
+
+    if mode == "middle":
+        return pad_char * pad_left_len + msg + pad_char * pad_right_len
+    elif mode == "left":
+        return msg + pad_char * (pad_left_len + pad_right_len)
+    else:
+        return pad_char * (pad_left_len + pad_right_len) + msg
+
+
+def truncate(msg, expect_width) -> str:
+    # 超过宽度时截断并在末尾增加 ...，截断后（含 ...）不超过 expect_width
+    if printed_width(msg) <= expect_width:
+        return msg
+
+    return msg[:fit_index(msg, expect_width - 3)] + "..."
+
+
+def benchmark(lines=200, line_length=4000, rounds=5):
+    # 对比原来与现在的实现处理大段多行文本（自动换行、居中填充、截断）的耗时，并检查 ASCII 与中文文本的结果完全一致
+    import random
+    import time
+
+    def legacy_printed_width(msg):
+        # 原来的实现：非 ASCII 字符一律按 2 计算，用于对比
+        return sum(1 if ord(c) < 128 else 2 for c in msg)
+
+    def legacy_split_by_printed_width(msg: str, expect_width: int) -> Tuple[str, str]:
+        if legacy_printed_width(msg) <= expect_width:
+            return msg, ""
+
+        index = 0
+        current_width = 0
+        for substr in msg:
+            current_width += legacy_printed_width(substr)
+            if current_width > expect_width:
+                break
+            index += len(substr)
+
+        return msg[:index], msg[index:]
+
+    def legacy_split_line_if_too_long(msg: str, max_line_width) -> str:
+        padding = "\\n"
+        padding_width = legacy_printed_width(padding)
+
+        result = []
+        for line in msg.splitlines():
+            while legacy_printed_width(line) > max_line_width:
+                fitted_line, line = legacy_split_by_printed_width(line, max_line_width - padding_width)
+                result.append(fitted_line + padding)
+
+            result.append(line)
+
+        return "\n".join(result)
+
+    def legacy_truncate(msg, expect_width) -> str:
+        if legacy_printed_width(msg) <= expect_width:
+            return msg
+
+        truncated = []
+        current_width = 3
+        for substr in msg:
+            current_width += legacy_printed_width(substr)
+            if current_width > expect_width:
+                truncated.append("...")
+                break
+            truncated.append(substr)
+
+        return "".join(truncated)
+
+    def legacy_pad_left_right(msg, target_size):
+        msg = legacy_truncate(str(msg), target_size)
+        total = max(target_size - legacy_printed_width(msg), 0)
+        return " " * (total // 2) + msg + " " * (total - total // 2)
+
+    rnd = random.Random(0)
+    alphabets = {
+        "ASCII": "abcdefghijklmnopqrstuvwxyz ABCDEFGHIJKLMNOPQRSTUVWXYZ 0123456789,.:/",
+        "中文": "使用说明请参考在线文档前务必确保已看过上述跳跃修正系数，。：！",
+        "中英混合": "abcdefghij klmnopqrstuvwxyz 0123456789 使用说明请参考在线文档，。",
+    }
+
+    for name, alphabet in alphabets.items():
+        msg = "\n".join("".join(rnd.choice(alphabet) for _ in range(rnd.randint(line_length // 2, line_length))) for _ in range(lines))
+        short_lines = [line[:rnd.randint(0, 120)] for line in msg.splitlines()]
+
+        results = []
+        for implementation, wrap, pad in [
+            ("原来的实现", legacy_split_line_if_too_long, legacy_pad_left_right),
+            ("现在的实现", split_line_if_too_long, lambda line, width: padLeftRight(line, width, need_truncate=True)),
+        ]:
+            start = time.perf_counter()
+            for _ in range(rounds):
+                wrapped = wrap(msg, 80)
+            wrap_seconds = (time.perf_counter() - start) / rounds
+
+            start = time.perf_counter()
+            for _ in range(rounds):
+                padded = [pad(line, 80) for line in short_lines]
+            pad_seconds = (time.perf_counter() - start) / rounds
+
+            results.append((wrapped, padded))
+            print(f"{name} {lines}行x最多{line_length}字符 {implementation}: 自动换行 {wrap_seconds * 1000:.1f}ms 填充与截断 {pad_seconds * 1000:.2f}ms")
+
+        print(f"{name} 两种实现的结果{'完全一致' if results[0] == results[1] else '不一致'}")
+
+    for text in ["café", "ｈｅｌｌｏ", "é", "😀", "①②"]:
+        print(f"{text!r}: 原来计算的宽度 {legacy_printed_width(text)} 现在计算的宽度 {printed_width(text)}")
+
+
+if __name__ == '__main__':
+    benchmark()
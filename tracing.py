@@ -0,0 +1,195 @@
+import atexit
+import datetime
+import json
+import os
+import threading
+import time
+from collections import deque, namedtuple
+from typing import Dict, List, Optional
+
+from press import Histogram
+
+# 一段耗时的记录，时间单位均为纳秒
+SpanRecord = namedtuple('SpanRecord', ['name', 'thread_id', 'start_ns', 'duration_ns'])
+
+
+class NullSpan:
+    # 未开启追踪时使用的空span，进入与退出均不做任何事
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+class Span:
+    __slots__ = ("tracer", "name", "start_ns")
+
+    def __init__(self, tracer: "Tracer", name: str):
+        self.tracer = tracer
+        self.name = name
+        self.start_ns = 0
+
+    def __enter__(self):
+        self.start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.tracer.record(self.name, self.start_ns)
+        return False
+
+
+class Tracer:
+    # 记录跳跃流程中各阶段的耗时，在内存中按阶段汇总为分布，并保留最近的 max_events 条记录用于导出为 Chrome trace 文件（chrome://tracing 或 https://ui.perfetto.dev 打开）
+    # 默认关闭，关闭时 span 直接返回共用的空span，record 与 observe 仅判断一次开关，几乎没有额外开销
+    def __init__(self, max_events=100_000):
+        self.enabled = False
+        self.max_events = max_events
+
+        self.histograms: Dict[str, Histogram] = {}
+        self.events: deque = deque(maxlen=max_events)
+        self.thread_names: Dict[int, str] = {}
+        self.lock = threading.Lock()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self.lock:
+            self.histograms = {}
+            self.events = deque(maxlen=self.max_events)
+            self.thread_names = {}
+
+    def span(self, name: str):
+        # 用法: with tracer.span("press.hold"): ...
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name)
+
+    def record(self, name: str, start_ns: int, end_ns: Optional[int] = None):
+        # 记录从 start_ns 到 end_ns（默认为当前时间）的耗时，起点可以来自其他线程，如 按键事件产生 到 开始处理 的延迟
+        if not self.enabled:
+            return
+
+        if end_ns is None:
+            end_ns = time.perf_counter_ns()
+
+        thread_id = threading.get_ident()
+        with self.lock:
+            self.histogram(name).add(end_ns - start_ns)
+            self.events.append(SpanRecord(name, thread_id, start_ns, end_ns - start_ns))
+            if thread_id not in self.thread_names:
+                self.thread_names[thread_id] = threading.current_thread().name
+
+    def observe(self, name: str, value_ns: int):
+        # 仅汇总到分布中，不产生 trace 记录，用于并非一段时间区间的数值，如 按压时长的误差
+        if not self.enabled:
+            return
+
+        with self.lock:
+            self.histogram(name).add(value_ns)
+
+    def histogram(self, name: str) -> Histogram:
+        # 调用方需持有 self.lock
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = Histogram(bucket_width_us=10)
+            self.histograms[name] = histogram
+        return histogram
+
+    def summary_lines(self) -> List[str]:
+        with self.lock:
+            histograms = sorted(self.histograms.items())
+
+        lines = [f"{'阶段':<28} {'次数':>8} {'p50':>10} {'p95':>10} {'p99':>10} {'max':>10}"]
+        for name, histogram in histograms:
+            percentiles = " ".join(f"{histogram.percentile(p):>8.1f}us" for p in [50, 95, 99, 100])
+            lines.append(f"{name:<30} {histogram.count():>8} {percentiles}")
+
+        return lines
+
+    def export_chrome_trace(self, path: str) -> int:
+        # 导出为 Chrome trace-event 格式，返回导出的记录数
+        with self.lock:
+            events = list(self.events)
+            thread_names = dict(self.thread_names)
+
+        pid = os.getpid()
+        trace_events = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": thread_id, "args": {"name": name}} for thread_id, name in thread_names.items()]
+        for event in events:
+            trace_events.append({"name": event.name, "ph": "X", "pid": pid, "tid": event.thread_id, "ts": event.start_ns / 1000, "dur": event.duration_ns / 1000})
+
+        directory = os.path.dirname(path)
+        if directory != "":
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": trace_events, "displayTimeUnit": "ms"}, f)
+
+        return len(events)
+
+
+# 全局追踪器，各模块直接使用，默认关闭
+tracer = Tracer()
+
+
+def trace_path(config_path: str) -> str:
+    # 导出的 trace 文件保存在配置文件旁边的 traces 目录中，以启动时间命名
+    time_str = datetime.datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
+    return os.path.join(os.path.dirname(config_path), "traces", f"{time_str}.json")
+
+
+def start_profiling(path: str):
+    # --profile 模式：开启追踪，退出时输出各阶段耗时的分布，并将 trace 导出到 path
+    tracer.enable()
+    atexit.register(finish_profiling, path)
+
+
+def finish_profiling(path: str):
+    for line in tracer.summary_lines():
+        print(line)
+
+    count = tracer.export_chrome_trace(path)
+    print(f"已导出 {count} 条 trace 记录到 {path}，可在 chrome://tracing 或 https://ui.perfetto.dev 中打开")
+
+
+def benchmark(calls=200_000):
+    # 统计关闭与开启追踪时，每次 span 与 record 调用的额外耗时
+    local_tracer = Tracer()
+
+    def measure(enabled: bool) -> tuple:
+        local_tracer.enabled = enabled
+
+        start = time.perf_counter_ns()
+        for _ in range(calls):
+            pass
+        empty_ns = time.perf_counter_ns() - start
+
+        start = time.perf_counter_ns()
+        for _ in range(calls):
+            with local_tracer.span("benchmark.span"):
+                pass
+        span_ns = (time.perf_counter_ns() - start - empty_ns) / calls
+
+        start = time.perf_counter_ns()
+        for _ in range(calls):
+            local_tracer.record("benchmark.record", start)
+        record_ns = (time.perf_counter_ns() - start - empty_ns) / calls
+
+        return span_ns, record_ns
+
+    for enabled in [False, True]:
+        span_ns, record_ns = measure(enabled)
+        print(f"追踪{'开启' if enabled else '关闭'}: 每次 span {span_ns:.0f}ns，每次 record {record_ns:.0f}ns")
+
+    for line in local_tracer.summary_lines():
+        print(line)
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,219 @@
+import time
+from typing import List, Optional
+
+import numpy as np
+
+from press import Histogram
+from vision import Box, Detection, Platform, VisionConfig, detect, render_synthetic_frame
+
+
+class RegionTracker:
+    # 增量跟踪角色与平台的位置
+    # 每次跳跃后角色落在上一跳的目标平台上，下一个平台通常在上一帧中就已经能看到，因此窗口从预测的落点开始，到落点之后的那个平台为止，仅在该小窗口内搜索
+    # 镜头跟随角色移动后，角色通常会回到画面中的固定位置，全画面搜索时记下这个位置，之后也在该位置附近搜索
+    # 窗口内结果置信度不够或者角色、目标平台被窗口截断时，再回退到全画面搜索
+    def __init__(self, cfg: VisionConfig):
+        self.cfg = cfg
+
+        self.last_detection: Optional[Detection] = None
+        self.last_delta_x: Optional[int] = None
+        # 镜头移动后角色在画面中的水平位置
+        self.anchor_x: Optional[int] = None
+        # 上一帧识别时搜索的范围的右边缘，此处及之后的平台可能只识别到了一部分
+        self.last_search_right = 0
+
+        self.frames = 0
+        self.hits = 0
+        self.fallbacks = 0
+        # 命中时搜索的窗口面积占整个画面的比例之和
+        self.hit_area = 0.0
+        self.frame_time = Histogram()
+
+    def reset(self):
+        self.last_detection = None
+        self.last_delta_x = None
+
+    def notify_jump(self, delta_x: int):
+        # 记录实际执行的跳跃距离，未调用时则认为角色跳到了上次识别出的目标位置
+        self.last_delta_x = delta_x
+
+    def track(self, frame: np.ndarray) -> Optional[Detection]:
+        start = time.perf_counter_ns()
+        height, width = frame.shape[:2]
+
+        regions = self.predict_regions(width, height)
+        detection = None
+        self.last_search_right = width - 1
+        for region in regions:
+            detection = detect(frame, self.cfg, region)
+            if self.is_reliable(detection, region, width, height):
+                self.last_search_right = region.right
+                self.hits += 1
+                self.hit_area += (region.right - region.left + 1) * (region.bottom - region.top + 1) / (width * height)
+                break
+
+            detection = None
+
+        if detection is None:
+            self.fallbacks += 1
+            detection = detect(frame, self.cfg)
+            if detection is not None and self.last_detection is not None and not any(region.left <= detection.start_position.x <= region.right for region in regions):
+                # 角色不在任何一个预测的窗口内，说明镜头移动了
+                self.anchor_x = detection.start_position.x
+
+        self.frames += 1
+        self.frame_time.add(time.perf_counter_ns() - start)
+
+        self.last_detection = detection
+        self.last_delta_x = None
+
+        return detection
+
+    def predict_regions(self, width: int, height: int) -> List[Box]:
+        # 依次为：预测的落点附近、镜头移动后角色的固定位置附近、角色原来的位置附近（跳跃被取消的情况）
+        last = self.last_detection
+        if last is None:
+            return []
+
+        delta_x = self.last_delta_x
+        if delta_x is None:
+            delta_x = last.end_position.x - last.start_position.x
+        landing_x = last.start_position.x + delta_x
+
+        candidates = [(landing_x, last.end_position.y, self.next_platform_right(landing_x))]
+        if self.anchor_x is not None:
+            candidates.append((self.anchor_x, last.end_position.y, None))
+        candidates.append((last.start_position.x, last.start_position.y, self.next_platform_right(last.start_position.x)))
+
+        regions = []
+        for center_x, feet_y, right in candidates:
+            region = self.predict_region(width, height, center_x, feet_y, right)
+            if region is not None and region not in regions:
+                regions.append(region)
+
+        return regions
+
+    def next_platform_right(self, center_x: int) -> Optional[int]:
+        # 上一帧中，位于 center_x 所在平台之后的第一个平台的右边缘，看不到或者被搜索范围截断时返回 None
+        platforms = sorted(self.last_detection.platforms, key=lambda platform: platform.left)
+        current_right = center_x
+        for platform in platforms:
+            if platform.left <= center_x <= platform.right:
+                current_right = platform.right
+                break
+
+        for platform in platforms:
+            if platform.left > current_right:
+                return platform.right if platform.right < self.last_search_right else None
+        return None
+
+    def predict_region(self, width: int, height: int, center_x: int, feet_y: int, right: Optional[int]) -> Optional[Box]:
+        box = self.last_detection.character_box
+        character_width, character_height = box.right - box.left, box.bottom - box.top
+
+        margin = self.cfg.track_margin
+        left = center_x - character_width // 2 - margin
+        if right is None:
+            right = center_x + self.cfg.track_max_jump_distance
+        right += margin
+        top = min(feet_y - character_height, feet_y - self.cfg.platform_search_above) - margin
+        bottom = feet_y + self.cfg.platform_search_below + margin
+
+        left, top = max(0, left), max(0, top)
+        right, bottom = min(width - 1, right), min(height - 1, bottom)
+        if left >= right or top >= bottom:
+            return None
+
+        return Box(left, top, right, bottom)
+
+    def is_reliable(self, detection: Optional[Detection], region: Box, width: int, height: int) -> bool:
+        if detection is None or detection.confidence < self.cfg.track_min_confidence:
+            return False
+
+        # 角色或目标平台贴着窗口的任意一条边（画面本身的边缘除外）时，可能只识别到了一部分
+        box = detection.character_box
+        if clipped(box.left, box.right, region.left, region.right, width) or clipped(box.top, box.bottom, region.top, region.bottom, height):
+            return False
+
+        for platform in detection.platforms:
+            if (platform.left + platform.right) // 2 != detection.end_position.x:
+                continue
+            if clipped(platform.left, platform.right, region.left, region.right, width) or (platform.top <= region.top < height - 1 and region.top > 0):
+                return False
+
+        return True
+
+    def hit_rate(self) -> float:
+        return self.hits / max(1, self.frames)
+
+    def summary(self) -> str:
+        return f"frames={self.frames} hit_rate={self.hit_rate():.1%} fallbacks={self.fallbacks} 命中时平均搜索面积={self.hit_area / max(1, self.hits):.1%} 单帧耗时 {self.frame_time.summary()}"
+
+
+def clipped(low: int, high: int, region_low: int, region_high: int, size: int) -> bool:
+    # [low, high] 是否贴着窗口在该方向上的边缘，窗口边缘与画面边缘重合时不算
+    return (low <= region_low and region_low > 0) or (high >= region_high and region_high < size - 1)
+
+
+def synthetic_frames(count: int, cfg: VisionConfig, width=1920, height=1080, seed=0) -> List[np.ndarray]:
+    # 生成一段每次落地后的画面序列，角色依次跳到下一个平台，下一个平台超出画面后镜头会整体右移
+    rng = np.random.default_rng(seed)
+
+    platforms = []
+    x = 200
+    for _ in range(count + 2):
+        platform_width = int(rng.integers(120, 260))
+        platforms.append(Platform(x, x + platform_width - 1, int(rng.integers(700, 800))))
+        x += platform_width + int(rng.integers(150, 450))
+
+    frames = []
+    camera_x = 0
+    for index in range(count):
+        current = platforms[index]
+        center = (current.left + current.right) // 2
+        if platforms[index + 1].right - camera_x >= width:
+            camera_x = center - 300
+
+        visible = [Platform(p.left - camera_x, p.right - camera_x, p.top) for p in platforms if p.right - camera_x >= 0 and p.left - camera_x < width]
+        visible = [Platform(max(0, p.left), min(width - 1, p.right), p.top) for p in visible]
+        character = Box(center - camera_x - 20, current.top - 60, center - camera_x + 19, current.top - 1)
+        frames.append(render_synthetic_frame(width, height, visible, character, cfg))
+
+    return frames
+
+
+def benchmark(frames_directory="", count=200):
+    # 在一段画面序列上对比 每次全画面搜索 与 增量跟踪 的命中率及单帧耗时
+    import glob
+    import os
+
+    from vision import load_frame
+
+    cfg = VisionConfig()
+    if frames_directory != "":
+        frames = [load_frame(path) for path in sorted(glob.glob(os.path.join(frames_directory, "*.png")))]
+    else:
+        frames = synthetic_frames(count, cfg)
+
+    full_scan_time = Histogram()
+    full_scan_results = []
+    for frame in frames:
+        start = time.perf_counter_ns()
+        full_scan_results.append(detect(frame, cfg))
+        full_scan_time.add(time.perf_counter_ns() - start)
+
+    tracker = RegionTracker(cfg)
+    mismatches = 0
+    for frame, expected in zip(frames, full_scan_results):
+        detection = tracker.track(frame)
+        if expected is not None and (detection is None or detection.end_position != expected.end_position):
+            mismatches += 1
+
+    print(f"全画面搜索: 单帧耗时 {full_scan_time.summary()}")
+    print(f"增量跟踪: {tracker.summary()} 与全画面搜索结果不一致的帧数={mismatches}")
+
+
+if __name__ == '__main__':
+    import sys
+
+    benchmark(sys.argv[1] if len(sys.argv) > 1 else "")
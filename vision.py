@@ -0,0 +1,306 @@
+from __future__ import annotations
+
+import time
+from collections import namedtuple
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from data_struct import ConfigInterface
+from draw import Point
+
+# 矩形区域，right/bottom 为闭区间
+Box = namedtuple('Box', ['left', 'top', 'right', 'bottom'])
+# 平台的水平范围及顶部所在行
+Platform = namedtuple('Platform', ['left', 'right', 'top'])
+# 一帧画面的识别结果，start_position 为角色脚下的位置，end_position 为下一个平台顶部中心
+Detection = namedtuple('Detection', ['start_position', 'end_position', 'confidence', 'character_box', 'platforms'])
+
+
+class VisionConfig(ConfigInterface):
+    def __init__(self):
+        # 颜色均按照画面的通道顺序（RGB）填写，需要根据实际游戏画面自行调整
+        self.character_color = [250, 60, 60]
+        self.character_color_tolerance = 40
+        # 角色在画面中至少需要的像素数（按原始分辨率计算），低于此值则认为没有找到
+        self.min_character_pixels = 400
+        # 可选的角色模板图片路径，设置后会在粗略定位的基础上通过模板匹配进一步校准角色位置
+        self.character_template_path = ""
+
+        self.platform_color = [120, 80, 40]
+        self.platform_color_tolerance = 40
+        # 在角色脚下所在行的上下多少像素范围内寻找平台
+        self.platform_search_above = 200
+        self.platform_search_below = 120
+        # 某一列至少有多少行是平台颜色，才认为这一列属于平台
+        self.min_platform_rows = 3
+        # 平台的最小宽度，以及平台内部允许的最大空隙（如纹理导致的缺口）
+        self.min_platform_width = 20
+        self.max_platform_gap = 4
+
+        # 粗略定位角色时的下采样步长
+        self.coarse_step = 4
+
+        # 增量跟踪时，在预测的角色位置周围额外搜索的像素范围
+        self.track_margin = 60
+        # 增量跟踪时，上一帧中看不到落点之后的平台（或镜头移动后）时，在角色右侧搜索下一个平台的最大距离
+        self.track_max_jump_distance = 800
+        # 增量跟踪结果低于该置信度时，回退到全画面搜索
+        self.track_min_confidence = 0.8
+        # 多跳规划中每次落地后确认角色位置时，仅在预测位置左右各这么多像素的竖直区域内寻找角色，不识别平台
+        self.locate_margin = 100
+
+        # 是否在单独的进程中截图与识别，避免识别占用GIL影响按压计时
+        self.use_worker_process = True
+
+
+def load_frame(filepath: str) -> np.ndarray:
+    # 读取保存的截图，返回 HxWx3 的 RGB uint8 数组
+    from PIL import Image
+
+    with Image.open(filepath) as image:
+        return np.asarray(image.convert("RGB"))
+
+
+def save_frame(filepath: str, frame: np.ndarray):
+    from PIL import Image
+
+    Image.fromarray(np.ascontiguousarray(frame[..., :3])).save(filepath)
+
+
+def color_mask(frame: np.ndarray, color, tolerance: int) -> np.ndarray:
+    # 每个通道与目标颜色的差值都不超过 tolerance 的像素
+    # 利用uint8减法的回绕，(value - low) <= (high - low) 即等价于 low <= value <= high，避免转换为更宽的类型
+    mask = None
+    for channel in range(3):
+        low, high = max(0, int(color[channel]) - tolerance), min(255, int(color[channel]) + tolerance)
+        channel_mask = (frame[..., channel] - np.uint8(low)) <= np.uint8(high - low)
+        mask = channel_mask if mask is None else (mask & channel_mask)
+
+    return mask
+
+
+def mask_box(mask: np.ndarray) -> Optional[Box]:
+    # 通过行列投影计算mask的外接矩形
+    cols = np.flatnonzero(mask.any(axis=0))
+    if len(cols) == 0:
+        return None
+    rows = np.flatnonzero(mask.any(axis=1))
+
+    return Box(int(cols[0]), int(rows[0]), int(cols[-1]), int(rows[-1]))
+
+
+def find_runs(flags: np.ndarray, min_length: int, max_gap: int) -> List[Tuple[int, int]]:
+    # 找出一维布尔数组中连续为True的区间，间隔不超过 max_gap 的区间会被合并，返回 [(起始下标, 结束下标)]，均为闭区间
+    padded = np.concatenate(([False], flags, [False]))
+    changes = np.flatnonzero(padded[1:] != padded[:-1])
+    starts, ends = changes[0::2], changes[1::2] - 1
+
+    runs: List[Tuple[int, int]] = []
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        if runs and start - runs[-1][1] - 1 <= max_gap:
+            runs[-1] = (runs[-1][0], end)
+        else:
+            runs.append((start, end))
+
+    return [(start, end) for start, end in runs if end - start + 1 >= min_length]
+
+
+def match_template(image: np.ndarray, template: np.ndarray) -> Tuple[Point, float]:
+    # 基于FFT计算模板在灰度图中各位置的平方差，返回最匹配位置的左上角坐标以及 0~1 的匹配得分
+    image = image.astype(np.float32)
+    template = template.astype(np.float32)
+    th, tw = template.shape
+    ih, iw = image.shape
+    if th > ih or tw > iw:
+        return Point(0, 0), 0.0
+
+    # sum((I - T)^2) = sum(I^2) - 2 * sum(I * T) + sum(T^2)
+    shape = (ih + th - 1, iw + tw - 1)
+    correlation = np.fft.irfft2(np.fft.rfft2(image, shape) * np.fft.rfft2(template[::-1, ::-1], shape), shape)
+    correlation = correlation[th - 1:ih, tw - 1:iw]
+
+    squared = np.pad(image * image, ((1, 0), (1, 0))).cumsum(axis=0).cumsum(axis=1)
+    window_squared = squared[th:, tw:] - squared[:-th, tw:] - squared[th:, :-tw] + squared[:-th, :-tw]
+
+    ssd = window_squared - 2 * correlation + (template * template).sum()
+    y, x = np.unravel_index(int(np.argmin(ssd)), ssd.shape)
+
+    score = 1.0 - min(1.0, max(0.0, float(ssd[y, x])) / (th * tw * 255.0 * 255.0))
+    return Point(int(x), int(y)), score
+
+
+def to_gray(frame: np.ndarray) -> np.ndarray:
+    return frame[..., :3].astype(np.float32) @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+
+_template_cache = {}
+
+
+def load_template(filepath: str) -> np.ndarray:
+    if filepath not in _template_cache:
+        _template_cache[filepath] = to_gray(load_frame(filepath))
+
+    return _template_cache[filepath]
+
+
+def find_character(frame: np.ndarray, cfg: VisionConfig) -> Optional[Tuple[Box, float]]:
+    # 先在下采样后的画面中粗略定位角色，再在原始分辨率的局部区域中精确计算外接矩形
+    step = max(1, cfg.coarse_step)
+    coarse = mask_box(color_mask(frame[::step, ::step], cfg.character_color, cfg.character_color_tolerance))
+    if coarse is None:
+        return None
+
+    height, width = frame.shape[:2]
+    left, top = max(0, (coarse.left - 1) * step), max(0, (coarse.top - 1) * step)
+    right, bottom = min(width - 1, (coarse.right + 1) * step), min(height - 1, (coarse.bottom + 1) * step)
+
+    mask = color_mask(frame[top:bottom + 1, left:right + 1], cfg.character_color, cfg.character_color_tolerance)
+    box = mask_box(mask)
+    if box is None:
+        return None
+    box = Box(box.left + left, box.top + top, box.right + left, box.bottom + top)
+
+    confidence = min(1.0, int(mask.sum()) / max(1, cfg.min_character_pixels))
+
+    if cfg.character_template_path != "":
+        template = load_template(cfg.character_template_path)
+        th, tw = template.shape
+        margin = step * 2
+        region_left, region_top = max(0, box.left - margin), max(0, box.top - margin)
+        region = frame[region_top:min(height, box.bottom + margin + 1), region_left:min(width, box.right + margin + 1)]
+        position, score = match_template(to_gray(region), template)
+        box = Box(region_left + position.x, region_top + position.y, region_left + position.x + tw - 1, region_top + position.y + th - 1)
+        confidence = min(confidence, score)
+
+    return box, confidence
+
+
+def locate_character(frame: np.ndarray, cfg: VisionConfig, center_x: int) -> Optional[Tuple[Box, float]]:
+    # 仅在 center_x 附近的竖直区域内寻找角色，返回的坐标为整个画面中的坐标
+    left = max(0, center_x - cfg.locate_margin)
+    right = min(frame.shape[1], center_x + cfg.locate_margin + 1)
+    if left >= right:
+        return None
+
+    character = find_character(frame[:, left:right], cfg)
+    if character is None:
+        return None
+
+    box, confidence = character
+    return Box(box.left + left, box.top, box.right + left, box.bottom), confidence
+
+
+def find_platforms(frame: np.ndarray, cfg: VisionConfig, top: int, bottom: int) -> List[Platform]:
+    # 在 [top, bottom] 的水平带中，按列投影平台颜色的像素数，连续的平台列组成一个平台
+    height = frame.shape[0]
+    top, bottom = max(0, top), min(height - 1, bottom)
+    if top > bottom:
+        return []
+
+    band = color_mask(frame[top:bottom + 1], cfg.platform_color, cfg.platform_color_tolerance)
+    columns = band.sum(axis=0) >= cfg.min_platform_rows
+
+    platforms = []
+    for left, right in find_runs(columns, cfg.min_platform_width, cfg.max_platform_gap):
+        rows = np.flatnonzero(band[:, left:right + 1].mean(axis=1) >= 0.5)
+        if len(rows) == 0:
+            continue
+        platforms.append(Platform(left, right, top + int(rows[0])))
+
+    return platforms
+
+
+def detect(frame: np.ndarray, cfg: VisionConfig, region: Optional[Box] = None) -> Optional[Detection]:
+    # 定位角色与下一个平台，返回可直接用于计算按压时长的起点与终点
+    # 若指定了region，则仅在该区域内搜索，返回的坐标仍为整个画面中的坐标
+    if region is not None:
+        detection = detect(frame[region.top:region.bottom + 1, region.left:region.right + 1], cfg)
+        if detection is None:
+            return None
+        return offset_detection(detection, region.left, region.top)
+
+    character = find_character(frame, cfg)
+    if character is None:
+        return None
+    box, character_confidence = character
+
+    feet_y = box.bottom
+    center_x = (box.left + box.right) // 2
+    platforms = find_platforms(frame, cfg, feet_y - cfg.platform_search_above, feet_y + cfg.platform_search_below)
+
+    # 角色当前所在平台之后的第一个平台即为目标
+    current_right = box.right
+    for platform in platforms:
+        if platform.left <= center_x <= platform.right:
+            current_right = max(current_right, platform.right)
+            break
+
+    for platform in platforms:
+        if platform.left > current_right:
+            target = Point((platform.left + platform.right) // 2, platform.top)
+            platform_confidence = min(1.0, (platform.right - platform.left + 1) / max(1, cfg.min_platform_width))
+            return Detection(Point(center_x, feet_y), target, character_confidence * platform_confidence, box, platforms)
+
+    return None
+
+
+def offset_detection(detection: Detection, dx: int, dy: int) -> Detection:
+    box = detection.character_box
+    return Detection(
+        Point(detection.start_position.x + dx, detection.start_position.y + dy),
+        Point(detection.end_position.x + dx, detection.end_position.y + dy),
+        detection.confidence,
+        Box(box.left + dx, box.top + dy, box.right + dx, box.bottom + dy),
+        [Platform(platform.left + dx, platform.right + dx, platform.top + dy) for platform in detection.platforms],
+    )
+
+
+def render_synthetic_frame(width: int, height: int, platforms: List[Platform], character_box: Box, cfg: VisionConfig, noise=0, seed=0) -> np.ndarray:
+    # 生成一帧用于测试的画面：纯色背景 + 平台 + 角色
+    frame = np.empty((height, width, 3), dtype=np.uint8)
+    frame[:] = (40, 40, 70)
+
+    for platform in platforms:
+        frame[platform.top:, platform.left:platform.right + 1] = cfg.platform_color
+
+    frame[character_box.top:character_box.bottom + 1, character_box.left:character_box.right + 1] = cfg.character_color
+
+    if noise > 0:
+        rng = np.random.default_rng(seed)
+        frame = np.clip(frame.astype(np.int16) + rng.integers(-noise, noise + 1, frame.shape, dtype=np.int16), 0, 255).astype(np.uint8)
+
+    return frame
+
+
+def benchmark(frame_path="", rounds=100):
+    # 在1080p画面上统计单帧识别耗时，未指定截图时会生成一张测试画面并保存为PNG后再读取
+    import os
+    import tempfile
+
+    cfg = VisionConfig()
+    if frame_path == "":
+        platforms = [Platform(300, 520, 760), Platform(900, 1080, 720), Platform(1400, 1560, 780)]
+        character = Box(390, 700, 429, 759)
+        frame = render_synthetic_frame(1920, 1080, platforms, character, cfg, noise=8)
+
+        frame_path = os.path.join(tempfile.mkdtemp(), "frame.png")
+        save_frame(frame_path, frame)
+
+    frame = load_frame(frame_path)
+
+    detection = detect(frame, cfg)
+    print(f"识别结果: {detection}")
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        detect(frame, cfg)
+    cost = (time.perf_counter() - start) / rounds
+
+    print(f"{frame.shape[1]}x{frame.shape[0]} 单帧识别耗时 {cost * 1000:.2f}ms")
+
+
+if __name__ == '__main__':
+    import sys
+
+    benchmark(sys.argv[1] if len(sys.argv) > 1 else "")
@@ -0,0 +1,352 @@
+import ctypes
+import multiprocessing
+import platform
+import struct
+import threading
+import time
+from multiprocessing import shared_memory
+from typing import Optional
+
+import numpy as np
+
+from capture import CAPTURE_BACKEND_WIN32, CaptureConfig, FixedFrameRing, create_capture
+from data_struct import to_raw_type
+from draw import Point
+from log import child_logging_args, init_child_logging, logger
+from tracker import RegionTracker
+from vision import Box, Detection, Platform, VisionConfig, locate_character, offset_detection
+
+# 结果记录中最多保存的平台数目
+MAX_PLATFORMS = 16
+
+# 结果记录通过序号实现 seqlock：写入前将序号改为奇数，写完后改为偶数，读取时前后两次读到相同的偶数序号才算有效
+SEQ_STRUCT = struct.Struct("<Q")
+# request_id, found, platform_count, frame_slot, confidence, detect_ns, frame_width, frame_height, start(x,y), end(x,y), character_box(4), platforms(left, right, top) * MAX_PLATFORMS
+RESULT_STRUCT = struct.Struct("<QBBbxdqii4i4i" + "3i" * MAX_PLATFORMS)
+RESULT_SIZE = SEQ_STRUCT.size + RESULT_STRUCT.size
+
+COMMAND_DETECT = "detect"
+COMMAND_LOCATE = "locate"
+COMMAND_JUMP = "jump"
+COMMAND_STOP = "stop"
+
+
+class LocalVision:
+    # 在当前进程中截图并识别
+    def __init__(self, vision_cfg: VisionConfig, capture_cfg: CaptureConfig):
+        self.vision_cfg = vision_cfg
+        self.capture = create_capture(capture_cfg)
+        self.tracker = RegionTracker(vision_cfg)
+
+    def start(self):
+        return
+
+    def stop(self):
+        self.capture.close()
+
+    def detect(self, timeout: Optional[float] = None) -> Optional[Detection]:
+        # 返回屏幕坐标下的识别结果
+        frame = self.capture.grab()
+        if frame is None:
+            return None
+
+        detection = self.tracker.track(frame)
+        if detection is None:
+            return None
+
+        return offset_detection(detection, self.capture.last_region.left, self.capture.last_region.top)
+
+    def locate(self, predicted: Point, timeout: Optional[float] = None) -> Optional[Point]:
+        # 返回屏幕坐标下预测位置附近的角色脚下的位置
+        frame = self.capture.grab()
+        if frame is None:
+            return None
+
+        detection = locate_detection(frame, self.vision_cfg, self.capture.last_region, predicted)
+        return detection.start_position if detection is not None else None
+
+    def notify_jump(self, delta_x: int):
+        self.tracker.notify_jump(delta_x)
+
+
+class VisionWorker:
+    # 在单独的进程中截图并识别，避免识别时占用GIL影响按压计时
+    # 画面写入共享内存中的环形缓冲区，识别结果写入另一块很小的共享内存，主进程仅读取结果记录
+    def __init__(self, vision_cfg: VisionConfig, capture_cfg: CaptureConfig, max_width=2560, max_height=1600):
+        self.vision_cfg = vision_cfg
+        self.capture_cfg = capture_cfg
+        self.slot_bytes = max_width * max_height * 4
+
+        self.frames_memory: Optional[shared_memory.SharedMemory] = None
+        self.result_memory: Optional[shared_memory.SharedMemory] = None
+        self.commands: Optional[multiprocessing.Queue] = None
+        self.process: Optional[multiprocessing.Process] = None
+
+        self.request_id = 0
+        # 识别进程意外退出后，改为在当前进程中截图并识别
+        self.fallback: Optional[LocalVision] = None
+
+    def start(self):
+        ring_size = max(1, self.capture_cfg.ring_size)
+        self.frames_memory = shared_memory.SharedMemory(create=True, size=ring_size * self.slot_bytes)
+        self.result_memory = shared_memory.SharedMemory(create=True, size=RESULT_SIZE)
+        self.result_memory.buf[:RESULT_SIZE] = bytes(RESULT_SIZE)
+
+        self.commands = multiprocessing.Queue()
+        self.process = multiprocessing.Process(
+            target=worker_main,
+            args=(self.commands, self.frames_memory.name, self.result_memory.name, self.slot_bytes, to_raw_type(self.vision_cfg), to_raw_type(self.capture_cfg), child_logging_args()),
+            name="VisionWorker",
+            daemon=True,
+        )
+        self.process.start()
+
+    def stop(self, timeout=2.0):
+        if self.fallback is not None:
+            self.fallback.stop()
+            self.fallback = None
+
+        if self.process is None:
+            return
+
+        self.commands.put((COMMAND_STOP,))
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process = None
+
+        for memory in [self.frames_memory, self.result_memory]:
+            memory.close()
+            memory.unlink()
+
+    def request(self, command: str, *args) -> int:
+        self.request_id += 1
+        self.commands.put((command, self.request_id, *args))
+        return self.request_id
+
+    def notify_jump(self, delta_x: int):
+        if self.fallback is not None:
+            self.fallback.notify_jump(delta_x)
+            return
+
+        self.commands.put((COMMAND_JUMP, delta_x))
+
+    def detect(self, timeout: Optional[float] = 1.0) -> Optional[Detection]:
+        if self.fallback is None:
+            result = self.wait_result(self.request(COMMAND_DETECT), timeout)
+            if self.fallback is None:
+                return unpack_detection(result) if result is not None else None
+
+        return self.fallback.detect()
+
+    def locate(self, predicted: Point, timeout: Optional[float] = 1.0) -> Optional[Point]:
+        # 识别进程仅在预测位置附近寻找角色，结果中只有角色的位置，没有平台
+        if self.fallback is None:
+            result = self.wait_result(self.request(COMMAND_LOCATE, predicted.x, predicted.y), timeout)
+            if self.fallback is None:
+                detection = unpack_detection(result) if result is not None else None
+                return detection.start_position if detection is not None else None
+
+        return self.fallback.locate(predicted)
+
+    def wait_result(self, request_id: int, timeout: Optional[float]) -> Optional[tuple]:
+        # 识别进程意外退出时改为在当前进程中截图并识别，此时设置 fallback 并返回 None，由调用方改用 fallback
+        deadline = time.perf_counter() + (timeout if timeout is not None else 3600)
+        while time.perf_counter() < deadline:
+            result = self.read_result()
+            if result is not None and result[0] == request_id:
+                return result
+
+            if not self.process.is_alive():
+                logger.warning(f"识别进程已退出(exitcode={self.process.exitcode})，之后将在当前进程中截图并识别")
+                self.fallback = LocalVision(self.vision_cfg, self.capture_cfg)
+                return None
+
+            time.sleep(0.0005)
+
+        logger.warning(f"等待识别进程返回结果超时({timeout}秒)")
+        return None
+
+    def read_result(self, max_retries=1000) -> Optional[tuple]:
+        # 识别进程正在写入时重试，写入只需几微秒；若识别进程恰好在写入过程中退出，序号会一直是奇数，重试一定次数后返回 None，由调用方检查进程状态
+        buf = self.result_memory.buf
+        for _ in range(max_retries):
+            seq_before = SEQ_STRUCT.unpack_from(buf, 0)[0]
+            if seq_before == 0:
+                return None
+            if seq_before & 1:
+                continue
+
+            result = RESULT_STRUCT.unpack_from(buf, SEQ_STRUCT.size)
+            if SEQ_STRUCT.unpack_from(buf, 0)[0] == seq_before:
+                return result
+
+        return None
+
+    def frame(self, slot: int, width: int, height: int) -> np.ndarray:
+        # 识别进程最近写入的画面（BGRA），仅用于调试
+        backing = np.ndarray((self.frames_memory.size,), dtype=np.uint8, buffer=self.frames_memory.buf)
+        start = slot * self.slot_bytes
+        return backing[start:start + width * height * 4].reshape(height, width, 4)
+
+
+def locate_detection(frame: np.ndarray, cfg: VisionConfig, region: Box, predicted: Point) -> Optional[Detection]:
+    # 在截图区域 region 的画面中寻找屏幕坐标 predicted 附近的角色，返回仅包含角色位置的屏幕坐标下的识别结果
+    character = locate_character(frame, cfg, predicted.x - region.left)
+    if character is None:
+        return None
+
+    box, confidence = character
+    position = Point((box.left + box.right) // 2, box.bottom)
+    return offset_detection(Detection(position, position, confidence, box, []), region.left, region.top)
+
+
+def pack_detection(request_id: int, detection: Optional[Detection], frame_slot: int, width: int, height: int, detect_ns: int) -> tuple:
+    platforms = [0, 0, 0] * MAX_PLATFORMS
+    if detection is None:
+        return (request_id, 0, 0, frame_slot, 0.0, detect_ns, width, height, 0, 0, 0, 0, 0, 0, 0, 0, *platforms)
+
+    for index, platform in enumerate(detection.platforms[:MAX_PLATFORMS]):
+        platforms[index * 3:index * 3 + 3] = [platform.left, platform.right, platform.top]
+
+    return (
+        request_id, 1, min(MAX_PLATFORMS, len(detection.platforms)), frame_slot, detection.confidence, detect_ns, width, height,
+        *detection.start_position, *detection.end_position, *detection.character_box, *platforms,
+    )
+
+
+def unpack_detection(result: tuple) -> Optional[Detection]:
+    if result[1] == 0:
+        return None
+
+    platform_count = result[2]
+    values = result[8:]
+    platforms = [Platform(*values[8 + index * 3:11 + index * 3]) for index in range(platform_count)]
+    return Detection(Point(values[0], values[1]), Point(values[2], values[3]), result[4], Box(*values[4:8]), platforms)
+
+
+def publish(buf, seq: int, values: tuple):
+    SEQ_STRUCT.pack_into(buf, 0, seq * 2 + 1)
+    RESULT_STRUCT.pack_into(buf, SEQ_STRUCT.size, *values)
+    SEQ_STRUCT.pack_into(buf, 0, seq * 2 + 2)
+
+
+def worker_main(commands: multiprocessing.Queue, frames_memory_name: str, result_memory_name: str, slot_bytes: int, raw_vision_cfg: dict, raw_capture_cfg: dict, logging_args: tuple):
+    init_child_logging(*logging_args)
+
+    vision_cfg = VisionConfig().auto_update_config(raw_vision_cfg)
+    capture_cfg = CaptureConfig().auto_update_config(raw_capture_cfg)
+
+    if capture_cfg.backend == CAPTURE_BACKEND_WIN32 and platform.system() == "Windows":
+        # 与主进程一样，确保截图使用的是物理屏幕坐标
+        PROCESS_PER_MONITOR_DPI_AWARE = 2
+        ctypes.windll.shcore.SetProcessDpiAwareness(PROCESS_PER_MONITOR_DPI_AWARE)
+
+    frames_memory = shared_memory.SharedMemory(name=frames_memory_name)
+    result_memory = shared_memory.SharedMemory(name=result_memory_name)
+
+    backing = np.ndarray((frames_memory.size,), dtype=np.uint8, buffer=frames_memory.buf)
+    ring = FixedFrameRing(max(1, capture_cfg.ring_size), backing, slot_bytes)
+    capture = create_capture(capture_cfg, ring)
+    tracker = RegionTracker(vision_cfg)
+
+    seq = 0
+    try:
+        while True:
+            command = commands.get()
+            if command[0] == COMMAND_STOP:
+                break
+            elif command[0] == COMMAND_JUMP:
+                tracker.notify_jump(command[1])
+            elif command[0] == COMMAND_DETECT:
+                start = time.perf_counter_ns()
+
+                detection = None
+                width, height = 0, 0
+                frame = capture.grab()
+                if frame is not None:
+                    height, width = frame.shape[:2]
+                    detection = tracker.track(frame)
+                    if detection is not None:
+                        detection = offset_detection(detection, capture.last_region.left, capture.last_region.top)
+
+                seq += 1
+                publish(result_memory.buf, seq, pack_detection(command[1], detection, ring.last_slot, width, height, time.perf_counter_ns() - start))
+            elif command[0] == COMMAND_LOCATE:
+                start = time.perf_counter_ns()
+
+                detection = None
+                width, height = 0, 0
+                frame = capture.grab()
+                if frame is not None:
+                    height, width = frame.shape[:2]
+                    detection = locate_detection(frame, vision_cfg, capture.last_region, Point(command[2], command[3]))
+
+                seq += 1
+                publish(result_memory.buf, seq, pack_detection(command[1], detection, ring.last_slot, width, height, time.perf_counter_ns() - start))
+    finally:
+        capture.close()
+        del backing, ring, capture
+        frames_memory.close()
+        result_memory.close()
+
+
+def create_vision(vision_cfg: VisionConfig, capture_cfg: CaptureConfig):
+    if vision_cfg.use_worker_process:
+        return VisionWorker(vision_cfg, capture_cfg)
+
+    return LocalVision(vision_cfg, capture_cfg)
+
+
+def benchmark(presses=300, min_seconds=0.005, max_seconds=0.02):
+    # 对比 无识别负载、同进程内持续识别、识别进程中持续识别 三种情况下的按压计时误差分布
+    import os
+    import random
+    import tempfile
+
+    from capture import CAPTURE_BACKEND_REPLAY, rgb_to_bgra
+    from press import FakeMouseController, PressScheduler
+    from tracker import synthetic_frames
+
+    vision_cfg = VisionConfig()
+    capture_cfg = CaptureConfig()
+    capture_cfg.backend = CAPTURE_BACKEND_REPLAY
+    capture_cfg.replay_directory = tempfile.mkdtemp()
+    for index, frame in enumerate(synthetic_frames(10, vision_cfg)):
+        np.save(os.path.join(capture_cfg.replay_directory, f"{index:04d}.npy"), rgb_to_bgra(frame))
+
+    def measure_presses() -> str:
+        rnd = random.Random(0)
+        scheduler = PressScheduler()
+        fake_mouse = FakeMouseController()
+        for _ in range(presses):
+            scheduler.hold(fake_mouse.press, fake_mouse.release, rnd.uniform(min_seconds, max_seconds))
+        return scheduler.error_histogram.summary()
+
+    def run_with_load(vision) -> str:
+        vision.start()
+        stop_event = threading.Event()
+        detections = []
+
+        def load():
+            while not stop_event.is_set():
+                detections.append(vision.detect())
+
+        thread = threading.Thread(target=load, daemon=True)
+        thread.start()
+        time.sleep(0.2)
+
+        summary = measure_presses()
+
+        stop_event.set()
+        thread.join()
+        vision.stop()
+        return f"{summary} 期间识别次数={len(detections)}"
+
+    print(f"无识别负载: {measure_presses()}")
+    print(f"同进程内持续识别: {run_with_load(LocalVision(vision_cfg, capture_cfg))}")
+    print(f"识别进程中持续识别: {run_with_load(VisionWorker(vision_cfg, capture_cfg))}")
+
+
+if __name__ == '__main__':
+    benchmark()